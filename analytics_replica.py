@@ -0,0 +1,340 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import cost_guard
+import metrics
+import query_validator
+import result_cache
+import schema_catalog
+
+# Optional local copy of the loaded SQL datasets in DuckDB, an in-process
+# columnar engine, for read-only analytics. load_sqldb.py --replica fills it
+# from the same CSVs as the server, one DuckDB schema per MySQL database,
+# and refreshes it whenever it loads tables into the server. Plain SELECTs
+# (and WITH ... SELECT) whose tables are all in the replica run there; writes,
+# DDL, locking reads and anything the replica cannot run go to the server.
+# Every copy records the server's UPDATE_TIME of its table when it was made,
+# and a read stays on the server once the server reports a different one:
+# a table written since, by anyone, is read from the server until the loader
+# copies it again. The versions are asked for at most every
+# REPLICA_VERSION_TTL seconds, and UPDATE_TIME only counts whole seconds, so
+# a write by another client shows up to about a second late (writes through
+# this process are seen at once).
+
+REPLICA_ROUTING = True  # False sends every query to the server again
+REPLICA_PATH = os.environ.get("CHATDB_REPLICA", os.path.join(".schema_cache", "replica.duckdb"))
+REPLICA_SOURCES_TABLE = "_replica_sources"  # table, CSV hash, load time and server version of every replica table
+REPLICA_CATALOG = "replica"  # name the replica is attached under in the interface
+REPLICA_VERSION_TTL = 1.0  # seconds the server's table versions are reused for
+REPLICA_TRANSLATION_CACHE_SIZE = 256  # DuckDB forms of reads kept, keyed by database and normalized SQL
+# Fields read as NULL; the loaders read the CSVs with pandas, which treats these as missing
+REPLICA_NULL_STRINGS = ["", "NULL", "null", "NA", "N/A", "NaN", "nan", "None", "#N/A"]
+
+_duckdb = None  # the duckdb module once imported, False when not installed
+_replica = {"connection": None, "signature": None, "tables": {}}  # tables: (database, table) -> (loaded_at, server version)
+# (database, table) -> time of the last write to it through this process;
+# (database, None) stands for every table of database and None for all
+_written = {}
+_versions = {}  # (database, table) -> (checked_at, server version), see REPLICA_VERSION_TTL
+_translations = OrderedDict()  # (database, normalized SQL) -> (DuckDB SQL, tables) or (None, None)
+_lock = threading.Lock()
+
+
+# duckdb, or None when it is not installed (every query then goes to the
+# server). Imported when first needed, like sqlglot.
+def load_duckdb():
+    global _duckdb
+    if _duckdb is None:
+        try:
+            import duckdb
+        except ImportError:
+            duckdb = False
+        _duckdb = duckdb
+    return _duckdb or None
+
+
+def _sources(connection):
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS {REPLICA_SOURCES_TABLE} (database VARCHAR, table_name VARCHAR, "
+        "sha256 VARCHAR, schema_sql VARCHAR, row_count BIGINT, loaded_at DOUBLE, PRIMARY KEY (database, table_name))"
+    )
+    connection.execute(f"ALTER TABLE {REPLICA_SOURCES_TABLE} ADD COLUMN IF NOT EXISTS server_version VARCHAR")
+    rows = connection.execute(f"SELECT database, table_name, sha256, schema_sql FROM {REPLICA_SOURCES_TABLE}")
+    return {(database, name): (sha256, schema_sql) for database, name, sha256, schema_sql in rows.fetchall()}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _mysql_string(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+# Replace one replica table with the CSV's rows, typed as csv_schema types
+# them for MySQL. Returns the number of rows loaded.
+def load_table(connection, database, table):
+    name = f"{_quote(database)}.{_quote(table['table'])}"
+    columns = ", ".join(f"{_quote(column['name'])}: '{column['type']}'" for column in table["columns"])
+    connection.execute(
+        f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM read_csv(?, header = true, quote = '\"', escape = '\"', "
+        f"nullstr = ?, columns = {{{columns}}})",
+        [os.path.abspath(table["path"]), REPLICA_NULL_STRINGS],
+    )
+    return connection.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+
+# The server's UPDATE_TIME of each (database, table) pair, as a string (None
+# while the server has none, as after a restart), through execute(sql) ->
+# cursor on a MySQL connection with information_schema_stats_expiry = 0 (see
+# connection_manager.MySQLPool). Tables the server does not have are left out.
+def server_versions(execute, tables):
+    tables = sorted({(database.lower(), name.lower()) for database, name in tables})
+    if not tables:
+        return {}
+    pairs = ", ".join(f"({_mysql_string(database)}, {_mysql_string(name)})" for database, name in tables)
+    cursor = execute("SELECT LOWER(TABLE_SCHEMA), LOWER(TABLE_NAME), UPDATE_TIME FROM information_schema.TABLES "
+                     f"WHERE (LOWER(TABLE_SCHEMA), LOWER(TABLE_NAME)) IN ({pairs})")
+    return {(database, name): None if updated_at is None else str(updated_at)
+            for database, name, updated_at in cursor.fetchall()}
+
+
+# Bring the replica's copy of database up to date with tables (csv_schema
+# tables, as the loader loaded them into the server). Every table is copied
+# again except those named in keep, which stay as they are if their CSV and
+# schema did not change since they were last copied. versions holds the
+# server's version of each copied table (see server_versions); tables named
+# in drop, such as those that failed to load into the server, are removed.
+# The replica is rewritten in a copy that replaces it when done, so running
+# interfaces keep reading the old one until then. Returns {table: rows
+# loaded, or None when kept}.
+def refresh(database, tables, path=None, keep=(), versions=None, drop=()):
+    # Only the loaders refresh; pandas stays out of the interface's startup
+    import csv_schema
+    import csv_sync
+
+    duckdb = load_duckdb()
+    if duckdb is None:
+        raise RuntimeError("the analytical replica needs duckdb (pip install duckdb)")
+    path = path or REPLICA_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    staging = path + ".tmp"
+    if os.path.exists(staging):
+        os.remove(staging)
+    if os.path.exists(path):
+        shutil.copyfile(path, staging)
+    results = {}
+    connection = duckdb.connect(staging)
+    try:
+        sources = _sources(connection)
+        connection.execute(f"CREATE SCHEMA IF NOT EXISTS {_quote(database)}")
+        for table in tables:
+            name = table["table"]
+            sha256 = csv_sync.file_hash(table["path"])
+            schema = csv_schema.create_table_sql(table)
+            if name in keep and sources.get((database, name)) == (sha256, schema):
+                results[name] = None
+                continue
+            rows = load_table(connection, database, table)
+            version = (versions or {}).get((database.lower(), name.lower()))
+            connection.execute(
+                f"INSERT OR REPLACE INTO {REPLICA_SOURCES_TABLE} (database, table_name, sha256, schema_sql, row_count, "
+                "loaded_at, server_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [database, name, sha256, schema, rows, time.time(), version],
+            )
+            results[name] = rows
+        for name in drop:
+            connection.execute(f"DROP TABLE IF EXISTS {_quote(database)}.{_quote(name)}")
+            connection.execute(f"DELETE FROM {REPLICA_SOURCES_TABLE} WHERE database = ? AND table_name = ?",
+                               [database, name])
+    finally:
+        connection.close()
+    os.replace(staging, path)
+    return results
+
+
+# A cursor on the replica, reopened when the loader has replaced the file;
+# None without a replica. Also returns {(database, table): (loaded_at,
+# server version)}.
+def _connect():
+    try:
+        stat = os.stat(REPLICA_PATH)
+    except OSError:
+        return None, {}
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if _replica["signature"] != signature:
+            duckdb = load_duckdb()
+            if duckdb is None:
+                return None, {}
+            # Attached to a new in-memory database: duckdb.connect(path) would
+            # hand back the instance still open on the replaced file. Reads in
+            # progress finish on the old file.
+            connection = duckdb.connect()
+            path = REPLICA_PATH.replace("'", "''")
+            try:
+                connection.execute(f"ATTACH '{path}' AS {REPLICA_CATALOG} (READ_ONLY)")
+                rows = connection.execute(
+                    f"SELECT database, table_name, loaded_at, server_version "
+                    f"FROM {REPLICA_CATALOG}.main.{REPLICA_SOURCES_TABLE}"
+                ).fetchall()
+            except duckdb.Error as e:
+                print(f"Analytical replica {REPLICA_PATH} is unusable, reading from the server: {e}")
+                _replica.update(connection=None, signature=signature, tables={})
+                return None, {}
+            # MySQL's default collation compares strings without case
+            connection.execute("SET default_collation = 'nocase'")
+            tables = {(database.lower(), name.lower()): (loaded_at, version)
+                      for database, name, loaded_at, version in rows}
+            _replica.update(connection=connection, signature=signature, tables=tables)
+        if _replica["connection"] is None:
+            return None, {}
+        return _replica["connection"].cursor(), _replica["tables"]
+
+
+# Whether the replica's copy of a table is at least as new as the last write
+# to it through this process (the server is asked about other writes)
+def _fresh(tables, database, name):
+    if (database, name) not in tables:
+        return False
+    loaded_at = tables[(database, name)][0]
+    with _lock:
+        written_at = max(_written.get((database, name), 0), _written.get((database, None), 0),
+                         _written.get(None, 0))
+    return loaded_at > written_at
+
+
+# The DuckDB form of a MySQL read and the (database, table) pairs it reads.
+# Tables are qualified with the replica and their database, and LIKE is made
+# case-insensitive as in MySQL. (None, None) when it is not a plain read.
+def _translate(query, database):
+    sqlglot = query_validator.load_sqlglot()
+    if sqlglot is None:
+        return None, None
+    exp = sqlglot.exp
+    try:
+        tree = sqlglot.parse_one(query, read="mysql")
+    except sqlglot.errors.ParseError:
+        return None, None
+    if not isinstance(tree, exp.Query):
+        return None, None
+    derived = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    tables = set()
+    for table in tree.find_all(exp.Table):
+        if table.name in derived and not table.db:
+            continue
+        if not table.name:
+            return None, None
+        table_database = (table.db or database).lower()
+        tables.add((table_database, table.name.lower()))
+        table.set("db", exp.to_identifier(table_database))
+        table.set("catalog", exp.to_identifier(REPLICA_CATALOG))
+    tree = tree.transform(lambda node: exp.ILike(this=node.this, expression=node.expression)
+                          if isinstance(node, exp.Like) else node)
+    try:
+        return tree.sql(dialect="duckdb"), tables
+    except sqlglot.errors.SqlglotError:
+        return None, None
+
+
+# The DuckDB form of a read (see _translate) and the tables it reads, or
+# (None, None) when it is not a plain read or names a table the replica does
+# not have or this process wrote since. Translations are cached, as parsing
+# takes longer than most reads on the replica.
+def translate(query, database, tables):
+    key = (database.lower(), result_cache.normalize_sql(query))
+    with _lock:
+        translation = _translations.get(key)
+        if translation is not None:
+            _translations.move_to_end(key)
+    if translation is None:
+        translation = _translate(query, database)
+        with _lock:
+            _translations[key] = translation
+            while len(_translations) > REPLICA_TRANSLATION_CACHE_SIZE:
+                _translations.popitem(last=False)
+    sql, names = translation
+    if sql is None or not all(_fresh(tables, table_database, name) for table_database, name in names):
+        return None, None
+    return sql, names
+
+
+# Whether the server reports the same version of every table as when it was
+# copied. Versions asked for less than REPLICA_VERSION_TTL seconds ago are
+# reused. Without an answer the read goes to the server.
+def _current(names, tables, server):
+    now = time.monotonic()
+    with _lock:
+        known = {name: _versions[name] for name in names if name in _versions}
+    expired = [name for name in names if name not in known or now - known[name][0] >= REPLICA_VERSION_TTL]
+    if expired:
+        try:
+            versions = server_versions(server, expired)
+        except Exception:
+            return False
+        with _lock:
+            for name in expired:
+                # Tables the server does not have are remembered as missing
+                _versions[name] = known[name] = (now, versions.get(name, False))
+    return all(known[name][1] is not False and known[name][1] == tables[name][1] for name in names)
+
+
+# Run a read on the replica. server is execute(sql) -> cursor on the MySQL
+# server, used to check that the tables did not change there since they were
+# copied (None trusts the copy, for benchmarks). Returns a cursor, or None
+# when the query has to go to the server: no replica, not a plain read, a
+# table missing or changed since it was copied, or an error in DuckDB.
+def execute(query, database, server=None):
+    if not REPLICA_ROUTING or not database:
+        return None
+    if not cost_guard.SQL_READ.match(query) or result_cache.SQL_UNCACHEABLE.search(query):
+        return None
+    cursor, tables = _connect()
+    if cursor is None:
+        return None
+    sql, names = translate(query, database, tables)
+    if sql is None:
+        metrics.increment("chatdb_replica_skipped_total", help_text="Reads the analytical replica could not take",
+                          reason="unsupported")
+        return None
+    if server is not None and not _current(names, tables, server):
+        metrics.increment("chatdb_replica_skipped_total", help_text="Reads the analytical replica could not take",
+                          reason="stale")
+        return None
+    try:
+        cursor.execute(sql)
+    except load_duckdb().Error as e:
+        metrics.increment("chatdb_replica_fallbacks_total", help_text="Reads that failed on the replica and went "
+                          "to the server", error=type(e).__name__)
+        return None
+    metrics.increment("chatdb_replica_reads_total", help_text="Reads answered by the analytical replica")
+    return cursor
+
+
+# Keep the tables a write or DDL statement touches on the server until they
+# are copied again
+def record_write(database, query):
+    if not result_cache.SQL_WRITE.match(query):
+        return
+    if schema_catalog.is_ddl(query):
+        # Like the result cache, DDL may name any database
+        tables, key = None, None
+    else:
+        tables, key = result_cache.sql_tables(query, database), ((database or "").lower(), None)
+    now = time.time()
+    with _lock:
+        if tables is None:
+            _written[key] = now
+            return
+        for table in tables:
+            _written[table] = now
+
+
+def close():
+    with _lock:
+        if _replica["connection"] is not None:
+            _replica["connection"].close()
+        _replica.update(connection=None, signature=None, tables={})
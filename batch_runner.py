@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cost_guard
+import metrics
+import result_stream
+import run_full_interface_with_error_correction as interface
+
+# Run a file of recorded questions through the same generate/execute/repair
+# pipeline as the interactive loop. Input lines look like
+#   {"id": "q1", "question": "top 5 brands by products", "dbms": "sql", "database": "bike_store"}
+# and one result line is written per question.
+
+BATCH_CONCURRENCY = 4  # questions in flight at once
+# Seconds a question may take once a worker picks it up. Reads get a server
+# side time limit and LLM calls a timeout of what is left, and no statement
+# starts after it; a question that runs out is reported as timed out and
+# nothing it produced is kept in the query cache.
+BATCH_ITEM_TIMEOUT = 120
+BATCH_ROW_CAP = 100  # rows kept per result in the output file
+
+
+def run_item(item, row_cap=BATCH_ROW_CAP, timeout=None):
+    started_at = time.perf_counter()
+    with cost_guard.time_budget(timeout):
+        try:
+            with metrics.request(command="batch", item=item.get("id")):
+                record = _run_item(item, row_cap, timeout)
+        except Exception as e:
+            record = {"query": None, "rows": None, "error": str(e)}
+            if timeout is not None and cost_guard.remaining_seconds() <= 0:
+                record.update(timed_out=True, error=f"Timed out after {timeout}s ({e})")
+    record["latency"] = round(time.perf_counter() - started_at, 4)
+    return record
+
+
+def _run_item(item, row_cap, timeout):
+    started_at = time.perf_counter()
+    dbms = item.get("dbms", "sql")
+    database = item["database"]
+    question = item["question"]
+
+    query, fingerprint, cached = interface.generate_query(question, dbms, database)
+    generated_at = time.perf_counter()
+    # The pooled connection stays checked out until the rows are collected
+    with (interface.connections.mysql(database) if dbms == "sql" else nullcontext()) as connection:
+        results, error, final_query = interface.execute_query(query, dbms, database, connection)
+
+        rows = None
+        if not error:
+            if isinstance(results, (list, tuple)) or hasattr(results, "__next__"):
+                rows = result_stream.collect(results, row_cap)
+                metrics.record_rows(len(rows), dbms)
+            else:
+                rows = results
+    finished_at = time.perf_counter()
+    # A question that ran out of time may have been cut short anywhere, so
+    # neither its query nor its failure says anything about the question
+    timed_out = timeout is not None and cost_guard.remaining_seconds() <= 0
+    if timed_out:
+        error = f"Timed out after {timeout}s" + (f" ({error})" if error else "")
+    else:
+        interface.record_query_outcome(question, dbms, database, fingerprint, final_query, error)
+    return {
+        "query": final_query,
+        "cached": cached,
+        "repaired": final_query != query,
+        "rows": rows,
+        "row_count": len(rows) if isinstance(rows, list) else None,
+        "error": error,
+        "timed_out": timed_out,
+        "generate_seconds": round(generated_at - started_at, 4),
+        "execute_seconds": round(finished_at - generated_at, 4),
+    }
+
+
+def read_items(path):
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", str(line_number))
+                yield item
+
+
+def read_progress(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+# Run every item not yet listed in the progress file, keeping at most
+# `concurrency` in flight. Returns the collected per-item records.
+def run_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY, timeout=BATCH_ITEM_TIMEOUT):
+    progress_path = output_path + ".progress"
+    done_ids = read_progress(progress_path)
+    records = []
+    skipped = 0
+    started_at = time.perf_counter()
+
+    with open(output_path, "a") as output, open(progress_path, "a") as progress, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+        def finish(item, record):
+            record = {"id": item["id"], "question": item["question"], "dbms": item.get("dbms", "sql"),
+                      "database": item["database"], **record}
+            output.write(json.dumps(record, default=str) + "\n")
+            output.flush()
+            progress.write(f"{item['id']}\n")
+            progress.flush()
+            records.append(record)
+
+        pending = {}
+        items = read_items(input_path)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                elif str(item["id"]) in done_ids:
+                    skipped += 1
+                else:
+                    # The timeout is enforced by the worker, from when it starts
+                    pending[pool.submit(run_item, item, BATCH_ROW_CAP, timeout)] = item
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                finish(pending.pop(future), future.result())
+
+    elapsed = time.perf_counter() - started_at
+    print_summary(records, skipped, elapsed)
+    print(interface.connections.summary())
+    return records
+
+
+def print_summary(records, skipped, elapsed):
+    latencies = sorted(record["latency"] for record in records)
+    failed = sum(1 for record in records if record.get("error"))
+    timed_out = sum(1 for record in records if record.get("timed_out"))
+    cached = sum(1 for record in records if record.get("cached"))
+    print(f"Processed {len(records)} question(s) in {elapsed:.1f}s "
+          f"({len(records) / elapsed if elapsed else 0:.2f} questions/s); skipped {skipped} already done.")
+    print(f"Succeeded: {len(records) - failed}, failed: {failed - timed_out}, timed out: {timed_out}, "
+          f"served from query cache: {cached}")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        print(f"Latency: mean {statistics.mean(latencies):.2f}s, p50 {statistics.median(latencies):.2f}s, p95 {p95:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the DB chatbot pipeline")
+    parser.add_argument("input", help="JSONL file with id, question, dbms and database per line")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=BATCH_ITEM_TIMEOUT, help="seconds per question")
+    args = parser.parse_args()
+    metrics.start()
+    run_batch(args.input, args.output, args.concurrency, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
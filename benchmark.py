@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+import cost_guard
+import csv_schema
+import llm_backend
+import metrics
+import mongo_schema
+import query_validator
+import result_cache
+import schema_catalog
+import schema_retrieval
+import run_full_interface_with_error_correction as interface
+
+# End-to-end benchmark over the bundled datasets. The CSVs are loaded into
+# local stand-ins (SQLite for MySQL, mongomock for MongoDB) and the curated
+# questions run through the real convert_to_query/execute_query path, with
+# Gemini replaced by recorded responses.
+
+DATASETS = {"bike_store": "Bike_Store", "famous_painters_db": "FamousPaintingDB"}
+BENCHMARK_QUESTIONS = "benchmark_questions.jsonl"
+BENCHMARK_RECORDING = "benchmark_llm_recording.json"
+STAGES = ["schema", "generate", "execute", "total"]
+
+
+# DB-API connection wrapper counting statements and fetch round trips
+class CountingConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.round_trips = 0
+
+    def cursor(self):
+        return CountingCursor(self, self.conn.cursor())
+
+
+class CountingCursor:
+    def __init__(self, owner, cursor):
+        self.owner = owner
+        self.cursor = cursor
+
+    def execute(self, *args):
+        self.owner.round_trips += 1
+        return self.cursor.execute(*args)
+
+    def fetchmany(self, *args):
+        self.owner.round_trips += 1
+        return self.cursor.fetchmany(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def read_csvs(directory):
+    import pandas as pd
+
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".csv"):
+            yield os.path.splitext(file)[0], pd.read_csv(os.path.join(directory, file))
+
+
+# Tables get the keys and indexes load_sqldb.py would create in MySQL
+def load_sqlite(datasets):
+    connections = {}
+    for db_name, directory in datasets.items():
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        tables = csv_schema.infer_directory(directory)
+        for table_name, df in read_csvs(directory):
+            table = tables[table_name]
+            conn.execute(csv_schema.create_table_sql(table, inline_indexes=False))
+            for statement in csv_schema.create_index_sql(table):
+                conn.execute(statement)
+            df.to_sql(table_name, conn, index=False, if_exists="append")
+        connections[db_name] = conn
+    return connections
+
+
+def load_mongomock(datasets):
+    import mongomock
+
+    client = mongomock.MongoClient()
+    for db_name, directory in datasets.items():
+        for collection_name, df in read_csvs(directory):
+            client[db_name][collection_name].insert_many(df.to_dict("records"))
+    return client
+
+
+# Put the stand-ins' schemas into the catalog cache the interface reads from
+def prime_catalogs(connections, mongo_client):
+    schema_catalog.SCHEMA_CACHE_TTL = float("inf")
+    for db_name, conn in connections.items():
+        schema_catalog.store(("sql", db_name), schema_catalog.load_sqlite_catalog(conn, db_name))
+    for db_name in DATASETS:
+        # mongomock's $sample copies the whole collection, so the stand-in is
+        # summarized from its first documents. This also keeps the persisted
+        # summary of a real server from being overwritten.
+        db = mongo_client[db_name]
+        collections = {
+            name: mongo_schema.infer_documents(
+                db[name].find().limit(mongo_schema.MONGO_SAMPLE_SIZE), db[name].estimated_document_count()
+            )
+            for name in db.list_collection_names()
+        }
+        summary = {"database": db_name, "collections": collections}
+        schema_catalog.store(("mongodb", db_name), mongo_schema.summary_to_catalog(summary))
+
+
+def run_question(item, connections, mongo_client):
+    dbms, database, question = item["dbms"], item["database"], item["question"]
+    db_type = "SQL" if dbms == "sql" else "MongoDB"
+    llm_before = interface.llm.stats()
+    repairs_before = metrics.counter_total("chatdb_repairs_total")
+    candidates_before = metrics.counter_total("chatdb_candidate_executions_total")
+    tracemalloc.reset_peak()
+
+    started_at = time.perf_counter()
+    schema_info = interface.get_prompt_schema(dbms, database, question)
+    schema_done = time.perf_counter()
+    query = interface.convert_to_query(question, db_type, dbms, database)
+    generated = time.perf_counter()
+
+    connection = CountingConnection(connections[database]) if dbms == "sql" else mongo_client
+    results, error, final_query = interface.execute_query(query, dbms, database, connection)
+    rows = 0
+    if not error and (isinstance(results, (list, tuple)) or hasattr(results, "__next__")):
+        for _ in results:
+            rows += 1
+    metrics.record_rows(rows, dbms)
+    finished = time.perf_counter()
+    retrieval = check_retrieval(item, schema_info)
+
+    llm_after = interface.llm.stats()
+    repairs = metrics.counter_total("chatdb_repairs_total") - repairs_before
+    candidates_run = metrics.counter_total("chatdb_candidate_executions_total") - candidates_before
+    if interface.REPAIR_CANDIDATES <= 1:
+        candidates_run = repairs  # every sequential repair is executed once
+    return {
+        "id": item["id"],
+        "dbms": dbms,
+        "error": error,
+        "rows": rows,
+        "repairs": repairs,
+        "llm_calls": llm_after["calls"] - llm_before["calls"],
+        "llm_tokens": (llm_after["prompt_tokens"] + llm_after["response_tokens"]
+                       - llm_before["prompt_tokens"] - llm_before["response_tokens"]),
+        # SQL counts statements and fetch batches; for Mongo each execution attempt
+        "db_round_trips": connection.round_trips if dbms == "sql" else candidates_run + 1,
+        "peak_memory_mb": tracemalloc.get_traced_memory()[1] / 1024 / 1024,
+        **retrieval,
+        "schema": schema_done - started_at,
+        "generate": generated - schema_done,
+        "execute": finished - generated,
+        "total": finished - started_at,
+    }
+
+
+# Prompt size against the full schema, and whether the tables the question
+# needs (expected_tables) made it into the prompt
+def check_retrieval(item, schema_info):
+    dbms, database = item["dbms"], item["database"]
+    full_schema = interface.get_schema_info(dbms, database)
+    catalog = interface.get_mysql_catalog(database) if dbms == "sql" else interface.get_mongodb_catalog(database)
+    shown = list(catalog["tables"])
+    if schema_retrieval.SCHEMA_RETRIEVAL_ENABLED:
+        _, shown = schema_retrieval.relevant_schema(catalog, item["question"])
+    expected = item.get("expected_tables")
+    return {
+        "schema_tokens": schema_retrieval.estimate_tokens(schema_info),
+        "full_schema_tokens": schema_retrieval.estimate_tokens(full_schema),
+        "tables_found": None if expected is None else set(expected) <= set(shown),
+    }
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(records):
+    summary = {"questions": len(records), "failed": sum(1 for record in records if record["error"])}
+    for stage in STAGES:
+        values = [record[stage] for record in records]
+        summary[stage] = {
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "mean_ms": statistics.mean(values) * 1000,
+        }
+    for key in ("llm_calls", "llm_tokens", "repairs", "db_round_trips", "rows"):
+        summary[key] = sum(record[key] for record in records)
+    summary["peak_memory_mb"] = max(record["peak_memory_mb"] for record in records)
+    summary["schema_tokens"] = sum(record["schema_tokens"] for record in records)
+    summary["full_schema_tokens"] = sum(record["full_schema_tokens"] for record in records)
+    checked = [record["tables_found"] for record in records if record["tables_found"] is not None]
+    summary["tables_found"] = sum(checked)
+    summary["tables_checked"] = len(checked)
+    return summary
+
+
+def print_report(summary, baseline=None):
+    print(f"\n{summary['questions']} question(s), {summary['failed']} failed")
+    print(f"{'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}")
+    for stage in STAGES:
+        values = summary[stage]
+        line = f"{stage:<10} {values['p50_ms']:>10.2f} {values['p95_ms']:>10.2f} {values['mean_ms']:>10.2f}"
+        if baseline:
+            old = baseline[stage]["p95_ms"]
+            line += f"   p95 vs baseline: {(values['p95_ms'] - old) / old * 100 if old else 0:+.0f}%"
+        print(line)
+    for key in ("llm_calls", "llm_tokens", "repairs", "db_round_trips", "rows"):
+        line = f"{key:<15} {summary[key]:>10}"
+        if baseline and key in baseline:
+            line += f"   baseline: {baseline[key]}"
+        print(line)
+    line = f"{'peak memory':<15} {summary['peak_memory_mb']:>10.1f} MB"
+    if baseline:
+        line += f"   baseline: {baseline['peak_memory_mb']:.1f} MB"
+    print(line)
+    questions = summary["questions"]
+    schema_tokens, full_tokens = summary["schema_tokens"], summary["full_schema_tokens"]
+    print(f"schema tokens   {schema_tokens / questions:>10.0f}   full schema: {full_tokens / questions:.0f} "
+          f"per question ({(schema_tokens - full_tokens) / full_tokens * 100 if full_tokens else 0:+.0f}%)")
+    print(f"tables found    {summary['tables_found']:>10}   of {summary['tables_checked']} question(s) "
+          f"with expected_tables")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the query pipeline on the bundled datasets")
+    parser.add_argument("--questions", default=BENCHMARK_QUESTIONS)
+    parser.add_argument("--recording", default=BENCHMARK_RECORDING)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per LLM call")
+    parser.add_argument("--baseline", help="compare against a summary saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="write this run's summary to a JSON file")
+    parser.add_argument("--output", help="write per-question records to a JSONL file")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run the questions this many times; later rounds can hit the result cache")
+    parser.add_argument("--full-schema", action="store_true",
+                        help="send the full schema instead of the tables relevant to each question")
+    parser.add_argument("--candidates", type=int, default=0,
+                        help="repair failed queries with this many concurrent candidates (compare against a "
+                             "sequential --baseline)")
+    args = parser.parse_args()
+    interface.REPAIR_CANDIDATES = args.candidates
+    if args.full_schema:
+        schema_retrieval.SCHEMA_RETRIEVAL_ENABLED = False
+
+    with open(args.questions) as f:
+        items = [json.loads(line) for line in f if line.strip()] * args.repeat
+
+    started_at = time.perf_counter()
+    connections = load_sqlite(DATASETS)
+    mongo_client = load_mongomock(DATASETS)
+    prime_catalogs(connections, mongo_client)
+    print(f"Loaded stand-in databases in {time.perf_counter() - started_at:.1f}s")
+
+    interface.llm = llm_backend.ReplayBackend(args.recording, latency=args.llm_latency)
+    # Nobody is there to confirm; run expensive queries and leave the decision in the guard log
+    cost_guard.confirm = lambda decision: True
+    # Imported on first use otherwise, which would count towards the first question's memory
+    query_validator.load_sqlglot()
+    tracemalloc.start()
+    records = []
+    for item in items:
+        with metrics.request(command="benchmark", item=item["id"]):
+            records.append(run_question(item, connections, mongo_client))
+    tracemalloc.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    summary = summarize(records)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(summary, baseline)
+    print(result_cache.summary())
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import http
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from websockets.asyncio.server import serve as serve_websocket
+
+import connection_manager
+import metrics
+import result_stream
+import run_full_interface_with_error_correction as interface
+
+# Serve the chat interface to many analysts at once. Every client gets a
+# session (DBMS, selected database) and sends the same input the console
+# takes; commands run through interface.handle_input on a bounded thread
+# pool, so the schema catalog, query cache and LLM backend are shared.
+# HTTP is served by http.server threads and WebSockets by the websockets
+# library on a second port; both hand their work to the asyncio loop, which
+# owns the sessions.
+#
+#   POST   /sessions                {"dbms": "sql", "database": null} -> {"session_id": ...}
+#   GET    /sessions/<id>           session state
+#   POST   /sessions/<id>/messages  {"input": "show tables"} -> response
+#   DELETE /sessions/<id>
+#   GET    /health, GET /metrics
+#   ws://<host>:<ws-port>/ws[?session=<id>]  one text message in, one JSON message out
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_WS_PORT = 8081  # WebSocket port
+# Threads running commands; each holds at most one pooled MySQL connection
+SERVER_WORKERS = connection_manager.MYSQL_POOL_SIZE
+SERVER_MAX_PENDING = 64  # messages queued or running before new ones get 503
+SERVER_ROW_CAP = 100  # rows returned per query response
+SESSION_IDLE_TIMEOUT = 1800  # seconds before an unused session is closed
+SERVER_MAX_BODY = 1024 * 1024  # bytes, per request body or WebSocket message
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Run one line of input for a session in a worker thread. Query results are
+# collected up to row_cap rows so the pooled connection can be given back
+# before the response is sent.
+def run_message(session, user_input, row_cap=SERVER_ROW_CAP):
+    started_at = time.perf_counter()
+    with metrics.request(command="unknown") as request:
+        try:
+            response = interface.handle_input(session, user_input)
+            request["command"] = response["command"]
+            if "query" in response:
+                interface.run_query(session, response)
+                _collect_results(response, session.dbms, row_cap)
+        finally:
+            # Sessions only hold a MySQL connection while a message runs, so
+            # idle analysts do not use up the pool
+            session.close()
+    response.pop("fingerprint", None)
+    response.update(dbms=session.dbms, database=session.database,
+                    seconds=round(time.perf_counter() - started_at, 4))
+    return response
+
+
+def _collect_results(response, dbms, row_cap):
+    results = response.pop("results")
+    if response["error"]:
+        return
+    if isinstance(results, dict) and "message" in results:
+        response["message"] = results["message"]
+    elif isinstance(results, (list, tuple)) or hasattr(results, "__next__"):
+        rows = result_stream.collect(results, row_cap)
+        metrics.record_rows(len(rows), dbms)
+        response["rows"] = rows
+        response["row_count"] = len(rows)
+    else:
+        response["message"] = results
+
+
+class ChatServer:
+    def __init__(self, workers=SERVER_WORKERS, max_pending=SERVER_MAX_PENDING, row_cap=SERVER_ROW_CAP,
+                 idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-worker")
+        self.max_pending = max_pending
+        self.row_cap = row_cap
+        self.idle_timeout = idle_timeout
+        self.sessions = {}  # id -> {"session", "lock", "used_at"}
+        self.pending = 0
+
+    # --- Sessions ---
+
+    def create_session(self, dbms="sql", database=None):
+        if dbms not in ("sql", "mongodb"):
+            raise HTTPError(400, f"Unknown DBMS: {dbms}")
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = {
+            "session": interface.connections.session(dbms, database),
+            "lock": asyncio.Lock(),
+            "used_at": time.monotonic(),
+        }
+        self._publish()
+        return session_id
+
+    def get_session(self, session_id):
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            raise HTTPError(404, f"No session {session_id}")
+        return entry
+
+    def close_session(self, session_id):
+        entry = self.sessions.pop(session_id, None)
+        if entry:
+            entry["session"].close()
+        self._publish()
+        return entry is not None
+
+    def describe(self, session_id):
+        session = self.get_session(session_id)["session"]
+        return {"session_id": session_id, "dbms": session.dbms, "database": session.database}
+
+    async def expire_sessions(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - self.idle_timeout
+            for session_id, entry in list(self.sessions.items()):
+                if entry["used_at"] < cutoff and not entry["lock"].locked():
+                    self.close_session(session_id)
+
+    # Run a message on the worker pool. Messages of one session run in order;
+    # different sessions run concurrently up to the pool size.
+    async def send(self, session_id, user_input):
+        entry = self.get_session(session_id)
+        if not isinstance(user_input, str) or not user_input.strip():
+            raise HTTPError(400, "Expected a non-empty 'input'")
+        if self.pending >= self.max_pending:
+            metrics.increment("chatdb_server_rejected_total", help_text="Messages rejected because the server was busy")
+            raise HTTPError(503, "Server busy, try again")
+        self.pending += 1
+        self._publish()
+        try:
+            async with entry["lock"]:
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(self.executor, run_message, entry["session"], user_input,
+                                                      self.row_cap)
+                entry["used_at"] = time.monotonic()
+        finally:
+            self.pending -= 1
+            self._publish()
+        if response["command"] == "exit":
+            self.close_session(session_id)
+        return response
+
+    def _publish(self):
+        metrics.set_gauge("chatdb_server_sessions", len(self.sessions), help_text="Open chat sessions")
+        metrics.set_gauge("chatdb_server_pending", self.pending, help_text="Messages queued or running")
+
+    # --- HTTP ---
+
+    async def route(self, method, path, body):
+        parts = [part for part in urlsplit(path).path.split("/") if part]
+        try:
+            if parts == ["health"] and method == "GET":
+                return 200, {"status": "ok", "sessions": len(self.sessions), "pending": self.pending}, None
+            if parts == ["metrics"] and method == "GET":
+                return 200, metrics.render_prometheus(), "text/plain; version=0.0.4"
+            if parts == ["sessions"] and method == "POST":
+                options = parse_json(body) if body else {}
+                session_id = self.create_session(options.get("dbms", "sql"), options.get("database"))
+                return 201, self.describe(session_id), None
+            if len(parts) == 2 and parts[0] == "sessions":
+                if method == "GET":
+                    return 200, self.describe(parts[1]), None
+                if method == "DELETE":
+                    if not self.close_session(parts[1]):
+                        raise HTTPError(404, f"No session {parts[1]}")
+                    return 200, {"closed": parts[1]}, None
+                raise HTTPError(405, f"{method} not allowed")
+            if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+                if method != "POST":
+                    raise HTTPError(405, f"{method} not allowed")
+                return 200, await self.send(parts[1], parse_json(body).get("input")), None
+            raise HTTPError(404, f"No route for {method} {path}")
+        except HTTPError as e:
+            return e.status, {"error": str(e)}, None
+        except Exception as e:
+            return 500, {"error": str(e)}, None
+
+    # --- WebSocket ---
+
+    # Refuse the handshake for other paths and unknown sessions
+    def check_websocket(self, connection, request):
+        url = urlsplit(request.path)
+        if url.path != "/ws":
+            return connection.respond(http.HTTPStatus.NOT_FOUND, f"No route for {url.path}\n")
+        session_id = parse_qs(url.query).get("session", [None])[0]
+        if session_id is not None and session_id not in self.sessions:
+            return connection.respond(http.HTTPStatus.NOT_FOUND, f"No session {session_id}\n")
+        return None
+
+    async def handle_websocket(self, connection):
+        session_id = parse_qs(urlsplit(connection.request.path).query).get("session", [None])[0]
+        owned = session_id is None
+        if owned:
+            session_id = self.create_session()
+        try:
+            await connection.send(json.dumps(self.describe(session_id)))
+            async for message in connection:
+                if not isinstance(message, str):
+                    continue
+                try:
+                    response = await self.send(session_id, message)
+                except HTTPError as e:
+                    response = {"error": str(e), "status": e.status}
+                except Exception as e:
+                    response = {"error": str(e), "status": 500}
+                await connection.send(json.dumps(response, default=str))
+                if response.get("command") == "exit":
+                    break
+        finally:
+            if owned:
+                self.close_session(session_id)
+
+
+def parse_json(body):
+    try:
+        value = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body is not valid JSON")
+    if not isinstance(value, dict):
+        raise HTTPError(400, "Expected a JSON object")
+    return value
+
+
+# http.server handler class for a ChatServer. Requests are parsed on the
+# connection's thread and routed on the event loop that owns the sessions.
+def http_handler(chat_server, loop):
+    class ChatRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def handle_request(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > SERVER_MAX_BODY:
+                self.close_connection = True
+                self.write_response(413, {"error": "Request body too large"})
+                return
+            body = self.rfile.read(length) if length else b""
+            route = chat_server.route(self.command, self.path, body)
+            status, payload, content_type = asyncio.run_coroutine_threadsafe(route, loop).result()
+            self.write_response(status, payload, content_type)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+        def write_response(self, status, payload, content_type=None):
+            if isinstance(payload, str):
+                body = payload.encode()
+            else:
+                body = json.dumps(payload, default=str).encode()
+                content_type = "application/json"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 503:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ChatRequestHandler
+
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT, ws_port=SERVER_WS_PORT, workers=SERVER_WORKERS,
+                max_pending=SERVER_MAX_PENDING):
+    chat_server = ChatServer(workers, max_pending)
+    http_server = ThreadingHTTPServer((host, port), http_handler(chat_server, asyncio.get_running_loop()))
+    http_server.daemon_threads = True
+    threading.Thread(target=http_server.serve_forever, name="chat-http", daemon=True).start()
+    expiry = asyncio.create_task(chat_server.expire_sessions())
+    print(f"Chat server listening on http://{host}:{port} and ws://{host}:{ws_port}/ws "
+          f"({workers} worker(s), {max_pending} pending max)")
+    try:
+        async with serve_websocket(chat_server.handle_websocket, host, ws_port,
+                                   process_request=chat_server.check_websocket,
+                                   max_size=SERVER_MAX_BODY) as websocket_server:
+            await websocket_server.serve_forever()
+    finally:
+        expiry.cancel()
+        http_server.shutdown()
+        http_server.server_close()
+        for session_id in list(chat_server.sessions):
+            chat_server.close_session(session_id)
+        chat_server.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the chat interface over HTTP and WebSocket")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--ws-port", type=int, default=SERVER_WS_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=SERVER_MAX_PENDING)
+    args = parser.parse_args()
+
+    metrics.start()
+    interface.connections.connect_in_background()
+    try:
+        asyncio.run(serve(args.host, args.port, args.ws_port, args.workers, args.max_pending))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(interface.query_cache.summary())
+        print(interface.llm.summary())
+        print(interface.connections.summary())
+        interface.connections.close()
+
+
+if __name__ == "__main__":
+    main()
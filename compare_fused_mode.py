@@ -0,0 +1,80 @@
+import argparse
+import json
+import statistics
+import time
+
+import run_full_interface_with_error_correction as interface
+import schema_catalog
+
+# Compare the two-call path (interpret_user_input + convert_to_query) with the
+# fused single-call path on labelled examples. Each line of the examples file
+# is {"input": ..., "command": expected command, "dbms": "sql"|"mongodb",
+# "database": database to select or null}. The two paths take turns going
+# first, and each run starts with an empty schema catalog, so neither finds
+# the schema or the HTTP connection warmed up by the other.
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_two_call(text):
+    calls = 1
+    command, target = interface.interpret_user_input(text, use_local=False)
+    session = interface.console_session
+    if command == "query" and session.database:
+        interface.convert_to_query(target, "SQL" if session.dbms == "sql" else "MongoDB")
+        calls += 1
+    return command, calls
+
+
+def run_fused(text):
+    command, _, _ = interface.interpret_and_convert(text, use_local=False)
+    return command, 1
+
+
+def compare(examples):
+    results = {"two-call": [], "fused": []}
+    paths = [("two-call", run_two_call), ("fused", run_fused)]
+    for i, example in enumerate(examples):
+        interface.console_session.dbms = example.get("dbms", "sql")
+        interface.console_session.database = example.get("database")
+        for name, run in paths if i % 2 == 0 else paths[::-1]:
+            schema_catalog.invalidate()
+            start = time.perf_counter()
+            command, calls = run(example["input"])
+            elapsed = time.perf_counter() - start
+            results[name].append({
+                "correct": command == example["command"],
+                "latency": elapsed,
+                "calls": calls,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fused and two-call intent + query generation")
+    parser.add_argument("examples", nargs="?", default="fused_mode_examples.jsonl")
+    args = parser.parse_args()
+
+    with open(args.examples) as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+
+    results = compare(examples)
+    print(f"{'path':<10} {'accuracy':>9} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'LLM calls':>10}")
+    for name, rows in results.items():
+        latencies = [row["latency"] for row in rows]
+        accuracy = sum(row["correct"] for row in rows) / len(rows)
+        print(
+            f"{name:<10} {accuracy:>9.0%} {statistics.mean(latencies):>8.2f} "
+            f"{percentile(latencies, 50):>8.2f} {percentile(latencies, 95):>8.2f} "
+            f"{sum(row['calls'] for row in rows):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# mysql.connector and pymongo are imported when a backend is first used, so
+# startup does not pay for a driver the session may never need
+
+MYSQL_POOL_SIZE = 8  # connections opened at most
+MYSQL_CONNECT_TIMEOUT = 5  # seconds before an unreachable server fails a connect
+MYSQL_CHECKOUT_TIMEOUT = 30  # seconds to wait for a free connection
+MYSQL_HEALTH_CHECK_INTERVAL = 30  # ping connections idle for longer than this before reuse
+MYSQL_RECONNECT_ATTEMPTS = 3
+MYSQL_RECONNECT_DELAY = 1  # seconds between reconnect attempts
+# Client errors meaning the server cannot be reached (no socket, refused or
+# unknown host, server gone away, lost connection)
+MYSQL_UNREACHABLE_ERRORS = (2002, 2003, 2005, 2006, 2013, 2055)
+BACKEND_RETRY_INTERVAL = 30  # seconds an unreachable backend fails fast before it is tried again
+
+# Passed to pymongo.MongoClient; the client keeps its own connection pool
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 50,
+    "minPoolSize": 0,
+    "maxIdleTimeMS": 60000,
+    "waitQueueTimeoutMS": 10000,
+    "serverSelectionTimeoutMS": 5000,
+    "connectTimeoutMS": 5000,
+    "retryReads": True,
+    "retryWrites": True,
+    "appname": "chatdb",
+}
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+# Whether error means the database server could not be reached, as opposed
+# to an error in a statement. Checked by module so neither driver is imported.
+def is_unreachable(error):
+    module = type(error).__module__
+    if module.startswith("mysql.connector"):
+        return getattr(error, "errno", None) in MYSQL_UNREACHABLE_ERRORS
+    if module.startswith("pymongo"):
+        from pymongo.errors import ConnectionFailure
+        return isinstance(error, ConnectionFailure)
+    return False
+
+
+# Session settings every MySQL connection gets, again after a reconnect:
+# MySQL 8 caches information_schema's UPDATE_TIME for a day by default, and
+# the analytical replica compares it on reads (older servers do not cache)
+def prepare_mysql(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        pass
+    finally:
+        cursor.close()
+    return conn
+
+
+def has_unread_result(conn):
+    try:
+        return bool(conn.unread_result)
+    except Exception:
+        return False
+
+
+# Blocking MySQL connection pool. Connections are opened on demand up to
+# `size`, pinged before reuse once idle for `health_check_interval` seconds
+# and replaced when the ping cannot reconnect them.
+class MySQLPool:
+    def __init__(self, config, size=MYSQL_POOL_SIZE, timeout=MYSQL_CHECKOUT_TIMEOUT,
+                 health_check_interval=MYSQL_HEALTH_CHECK_INTERVAL):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.idle = []  # (connection, released_at)
+        self.in_use = 0
+        self.selected = {}  # id(connection) -> database selected on it
+        self.usage = {"created": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0, "reconnects": 0, "discarded": 0}
+        self.cond = threading.Condition()
+
+    def _connect(self):
+        import mysql.connector
+
+        # Statements run through the chat interface take effect right away.
+        # A pooled connection passes between sessions, so an open transaction
+        # would carry its locks and uncommitted rows over to the next one.
+        config = dict({"connection_timeout": MYSQL_CONNECT_TIMEOUT}, **self.config)
+        conn = prepare_mysql(mysql.connector.connect(autocommit=True, **config))
+        with self.cond:
+            self.usage["created"] += 1
+        return conn
+
+    def _close(self, conn):
+        self.selected.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # Ping a connection that sat idle for a while; reconnect or replace it if dead
+    def check(self, conn, last_used):
+        import mysql.connector
+
+        if time.monotonic() - last_used < self.health_check_interval:
+            return conn
+        # A reconnect drops the selected database
+        self.selected.pop(id(conn), None)
+        try:
+            conn.ping(reconnect=True, attempts=MYSQL_RECONNECT_ATTEMPTS, delay=MYSQL_RECONNECT_DELAY)
+            return prepare_mysql(conn)
+        except mysql.connector.Error:
+            self._close(conn)
+            with self.cond:
+                self.usage["reconnects"] += 1
+            metrics.increment("chatdb_mysql_reconnects_total", help_text="Dead MySQL connections replaced")
+            return self._connect()
+
+    def select(self, conn, database):
+        if database and self.selected.get(id(conn)) != database:
+            conn.database = database
+            self.selected[id(conn)] = database
+        return conn
+
+    def checkout(self, database=None):
+        started_at = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self.cond:
+            while True:
+                if self.idle:
+                    conn, released_at = self.idle.pop()
+                    break
+                if self.in_use + len(self.idle) < self.size:
+                    conn, released_at = None, None
+                    break
+                waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    raise PoolTimeoutError(f"No MySQL connection free after {self.timeout}s")
+            self.in_use += 1
+        try:
+            conn = self._connect() if conn is None else self.check(conn, released_at)
+            self.select(conn, database)
+        except BaseException:
+            if conn is not None:
+                self._close(conn)
+            with self.cond:
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+
+        wait = time.perf_counter() - started_at
+        with self.cond:
+            self.usage["checkouts"] += 1
+            self.usage["waits"] += waited
+            self.usage["wait_seconds"] += wait
+        metrics.observe("chatdb_mysql_checkout_wait_seconds", wait, help_text="Time spent waiting for a MySQL connection")
+        self._publish()
+        return conn
+
+    def release(self, conn, broken=False):
+        # A result its reader stopped early is not read to the end: closing
+        # the connection stops the server from sending the rest
+        if has_unread_result(conn):
+            broken = True
+        if broken:
+            self._close(conn)
+        with self.cond:
+            self.in_use -= 1
+            if broken:
+                self.usage["discarded"] += 1
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+        self._publish()
+
+    @contextmanager
+    def connection(self, database=None):
+        import mysql.connector
+
+        conn = self.checkout(database)
+        broken = False
+        try:
+            yield conn
+        except (mysql.connector.OperationalError, mysql.connector.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def stats(self):
+        with self.cond:
+            return {"size": self.size, "in_use": self.in_use, "idle": len(self.idle), **self.usage}
+
+    def _publish(self):
+        stats = self.stats()
+        metrics.set_gauge("chatdb_mysql_pool_in_use", stats["in_use"], help_text="MySQL connections checked out")
+        metrics.set_gauge("chatdb_mysql_pool_idle", stats["idle"], help_text="Open MySQL connections not in use")
+        metrics.set_gauge("chatdb_mysql_pool_size", stats["size"], help_text="Maximum MySQL connections")
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+# Tracks the MongoClient's pool through pymongo's connection pool events.
+# pymongo only accepts subclasses of its listener classes; the base class is
+# mixed in by pool_listener() when the client is created.
+class MongoPoolListener:
+    def __init__(self):
+        self.usage = {"created": 0, "closed": 0, "checked_out": 0, "checkouts": 0, "checkout_failures": 0}
+        self.lock = threading.Lock()
+
+    def _count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.usage[key] += value
+            checked_out = self.usage["checked_out"]
+            open_connections = self.usage["created"] - self.usage["closed"]
+        metrics.set_gauge("chatdb_mongo_pool_in_use", checked_out, help_text="MongoDB connections checked out")
+        metrics.set_gauge("chatdb_mongo_pool_open", open_connections, help_text="Open MongoDB connections")
+
+    def connection_created(self, event):
+        self._count(created=1)
+
+    def connection_closed(self, event):
+        self._count(closed=1)
+
+    def connection_checked_out(self, event):
+        self._count(checked_out=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._count(checked_out=-1)
+
+    def connection_check_out_failed(self, event):
+        self._count(checkout_failures=1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {"max_size": MONGO_CLIENT_OPTIONS["maxPoolSize"], **self.usage}
+
+
+def pool_listener():
+    from pymongo import monitoring
+
+    return type("MongoPoolListener", (MongoPoolListener, monitoring.ConnectionPoolListener), {})()
+
+
+# One analyst's view of the databases: the DBMS and database in use plus a
+# MySQL connection checked out for the session, so sessions never change
+# each other's current database
+class Session:
+    def __init__(self, manager, dbms="sql", database=None):
+        self.manager = manager
+        self.dbms = dbms
+        self.database = database
+        self._conn = None
+        self._used_at = None
+
+    def mysql_connection(self):
+        pool = self.manager.mysql_pool
+        if self._conn is not None and has_unread_result(self._conn):
+            # The last result was abandoned part-way (see MySQLPool.release)
+            self.reconnect()
+        if self._conn is None:
+            self._conn = pool.checkout(self.database)
+        else:
+            conn, self._conn = self._conn, None
+            try:
+                conn = pool.select(pool.check(conn, self._used_at), self.database)
+            except BaseException:
+                # check() may have closed it before failing to reconnect; give
+                # its slot back so the next statement checks out a fresh one
+                pool.release(conn, broken=True)
+                raise
+            self._conn = conn
+        self._used_at = time.monotonic()
+        return self._conn
+
+    def cursor(self):
+        return self.mysql_connection().cursor()
+
+    # Select a database; for MySQL an unknown name raises and leaves the
+    # session unchanged
+    def use(self, database):
+        if self.dbms == "sql":
+            self.manager.mysql_pool.select(self.mysql_connection(), database)
+        self.database = database
+
+    def mongo_db(self, database=None):
+        return self.manager.mongo_client[database or self.database]
+
+    # Give up the session's connection after an error that left it unusable;
+    # the next statement checks out a fresh one
+    def reconnect(self):
+        if self._conn is not None:
+            self.manager.mysql_pool.release(self._conn, broken=True)
+            self._conn = None
+
+    def close(self):
+        if self._conn is not None:
+            self.manager.mysql_pool.release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# The MySQL pool and the MongoClient shared by every session. Nothing
+# connects until a backend is used or connect_in_background() is called,
+# and a backend that cannot be reached fails fast for
+# BACKEND_RETRY_INTERVAL instead of stalling every command on its timeout.
+class ConnectionManager:
+    def __init__(self, mysql_config, mongo_uri, pool_size=MYSQL_POOL_SIZE, mongo_options=None):
+        self.mysql_pool = MySQLPool(mysql_config, pool_size)
+        self.mongo_uri = mongo_uri
+        self.mongo_options = dict(MONGO_CLIENT_OPTIONS, **(mongo_options or {}))
+        self.mongo_listener = MongoPoolListener()
+        self._mongo_client = None
+        self.unreachable = {}  # dbms -> (error message, monotonic time it failed)
+        self.lock = threading.Lock()
+
+    # Created on first use; pymongo connects in the background by itself
+    @property
+    def mongo_client(self):
+        with self.lock:
+            if self._mongo_client is None:
+                import pymongo
+
+                listener = pool_listener()
+                self._mongo_client = pymongo.MongoClient(self.mongo_uri, event_listeners=[listener],
+                                                         **self.mongo_options)
+                self.mongo_listener = listener
+            return self._mongo_client
+
+    # Open a connection to dbms ("sql" leaves one idle in the pool for the
+    # first command) and remember whether the server answered
+    def probe(self, dbms):
+        try:
+            if dbms == "sql":
+                self.mysql_pool.release(self.mysql_pool.checkout())
+            else:
+                self.mongo_client.admin.command("ping")
+        except Exception as e:
+            self.mark_unreachable(dbms, e)
+            return False
+        with self.lock:
+            self.unreachable.pop(dbms, None)
+        return True
+
+    # Probe every backend on daemon threads, so the prompt shows while the
+    # drivers are imported and the connections opened
+    def connect_in_background(self, backends=("sql", "mongodb")):
+        threads = [threading.Thread(target=self.probe, args=(dbms,), name=f"connect-{dbms}", daemon=True)
+                   for dbms in backends]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def mark_unreachable(self, dbms, error):
+        with self.lock:
+            self.unreachable[dbms] = (str(error), time.monotonic())
+        metrics.increment("chatdb_backend_unreachable_total", help_text="Failed attempts to reach a database server",
+                          dbms=dbms)
+
+    # Why dbms could not be reached, or None when it was reachable or the
+    # failure is older than BACKEND_RETRY_INTERVAL (the next use tries again)
+    def unreachable_error(self, dbms):
+        with self.lock:
+            error, failed_at = self.unreachable.get(dbms, (None, 0))
+        if error is None or time.monotonic() - failed_at > BACKEND_RETRY_INTERVAL:
+            return None
+        return error
+
+    # Short checkout for one statement or catalog load
+    def mysql(self, database=None):
+        return self.mysql_pool.connection(database)
+
+    def session(self, dbms="sql", database=None):
+        return Session(self, dbms, database)
+
+    def stats(self):
+        return {"mysql": self.mysql_pool.stats(), "mongo": self.mongo_listener.stats()}
+
+    def summary(self):
+        mysql_stats, mongo_stats = self.mysql_pool.stats(), self.mongo_listener.stats()
+        return (
+            f"Connections: MySQL {mysql_stats['created']} opened, {mysql_stats['checkouts']} checkout(s), "
+            f"{mysql_stats['waits']} waited ({mysql_stats['wait_seconds']:.2f}s), "
+            f"{mysql_stats['reconnects']} reconnect(s); MongoDB {mongo_stats['created']} opened, "
+            f"{mongo_stats['checkouts']} checkout(s)"
+        )
+
+    def close(self):
+        self.mysql_pool.close()
+        if self._mongo_client is not None:
+            self._mongo_client.close()
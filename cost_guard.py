@@ -0,0 +1,293 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import query_validator
+import result_stream
+
+# Estimate how much work a generated query will do before it runs: EXPLAIN
+# of SQL reads, the query planner (or the collection's indexes) for MongoDB.
+# SQL writes and DDL are not estimated. Expensive reads get a server-side
+# time limit and a LIMIT; queries past
+# GUARD_CONFIRM_ROWS only run when `confirm` approves them. Every decision is
+# appended to GUARD_LOG_PATH together with the query.
+
+GUARD_ENABLED = True
+GUARD_TIMEOUT_ROWS = 100_000  # estimated rows examined before reads get a time limit
+GUARD_LIMIT_ROWS = 1_000_000  # ... before reads without a LIMIT get one
+GUARD_CONFIRM_ROWS = 100_000_000  # ... before the query needs confirmation
+GUARD_LIMIT = result_stream.RESULT_ROW_CAP  # rows kept by an added LIMIT
+GUARD_MAX_EXECUTION_MS = 30_000  # MAX_EXECUTION_TIME / maxTimeMS for guarded reads
+GUARD_LOG_PATH = os.environ.get("CHATDB_GUARD_LOG", os.path.join(".schema_cache", "query_guard.jsonl"))
+
+# Called with the decision for queries past GUARD_CONFIRM_ROWS; returns True
+# to run the query anyway. Left unset (batch runs, the server) they are refused.
+confirm = None
+
+SQL_READ = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+SQL_SELECT = re.compile(r"^\s*select\b", re.IGNORECASE)
+
+_log_lock = threading.Lock()
+_budget = threading.local()  # .deadline: time.monotonic() past which this thread starts no statement
+
+
+class QueryRejected(Exception):
+    pass
+
+
+# Raised instead of running a statement once the thread's time budget is spent
+class BudgetExceeded(QueryRejected):
+    pass
+
+
+# Give the work done by this thread `seconds` in total (batch items; None:
+# no budget). While it lasts, reads get a server-side time limit of what is
+# left, LLM calls a timeout of what is left, and once it is spent no
+# statement is started.
+@contextmanager
+def time_budget(seconds):
+    _budget.deadline = None if seconds is None else time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        _budget.deadline = None
+
+
+# Seconds left of the thread's time budget; None without one
+def remaining_seconds():
+    deadline = getattr(_budget, "deadline", None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_budget():
+    remaining = remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        raise BudgetExceeded("Query not run: the time budget for this request is spent.")
+
+
+# max_time_ms shortened to what is left of the time budget
+def within_budget(max_time_ms):
+    remaining = remaining_seconds()
+    if remaining is None:
+        return max_time_ms
+    remaining_ms = max(1, int(remaining * 1000))
+    return min(max_time_ms, remaining_ms) if max_time_ms else remaining_ms
+
+
+# Rows MySQL expects to examine: the product of the row estimates of the
+# tables joined in each SELECT (nested loops), summed over the SELECTs.
+# Ignores `filtered`, so joins are over- rather than underestimated.
+def estimate_sql(explain_cursor):
+    columns = [column[0].lower() for column in explain_cursor.description or []]
+    plan = explain_cursor.fetchall()
+    if "rows" not in columns:
+        return None  # not MySQL (the benchmark's SQLite stand-in)
+    per_select = {}
+    for row in plan:
+        step = dict(zip(columns, row))
+        select_id = step.get("id")
+        per_select[select_id] = per_select.get(select_id, 1) * max(1, int(step["rows"] or 0))
+    return sum(per_select.values())
+
+
+# The syntax tree of a SQL read (sqlglot), or None: not a single SELECT,
+# WITH or UNION, or no sqlglot
+def _sql_read_tree(query):
+    sqlglot = query_validator.load_sqlglot()
+    if sqlglot is None:
+        return None
+    try:
+        tree = sqlglot.parse_one(query, read=query_validator.SQL_DIALECT)
+    except sqlglot.errors.ParseError:
+        return None
+    return tree if isinstance(tree, sqlglot.exp.Query) else None
+
+
+# A read with LIMIT `limit` added through its syntax tree, so it lands before
+# FOR UPDATE / LOCK IN SHARE MODE and not inside a trailing comment or after
+# a ;. Reads that already have a LIMIT, or cannot be parsed, are returned
+# as they are.
+def add_sql_limit(query, limit, tree=None):
+    tree = tree or _sql_read_tree(query)
+    if tree is None or tree.args.get("limit") is not None:
+        return query
+    return tree.limit(limit).sql(dialect=query_validator.SQL_DIALECT)
+
+
+def add_sql_time_limit(query, max_time_ms):
+    return SQL_SELECT.sub(f"SELECT /*+ MAX_EXECUTION_TIME({max_time_ms}) */", query, count=1)
+
+
+# EXPLAIN a read through execute(sql), which runs a statement and returns
+# its cursor. Returns the rows it would examine (None when unknown or not a
+# read); errors from EXPLAIN are the statement's own errors and propagate.
+def explain_sql(query, execute):
+    if not SQL_READ.match(query):
+        return None
+    cursor = execute(f"EXPLAIN {query}")
+    try:
+        return estimate_sql(cursor)
+    finally:
+        cursor.close()
+
+
+# Guard one SQL statement (see explain_sql for execute). Returns the
+# statement to run.
+def guard_sql(query, execute, database=None):
+    check_budget()
+    if not GUARD_ENABLED or not SQL_READ.match(query):
+        max_time_ms = within_budget(None)
+        return add_sql_time_limit(query, max_time_ms) if max_time_ms and SQL_SELECT.match(query) else query
+    with metrics.span("guard", dbms="sql"):
+        estimate = explain_sql(query, execute)
+    tree = _sql_read_tree(query) if estimate is not None and estimate >= GUARD_LIMIT_ROWS else None
+    # Without a syntax tree (no sqlglot, or a read it cannot parse) no LIMIT
+    # can be added, so none is decided, printed or logged
+    has_limit = tree is None or tree.args.get("limit") is not None
+    decision = decide("sql", database, query, estimate, True, has_limit)
+    guarded = query
+    if decision["limit"]:
+        guarded = add_sql_limit(guarded, decision["limit"], tree)
+    max_time_ms = within_budget(decision["max_time_ms"])
+    if max_time_ms and SQL_SELECT.match(guarded):
+        guarded = add_sql_time_limit(guarded, max_time_ms)
+    decision["guarded_query"] = guarded
+    log(decision)
+    return guarded
+
+
+def _estimated_count(collection):
+    try:
+        return collection.estimated_document_count()
+    except Exception:
+        return 0
+
+
+def _indexed(collection, field):
+    try:
+        return any(info["key"][0][0] == field for info in collection.index_information().values())
+    except Exception:
+        return False
+
+
+# Documents examined to match filter: the whole collection for a collection
+# scan, one per lookup when the planner picks an index. Servers (or stand-ins)
+# without explain fall back to checking the filter fields against the indexes.
+def _scan_estimate(collection, filter):
+    count = _estimated_count(collection)
+    try:
+        plan = collection.database.command("explain", {"find": collection.name, "filter": filter},
+                                           verbosity="queryPlanner")
+        collection_scan = "COLLSCAN" in json.dumps(plan["queryPlanner"]["winningPlan"], default=str)
+    except Exception:
+        collection_scan = not any(_indexed(collection, field) for field in filter if not field.startswith("$"))
+    return count if collection_scan else 1
+
+
+# Upper bound on the documents a call examines. Pipeline documents flow into
+# each $lookup; an unindexed foreignField scans the joined collection once
+# per document.
+def estimate_mongodb_call(db, call):
+    if call.collection is None or call.method in ("insert_one", "insert_many", "estimated_document_count"):
+        return 0
+    collection = db[call.collection]
+    if call.method != "aggregate":
+        return _scan_estimate(collection, call.filter)
+
+    pipeline = call.pipeline
+    first_match = pipeline[0].get("$match", {}) if pipeline and isinstance(pipeline[0], dict) else {}
+    examined = _scan_estimate(collection, first_match)
+    flowing = examined if first_match else _estimated_count(collection)
+    for stage in pipeline:
+        if not isinstance(stage, dict):
+            continue
+        if "$limit" in stage:
+            flowing = min(flowing, int(stage["$limit"]))
+        lookup = stage.get("$lookup")
+        if lookup and "from" in lookup:
+            joined = db[lookup["from"]]
+            if "foreignField" in lookup and _indexed(joined, lookup["foreignField"]):
+                examined += flowing
+            else:
+                examined += flowing * _estimated_count(joined)
+    return examined
+
+
+# Documents a compiled query (mongo_query.MongoQuery) examines; None when unknown
+def estimate_mongodb(db, query):
+    try:
+        return sum(estimate_mongodb_call(db, call) for call in query.calls)
+    except Exception:
+        return None
+
+
+# Guard a recorded MongoDB query (mongo_query.MongoQuery). Returns the
+# decision; its "limit" and "max_time_ms" are applied when the calls run.
+def guard_mongodb(db, query, text, database=None):
+    check_budget()
+    if not GUARD_ENABLED:
+        return {"limit": None, "max_time_ms": within_budget(None)}
+    with metrics.span("guard", dbms="mongodb"):
+        estimate = estimate_mongodb(db, query)
+    is_read = all(call.is_read for call in query.calls)
+    has_limit = all(call.has_limit or call.method not in ("find", "aggregate") for call in query.calls)
+    decision = decide("mongodb", database, text, estimate, is_read, has_limit)
+    log(decision)
+    decision["max_time_ms"] = within_budget(decision["max_time_ms"])
+    return decision
+
+
+def decide(dbms, database, query, estimate, is_read, has_limit):
+    decision = {"dbms": dbms, "database": database, "query": query, "estimated_rows": estimate,
+                "actions": [], "limit": None, "max_time_ms": None}
+    if estimate is None:
+        return decision
+    if estimate >= GUARD_CONFIRM_ROWS:
+        approved = bool(confirm and confirm(decision))
+        decision["actions"].append("confirmed" if approved else "rejected")
+        if not approved:
+            log(decision)
+            raise QueryRejected(
+                f"Query not run: it is estimated to examine {estimate:,} rows "
+                f"(more than {GUARD_CONFIRM_ROWS:,}). Narrow the question or add filters."
+            )
+    if is_read and estimate >= GUARD_TIMEOUT_ROWS:
+        decision["max_time_ms"] = GUARD_MAX_EXECUTION_MS
+        decision["actions"].append("time_limit")
+    if is_read and not has_limit and estimate >= GUARD_LIMIT_ROWS:
+        decision["limit"] = GUARD_LIMIT
+        decision["actions"].append("limit")
+    if decision["actions"]:
+        print(f"Cost guard: estimated {estimate:,} rows examined; {describe(decision)}")
+    return decision
+
+
+def describe(decision):
+    parts = []
+    if decision["max_time_ms"]:
+        parts.append(f"time limit {decision['max_time_ms']} ms")
+    if decision["limit"]:
+        parts.append(f"LIMIT {decision['limit']}")
+    if "confirmed" in decision["actions"]:
+        parts.append("confirmed")
+    return ", ".join(parts) or "no changes"
+
+
+def log(decision):
+    for action in decision["actions"] or ["allow"]:
+        metrics.increment("chatdb_guard_decisions_total", help_text="Cost guard decisions", action=action,
+                          dbms=decision["dbms"])
+    if not GUARD_LOG_PATH:
+        return
+    record = {"time": time.time(), "request_id": metrics.current_request_id(), **decision}
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        directory = os.path.dirname(GUARD_LOG_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(GUARD_LOG_PATH, "a") as f:
+            f.write(line + "\n")
@@ -0,0 +1,230 @@
+import itertools
+import os
+import re
+
+import pandas as pd
+
+# Infer a relational schema from a directory of CSV files before they are
+# loaded: narrow column types, a primary key per table where the data has
+# one, and foreign keys between id columns of the same name. The result is
+# turned into MySQL DDL (load_sqldb.py) or MongoDB indexes
+# (import_csv_to_mongodb.py).
+
+SCHEMA_CHUNK_SIZE = 20000  # CSV rows read per chunk while inferring
+VARCHAR_MAX = 255  # longer strings are stored as TEXT
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+INT_TYPES = [("SMALLINT", 2 ** 15), ("INT", 2 ** 31), ("BIGINT", 2 ** 63)]
+# Types are sized for this much growth over the largest value (or string)
+# in the CSV, so rows added through the chat interface still fit
+TYPE_HEADROOM = 10
+
+
+# Columns that look like keys: "id" or ending in "_id"
+def is_id_column(name):
+    name = name.lower()
+    return name == "id" or name.endswith("_id")
+
+
+def table_name_for(file):
+    return os.path.splitext(file)[0].replace(" ", "_")
+
+
+def _new_stats():
+    return {"kind": None, "nulls": 0, "min": None, "max": None, "max_len": 0,
+            "integral": True, "date": True, "values": None}
+
+
+def _widen(old, new):
+    if old is None or old == new:
+        return new
+    if {old, new} <= {"i", "u", "f"}:
+        return "f"
+    return "O"
+
+
+def _update(stats, series, keep_values):
+    present = series.dropna()
+    stats["nulls"] += len(series) - len(present)
+    if keep_values:
+        stats["values"].update(present.tolist())
+    if present.empty:
+        return
+    kind = series.dtype.kind
+    stats["kind"] = _widen(stats["kind"], kind)
+    if kind in "iuf":
+        low, high = present.min(), present.max()
+        stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+        stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+        if kind == "f" and not (present == present.round()).all():
+            stats["integral"] = False
+    text = present.astype(str)
+    stats["max_len"] = max(stats["max_len"], int(text.str.len().max()))
+    if kind != "O" or not text.str.match(DATE_PATTERN).all():
+        stats["date"] = False
+
+
+def _column_type(stats):
+    kind = stats["kind"]
+    if kind is None:
+        return "TEXT"
+    if kind == "b":
+        return "BOOLEAN"
+    if kind in "iu" or (kind == "f" and stats["integral"]):
+        bound = max(abs(int(stats["min"])) - 1 if stats["min"] < 0 else 0, int(stats["max"]))
+        for name, limit in INT_TYPES:
+            if bound * TYPE_HEADROOM < limit:
+                return name
+        return "BIGINT"
+    if kind == "f":
+        return "DOUBLE"
+    if stats["date"]:
+        return "DATE"
+    if stats["max_len"] <= VARCHAR_MAX:
+        return f"VARCHAR({min(VARCHAR_MAX, max(32, 1 << (2 * stats['max_len'] - 1).bit_length()))})"
+    return "TEXT"
+
+
+# Scan one CSV in chunks and collect per-column statistics, plus the value
+# sets needed to find keys: id columns and pairs of id columns
+def infer_table(path, chunk_size=SCHEMA_CHUNK_SIZE):
+    stats = {}
+    pairs = {}
+    row_count = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        if not stats:
+            stats = {column: _new_stats() for column in chunk.columns}
+            id_columns = [column for column in chunk.columns if is_id_column(column)]
+            for column in id_columns:
+                stats[column]["values"] = set()
+            pairs = {pair: set() for pair in itertools.combinations(id_columns, 2)}
+        for column in chunk.columns:
+            _update(stats[column], chunk[column], stats[column]["values"] is not None)
+        for pair, seen in pairs.items():
+            seen.update(zip(chunk[pair[0]].tolist(), chunk[pair[1]].tolist()))
+        row_count += len(chunk)
+
+    table = table_name_for(os.path.basename(path))
+    columns = [{"name": name, "type": _column_type(column), "nullable": column["nulls"] > 0}
+               for name, column in stats.items()]
+    return {
+        "table": table,
+        "path": path,
+        "columns": columns,
+        "primary_key": _primary_key(table, stats, pairs, row_count),
+        "foreign_keys": [],
+        "indexes": [],
+        "row_count": row_count,
+        "_stats": stats,
+    }
+
+
+def _primary_key(table, stats, pairs, row_count):
+    if not row_count:
+        return []
+    unique = [name for name, column in stats.items()
+              if column["values"] is not None and column["nulls"] == 0 and len(column["values"]) == row_count]
+    # Prefer the column named after the table (orders -> order_id)
+    for name in unique:
+        if name.lower() in (f"{table.lower()}_id", f"{table.lower().rstrip('s')}_id"):
+            return [name]
+    if unique:
+        return [unique[0]]
+    for pair, seen in pairs.items():
+        if len(seen) == row_count and all(stats[name]["nulls"] == 0 for name in pair):
+            return list(pair)
+    return []
+
+
+# Link id columns to the table whose single-column primary key has the same
+# name and holds every value. Id columns shared with other tables are join
+# columns and get an index even without a foreign key.
+def _link_tables(tables):
+    owners = {}
+    shared = {}
+    for table in tables.values():
+        if len(table["primary_key"]) == 1:
+            owners.setdefault(table["primary_key"][0], table)
+        for column in table["columns"]:
+            shared[column["name"]] = shared.get(column["name"], 0) + 1
+
+    for table in tables.values():
+        stats = table["_stats"]
+        for column in table["columns"]:
+            name = column["name"]
+            if stats[name]["values"] is None or table["primary_key"] == [name]:
+                continue
+            owner = owners.get(name)
+            if owner and owner is not table and stats[name]["values"] <= owner["_stats"][name]["values"]:
+                table["foreign_keys"].append({"column": name, "ref_table": owner["table"], "ref_column": name})
+                # MySQL wants both sides of a foreign key to have the same type
+                column["type"] = next(c["type"] for c in owner["columns"] if c["name"] == name)
+            if table["primary_key"][:1] != [name] and shared[name] > 1:
+                table["indexes"].append([name])
+
+
+def infer_directory(directory, chunk_size=SCHEMA_CHUNK_SIZE):
+    tables = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith(".csv"):
+            table = infer_table(os.path.join(directory, file), chunk_size)
+            tables[table["table"]] = table
+    _link_tables(tables)
+    for table in tables.values():
+        del table["_stats"]
+    return tables
+
+
+def _index_clause(columns):
+    return f"KEY `idx_{'_'.join(columns)}` (" + ", ".join(f"`{name}`" for name in columns) + ")"
+
+
+def _foreign_key_clause(table, fk):
+    return (f"CONSTRAINT `fk_{table['table']}_{fk['column']}` FOREIGN KEY (`{fk['column']}`) "
+            f"REFERENCES `{fk['ref_table']}` (`{fk['ref_column']}`)")
+
+
+# CREATE TABLE for the inferred schema. SQLite has no inline KEY clause, so
+# inline_indexes=False leaves the indexes to create_index_sql; keys=False
+# leaves out the indexes and foreign keys, for add_keys_sql after a bulk load
+def create_table_sql(table, inline_indexes=True, keys=True):
+    lines = []
+    for column in table["columns"]:
+        line = f"`{column['name']}` {column['type']}"
+        if column["name"] in table["primary_key"]:
+            line += " NOT NULL"
+        lines.append(line)
+    if table["primary_key"]:
+        lines.append("PRIMARY KEY (" + ", ".join(f"`{name}`" for name in table["primary_key"]) + ")")
+    if keys:
+        lines.extend(_index_clause(columns) for columns in (table["indexes"] if inline_indexes else []))
+        lines.extend(_foreign_key_clause(table, fk) for fk in table["foreign_keys"])
+    return f"CREATE TABLE `{table['table']}` (\n  " + ",\n  ".join(lines) + "\n)"
+
+
+# One ALTER TABLE adding what create_table_sql(table, keys=False) left out,
+# so MySQL builds each index from the loaded rows in one pass. None when the
+# table has no secondary indexes or foreign keys.
+def add_keys_sql(table):
+    clauses = [f"ADD {_index_clause(columns)}" for columns in table["indexes"]]
+    clauses += [f"ADD {_foreign_key_clause(table, fk)}" for fk in table["foreign_keys"]]
+    if not clauses:
+        return None
+    return f"ALTER TABLE `{table['table']}` " + ", ".join(clauses)
+
+
+def create_index_sql(table):
+    return [
+        f"CREATE INDEX `idx_{table['table']}_{'_'.join(columns)}` ON `{table['table']}` ("
+        + ", ".join(f"`{name}`" for name in columns) + ")"
+        for columns in table["indexes"]
+    ]
+
+
+# MongoDB indexes matching the inferred keys: (fields, unique)
+def mongo_indexes(table):
+    indexes = []
+    if table["primary_key"]:
+        indexes.append((table["primary_key"], True))
+    indexes.extend((columns, False) for columns in table["indexes"])
+    return indexes
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# Incremental loading of a CSV directory. A manifest per dataset directory
+# and target database records every file's size, mtime and content hash and,
+# per row, a hash of the row under its key. The next sync skips files whose
+# content did not change and, for the others, applies only the rows that
+# were inserted, updated or deleted since (load_sqldb.py --sync,
+# import_csv_to_mongodb.py --mode sync).
+
+SYNC_MANIFEST_DIR = os.path.join(".schema_cache", "sync")
+SYNC_CHUNK_SIZE = 5000  # CSV rows compared per chunk
+
+
+def manifest_path(directory, dbms, database):
+    name = os.path.basename(os.path.normpath(os.path.abspath(directory)))
+    return os.path.join(SYNC_MANIFEST_DIR, f"{dbms}_{database}_{name}.json")
+
+
+# {file name: entry} recorded by the last sync of directory into database
+def load_manifest(directory, dbms, database):
+    try:
+        with open(manifest_path(directory, dbms, database)) as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_manifest(directory, dbms, database, files):
+    path = manifest_path(directory, dbms, database)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a temporary file first so an interrupted run keeps the old one
+    with open(path + ".tmp", "w") as f:
+        json.dump({"directory": os.path.abspath(directory), "files": files}, f)
+    os.replace(path + ".tmp", path)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Whether the file still has the content recorded in entry. Size and mtime
+# decide without reading the file; a touched file is hashed.
+def unchanged(entry, path):
+    stat = os.stat(path)
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime == entry["mtime"]:
+        return True
+    if file_hash(path) != entry["sha256"]:
+        return False
+    entry["mtime"] = stat.st_mtime
+    return True
+
+
+def _row_hash(values):
+    return hashlib.blake2b(json.dumps(values, default=str).encode(), digest_size=8).hexdigest()
+
+
+# Compare a CSV with the row hashes of the last sync (old_rows, key JSON ->
+# row hash). Yields (chunk, positions) for every chunk with inserted or
+# updated rows, positions being the changed rows of the chunk. Fills rows
+# with the hashes of the file and counts with the inserted, updated and
+# unchanged rows; deleted keys are those of old_rows missing from rows.
+def diff_rows(path, key, old_rows, rows, counts, chunk_size=SYNC_CHUNK_SIZE):
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        values = chunk.astype(object).where(chunk.notna(), None)
+        key_positions = [values.columns.get_loc(column) for column in key]
+        changed = []
+        for position, row in enumerate(values.itertuples(index=False, name=None)):
+            row_key = json.dumps([row[i] for i in key_positions], default=str)
+            row_hash = _row_hash(row)
+            rows[row_key] = row_hash
+            old_hash = old_rows.get(row_key)
+            if old_hash == row_hash:
+                counts["unchanged"] += 1
+                continue
+            counts["inserted" if old_hash is None else "updated"] += 1
+            changed.append(position)
+        if changed:
+            yield chunk, changed
+
+
+def deleted_keys(old_rows, rows):
+    return [json.loads(row_key) for row_key in old_rows if row_key not in rows]
+
+
+# schema is whatever identifies the table layout for the target (DDL, key
+# fields); a different schema makes the next sync load the file in full
+def new_entry(path, schema, key, rows, row_count=None):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash(path), "schema": schema,
+            "key": key, "row_count": len(rows) if row_count is None else row_count, "rows": rows}
+
+
+# Whether no two rows of the CSV share the same values of key. Rows are only
+# diffed and upserted by a unique key; a repeated key would merge rows.
+def is_unique_key(path, key, chunk_size=SYNC_CHUNK_SIZE):
+    seen = set()
+    row_count = 0
+    for chunk in pd.read_csv(path, usecols=key, chunksize=chunk_size):
+        values = chunk[key].astype(object).where(chunk[key].notna(), None)
+        seen.update(values.itertuples(index=False, name=None))
+        row_count += len(chunk)
+        if len(seen) < row_count:
+            return False
+    return True
+
+
+# Manifest entry for a file that was just loaded in full; row_count is the
+# number of rows the load wrote. Files without a key only record their row
+# count and are loaded in full when they change.
+def record_file(path, schema, key, chunk_size=SYNC_CHUNK_SIZE, row_count=None):
+    rows = {}
+    if not key:
+        if row_count is None:
+            row_count = sum(len(chunk) for chunk in pd.read_csv(path, chunksize=chunk_size))
+        return new_entry(path, schema, key, rows, row_count)
+    for _ in diff_rows(path, key, {}, rows, new_counts(), chunk_size):
+        pass
+    return new_entry(path, schema, key, rows)
+
+
+def new_counts():
+    return {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0, "reloaded": 0}
+
+
+def describe(counts):
+    if counts["reloaded"]:
+        return f"reloaded {counts['reloaded']} rows"
+    if not (counts["inserted"] or counts["updated"] or counts["deleted"]):
+        return f"unchanged, {counts['unchanged']} rows skipped"
+    return (f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['deleted']} deleted, "
+            f"{counts['unchanged']} rows skipped")
+
+
+def summary(totals):
+    written = totals["inserted"] + totals["updated"] + totals["deleted"] + totals["reloaded"]
+    skipped = totals["unchanged"]
+    share = skipped / (skipped + written) if skipped + written else 0.0
+    return (f"Sync: {written} row(s) written ({totals['inserted']} inserted, {totals['updated']} updated, "
+            f"{totals['deleted']} deleted, {totals['reloaded']} reloaded); {skipped} row(s) not rewritten "
+            f"({share:.0%})")
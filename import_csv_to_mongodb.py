@@ -1,40 +1,430 @@
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 import pymongo
-from pymongo import MongoClient
+from pymongo import DeleteOne, MongoClient, ReplaceOne
 
-def import_csv_to_mongodb():
-    client = MongoClient("mongodb://localhost:27017/")
+import csv_schema
+import csv_sync
+import mongo_schema
+import result_stream
 
-    db_name = "famous_painters_db" ## Change this to the name of the database you want to create
-    db = client[db_name]
+MONGO_URI = "mongodb://localhost:27017/"
+db_name = "famous_painters_db" ## Change this to the name of the database you want to create
+path = "FamousPaintingDB"  # Directory containing CSV files (or pass it on the command line)
 
-    path = "FamousPaintingDB"
-
-    csv_files = [f for f in os.listdir(path) if f.endswith('.csv')]
-
-    for csv_file in csv_files:
-        # Get the collection name (file name without extension)
-        collection_name = os.path.splitext(csv_file)[0]
-        
-        # Read the CSV file
-        file_path = os.path.join(path, csv_file)
-        df = pd.read_csv(file_path)
-        
-        # Convert DataFrame to list of dictionaries
-        records = df.to_dict('records')
-        
-        # Create or get the collection
-        collection = db[collection_name]
-        
-        # Insert the records into the collection
-        if records:
-            collection.insert_many(records)
-            print(f"Imported {len(records)} records into {collection_name} collection")
+IMPORT_BATCH_SIZE = 1000  # documents per bulk write
+IMPORT_WORKERS = 4  # collections imported at once
+# "replace" rebuilds each collection from scratch; "upsert" updates documents
+# in place by a unique key (collections without one are replaced), so
+# re-running either mode never duplicates data;
+# "sync" writes only the rows that changed since the last sync; "embed" is
+# "replace" with EMBEDDED_RELATIONSHIPS nested into their parent collections
+IMPORT_MODE = "replace"
+
+# Fields identifying a row of the bundled datasets, used when the inferred
+# primary key is missing and no two rows of the CSV share them. Some CSVs
+# repeat rows (work.csv, subject.csv, ...); those collections have no unique
+# key and are replaced in full instead of upserted or synced by row.
+NATURAL_KEYS = {
+    # Bike_Store
+    "brands": ["brand_id"],
+    "categories": ["category_id"],
+    "customers": ["customer_id"],
+    "order_items": ["order_id", "item_id"],
+    "orders": ["order_id"],
+    "products": ["product_id"],
+    "staffs": ["staff_id"],
+    "stocks": ["store_id", "product_id"],
+    "stores": ["store_id"],
+    # FamousPaintingDB
+    "artist": ["artist_id"],
+    "canvas_size": ["size_id"],
+    "museum": ["museum_id"],
+    "museum_hours": ["museum_id", "day"],
+    "product_size": ["work_id", "size_id"],
+    "subject": ["work_id", "subject"],
+    "work": ["work_id"],
+}
+
+
+# Related rows --mode embed nests into each document of a parent collection,
+# so questions that join them need no $lookup. A relationship puts the row of
+# `from` whose `foreign` column equals the document's `local` field under
+# `field` ("many": False), or the list of all such rows ("many": True, without
+# the `foreign` column, or only their `value` column). "embed" nests further
+# relationships into the related rows. The flat collections are loaded too.
+EMBEDDED_RELATIONSHIPS = {
+    # FamousPaintingDB: works with their artist, museum, subjects and sizes
+    "work": [
+        {"field": "artist", "from": "artist", "local": "artist_id", "foreign": "artist_id", "many": False},
+        {"field": "museum", "from": "museum", "local": "museum_id", "foreign": "museum_id", "many": False},
+        {"field": "subjects", "from": "subject", "local": "work_id", "foreign": "work_id", "many": True,
+         "value": "subject"},
+        {"field": "sizes", "from": "product_size", "local": "work_id", "foreign": "work_id", "many": True,
+         "embed": [{"field": "canvas", "from": "canvas_size", "local": "size_id", "foreign": "size_id",
+                    "many": False}]},
+    ],
+    "museum": [
+        {"field": "hours", "from": "museum_hours", "local": "museum_id", "foreign": "museum_id", "many": True},
+    ],
+    # Bike_Store: orders with their customer, store and items, products with
+    # their brand and category
+    "orders": [
+        {"field": "customer", "from": "customers", "local": "customer_id", "foreign": "customer_id", "many": False},
+        {"field": "store", "from": "stores", "local": "store_id", "foreign": "store_id", "many": False},
+        {"field": "items", "from": "order_items", "local": "order_id", "foreign": "order_id", "many": True,
+         "embed": [{"field": "product", "from": "products", "local": "product_id", "foreign": "product_id",
+                    "many": False}]},
+    ],
+    "products": [
+        {"field": "brand", "from": "brands", "local": "brand_id", "foreign": "brand_id", "many": False},
+        {"field": "category", "from": "categories", "local": "category_id", "foreign": "category_id",
+         "many": False},
+    ],
+}
+
+
+# Read a CSV as lists of documents, batch_size rows at a time
+def read_batches(file_path, batch_size=IMPORT_BATCH_SIZE):
+    for chunk in pd.read_csv(file_path, chunksize=batch_size):
+        yield chunk.to_dict('records')
+
+
+# Create the indexes csv_schema inferred (unique on the primary key, plain on
+# join columns) before any data is written
+def create_indexes(collection, table):
+    for fields, unique in csv_schema.mongo_indexes(table) if table else []:
+        collection.create_index([(field, pymongo.ASCENDING) for field in fields], unique=unique)
+
+
+# The relationships of EMBEDDED_RELATIONSHIPS whose CSVs are all in directory
+def embedded_relationships(directory, collection_name):
+    def available(relationship):
+        return (os.path.exists(os.path.join(directory, relationship["from"] + ".csv"))
+                and all(available(nested) for nested in relationship.get("embed", [])))
+    return [relationship for relationship in EMBEDDED_RELATIONSHIPS.get(collection_name, []) if available(relationship)]
+
+
+# Join value of a key column. pandas reads a column with missing values as
+# floats (43.0) and one with any non-numeric value as strings ("24"), so
+# both sides are compared as text; None for missing values.
+def _join_key(value):
+    if value is None or value != value:  # NaN
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+# Rows of the relationship's CSV by their `foreign` value, with the nested
+# relationships already embedded: {value: row} or {value: [row, ...]}. Held
+# in memory; the bundled CSVs are at most a few hundred thousand rows.
+def load_related(directory, relationship):
+    rows = pd.read_csv(os.path.join(directory, relationship["from"] + ".csv")).to_dict("records")
+    for nested in relationship.get("embed", []):
+        related = load_related(directory, nested)
+        for row in rows:
+            embed_related(row, nested, related)
+    by_key = {}
+    foreign = relationship["foreign"]
+    for row in rows:
+        key = _join_key(row.get(foreign))
+        if key is None:
+            continue
+        if not relationship["many"]:
+            by_key.setdefault(key, row)
+        elif "value" in relationship:
+            by_key.setdefault(key, []).append(row[relationship["value"]])
         else:
-            print(f"No records to import for {collection_name}")
+            by_key.setdefault(key, []).append({name: value for name, value in row.items() if name != foreign})
+    return by_key
+
+
+def embed_related(document, relationship, related):
+    match = related.get(_join_key(document.get(relationship["local"])))
+    if relationship["many"]:
+        document[relationship["field"]] = match or []
+    elif match is not None:
+        document[relationship["field"]] = match
+
+
+# How the importer describes an embedded field to the LLM (see
+# mongo_schema.EMBEDDED_NOTES_COLLECTION)
+def describe_relationship(relationship):
+    if relationship["many"] and "value" in relationship:
+        text = f"array of {relationship['from']}.{relationship['value']} values"
+    elif relationship["many"]:
+        text = f"array of {relationship['from']} documents"
+    else:
+        text = f"the {relationship['from']} document"
+    text += f" whose {relationship['foreign']} equals {relationship['local']}"
+    nested = [f"{item['field']} = {describe_relationship(item)}" for item in relationship.get("embed", [])]
+    if nested:
+        text += f", each with {'; '.join(nested)}"
+    return text
+
+
+# Fields of the embedded shape worth a (multikey) index: scalar arrays such
+# as subjects and the id columns of embedded arrays such as sizes.size_id
+def embedded_index_fields(directory, relationships, prefix=""):
+    fields = []
+    for relationship in relationships:
+        path = prefix + relationship["field"]
+        if relationship["many"] and "value" in relationship:
+            fields.append(path)
+        elif relationship["many"]:
+            columns = pd.read_csv(os.path.join(directory, relationship["from"] + ".csv"), nrows=0).columns
+            fields += [f"{path}.{column}" for column in columns
+                       if csv_schema.is_id_column(column) and column != relationship["foreign"]]
+        fields += embedded_index_fields(directory, relationship.get("embed", []), path + ".")
+    return fields
+
+
+# Record which fields of each collection hold embedded documents. Collections
+# loaded flat lose their note.
+def write_embedded_notes(db, embedded, flat):
+    notes = db[mongo_schema.EMBEDDED_NOTES_COLLECTION]
+    for collection_name, relationships in embedded.items():
+        fields = {relationship["field"]: describe_relationship(relationship) for relationship in relationships}
+        notes.replace_one({"_id": collection_name}, {"_id": collection_name, "fields": fields}, upsert=True)
+    if flat:
+        notes.delete_many({"_id": {"$in": list(flat)}})
+
+
+# Index field unless an index (the unique key, ...) already starts with it
+def _ensure_index(collection, field):
+    if not any(info["key"][0][0] == field for info in collection.index_information().values()):
+        collection.create_index([(field, pymongo.ASCENDING)])
+
+
+# Index both sides of every embedded relationship in the flat collections,
+# for the $lookups embedding does not cover (from artist to work, ...)
+def create_lookup_indexes(db, collection_name, relationships):
+    for relationship in relationships:
+        _ensure_index(db[collection_name], relationship["local"])
+        _ensure_index(db[relationship["from"]], relationship["foreign"])
+        create_lookup_indexes(db, relationship["from"], relationship.get("embed", []))
+
+
+def _write(collection, requests):
+    if requests:
+        # Unordered, so the server can apply the batch in parallel and one bad
+        # document does not stop the rest
+        collection.bulk_write(requests, ordered=False)
+
+
+# Import into a staging collection, then swap it in with a single rename so
+# readers never see a half-loaded collection.
+# relationships (of EMBEDDED_RELATIONSHIPS) are embedded into every document.
+def import_replace(db, collection_name, file_path, batch_size=IMPORT_BATCH_SIZE, table=None, relationships=()):
+    staging = db[f"{collection_name}__import"]
+    staging.drop()
+    create_indexes(staging, table)
+    directory = os.path.dirname(file_path)
+    for field in embedded_index_fields(directory, relationships):
+        staging.create_index([(field, pymongo.ASCENDING)])
+    related = [(relationship, load_related(directory, relationship)) for relationship in relationships]
+    count = 0
+    for records in read_batches(file_path, batch_size):
+        for relationship, rows in related:
+            for record in records:
+                embed_related(record, relationship, rows)
+        if records:
+            staging.insert_many(records, ordered=False)
+            count += len(records)
+    if count:
+        staging.rename(collection_name, dropTarget=True)
+    else:
+        db[collection_name].drop()
+    return count
+
+
+# The fields identifying a row of the CSV: its inferred primary key, or its
+# NATURAL_KEYS when no two rows share them. [] when rows repeat.
+def unique_key(collection_name, file_path, table=None):
+    if table and table["primary_key"]:
+        return table["primary_key"]
+    natural = NATURAL_KEYS.get(collection_name)
+    if natural and csv_sync.is_unique_key(file_path, natural):
+        return natural
+    return []
+
+
+# Upserting on a key that is not unique would merge rows, so collections
+# without a unique key are replaced
+def import_upsert(db, collection_name, file_path, batch_size=IMPORT_BATCH_SIZE, table=None):
+    keys = unique_key(collection_name, file_path, table)
+    if not keys:
+        print(f"{collection_name} has no unique key; replacing it instead of upserting")
+        return import_replace(db, collection_name, file_path, batch_size, table)
+    collection = db[collection_name]
+    create_indexes(collection, table)
+    indexed = [fields for fields, _ in csv_schema.mongo_indexes(table)] if table else []
+    if list(keys) not in indexed:
+        # Without an index every upsert would scan the collection
+        collection.create_index([(key, pymongo.ASCENDING) for key in keys])
+    count = 0
+    for records in read_batches(file_path, batch_size):
+        _write(collection, [ReplaceOne({field: record[field] for field in keys}, record, upsert=True)
+                            for record in records])
+        count += len(records)
+    return count
+
+
+# Bring one collection up to date with its CSV, given the manifest entry of
+# the last sync: nothing for an unchanged file and only the changed rows for
+# a changed one. Collections that are new, got different keys or indexes,
+# have no unique key (see unique_key) or whose document count no longer
+# matches the manifest are replaced in full.
+# Returns (collection, counts, entry, seconds)
+def sync_collection(db, collection_name, file_path, entry, batch_size=IMPORT_BATCH_SIZE, table=None):
+    started_at = time.perf_counter()
+    collection = db[collection_name]
+    key = unique_key(collection_name, file_path, table)
+    schema = [[fields, unique] for fields, unique in csv_schema.mongo_indexes(table)] if table else []
+    counts = csv_sync.new_counts()
+
+    in_sync = (entry and entry["schema"] == schema and entry["key"] == key
+               and collection.estimated_document_count() == entry["row_count"])
+    if in_sync and csv_sync.unchanged(entry, file_path):
+        counts["unchanged"] = entry["row_count"]
+        return collection_name, counts, entry, time.perf_counter() - started_at
+    if in_sync and key:
+        rows = {}
+        for chunk, positions in csv_sync.diff_rows(file_path, key, entry["rows"], rows, counts, batch_size):
+            records = chunk.iloc[positions].to_dict("records")
+            _write(collection, [ReplaceOne({field: record[field] for field in key}, record, upsert=True)
+                                for record in records])
+        deleted = csv_sync.deleted_keys(entry["rows"], rows)
+        for start in range(0, len(deleted), batch_size):
+            _write(collection, [DeleteOne(dict(zip(key, values))) for values in deleted[start:start + batch_size]])
+        counts["deleted"] = len(deleted)
+        entry = csv_sync.new_entry(file_path, schema, key, rows)
+        return collection_name, counts, entry, time.perf_counter() - started_at
+
+    counts["reloaded"] = import_replace(db, collection_name, file_path, batch_size, table)
+    entry = csv_sync.record_file(file_path, schema, key, batch_size, counts["reloaded"])
+    return collection_name, counts, entry, time.perf_counter() - started_at
+
+
+def sync_csv_to_mongodb(path, db, csv_files, tables, batch_size=IMPORT_BATCH_SIZE, workers=IMPORT_WORKERS):
+    started_at = time.perf_counter()
+    manifest = csv_sync.load_manifest(path, "mongodb", db.name)
+    totals = csv_sync.new_counts()
+    rewritten = []  # collections with rows written flat
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(sync_collection, db, os.path.splitext(csv_file)[0], os.path.join(path, csv_file),
+                        manifest.get(csv_file), batch_size, tables.get(csv_schema.table_name_for(csv_file))): csv_file
+            for csv_file in csv_files
+        }
+        for future in as_completed(futures):
+            csv_file = futures[future]
+            try:
+                collection_name, counts, entry, seconds = future.result()
+            except Exception as e:
+                print(f"Failed to sync {csv_file}: {e}")
+                # Import it in full next time
+                manifest.pop(csv_file, None)
+                continue
+            manifest[csv_file] = entry
+            for name, count in counts.items():
+                totals[name] += count
+            if counts["inserted"] or counts["updated"] or counts["deleted"] or counts["reloaded"]:
+                rewritten.append(collection_name)
+            print(f"Synced {collection_name} collection in {seconds:.2f}s: {csv_sync.describe(counts)}")
+    for csv_file in set(manifest) - set(csv_files):
+        # The CSV is gone; its collection is left as it is
+        del manifest[csv_file]
+    csv_sync.save_manifest(path, "mongodb", db.name, manifest)
+    write_embedded_notes(db, {}, rewritten)
+    print(f"{csv_sync.summary(totals)} in {time.perf_counter() - started_at:.2f}s")
+
+
+def import_collection(db, collection_name, file_path, mode=IMPORT_MODE, batch_size=IMPORT_BATCH_SIZE, table=None):
+    started_at = time.perf_counter()
+    if mode == "replace":
+        count = import_replace(db, collection_name, file_path, batch_size, table)
+    elif mode == "embed":
+        relationships = embedded_relationships(os.path.dirname(file_path), collection_name)
+        count = import_replace(db, collection_name, file_path, batch_size, table, relationships)
+    elif mode == "upsert":
+        count = import_upsert(db, collection_name, file_path, batch_size, table)
+    else:
+        raise ValueError(f"Unknown import mode: {mode}")
+    return collection_name, count, time.perf_counter() - started_at
+
+
+def import_csv_to_mongodb(path=path, db_name=db_name, mode=IMPORT_MODE, batch_size=IMPORT_BATCH_SIZE,
+                          workers=IMPORT_WORKERS, client=None):
+    client = client or MongoClient(MONGO_URI)
+    db = client[db_name]
+
+    csv_files = sorted((f for f in os.listdir(path) if f.endswith('.csv')),
+                       key=lambda f: os.path.getsize(os.path.join(path, f)), reverse=True)
+    tables = csv_schema.infer_directory(path)
+    if mode == "sync":
+        sync_csv_to_mongodb(path, db, csv_files, tables, batch_size, workers)
+        return
+
+    started_at = time.perf_counter()
+    total = 0
+    imported = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(import_collection, db, os.path.splitext(csv_file)[0], os.path.join(path, csv_file),
+                        mode, batch_size, tables.get(csv_schema.table_name_for(csv_file))): csv_file
+            for csv_file in csv_files
+        }
+        for future in as_completed(futures):
+            try:
+                collection_name, count, seconds = future.result()
+            except Exception as e:
+                print(f"Failed to import {futures[future]}: {e}")
+                continue
+            total += count
+            imported.append(collection_name)
+            if count:
+                print(f"Imported {count} records into {collection_name} collection "
+                      f"in {seconds:.2f}s ({count / seconds if seconds else 0:,.0f} docs/s)")
+            else:
+                print(f"No records to import for {collection_name}")
+
+    embedded = {}
+    if mode == "embed":
+        embedded = {name: embedded_relationships(path, name) for name in imported}
+        embedded = {name: relationships for name, relationships in embedded.items() if relationships}
+        # After every collection is in place; renaming a staging collection
+        # over its target drops the indexes created on the target
+        for collection_name, relationships in embedded.items():
+            create_lookup_indexes(db, collection_name, relationships)
+            fields = ", ".join(relationship["field"] for relationship in relationships)
+            print(f"Embedded {fields} into {collection_name}")
+    write_embedded_notes(db, embedded, set(imported) - set(embedded))
+
+    elapsed = time.perf_counter() - started_at
+    summary = (f"All CSV files have been imported to the {db_name} database ({mode} mode): "
+               f"{total} records in {elapsed:.2f}s ({total / elapsed if elapsed else 0:,.0f} docs/s)")
+    peak_memory = result_stream.peak_memory_mb()
+    if peak_memory is not None:
+        summary += f", peak memory {peak_memory:.1f} MB"
+    print(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a directory of CSV files into a MongoDB database")
+    parser.add_argument("path", nargs="?", default=path, help="directory containing CSV files")
+    parser.add_argument("--database", default=db_name)
+    parser.add_argument("--mode", choices=["replace", "upsert", "sync", "embed"], default=IMPORT_MODE)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+    import_csv_to_mongodb(args.path, args.database, args.mode, args.batch_size, args.workers)
 
-    print(f"All CSV files have been imported to the {db_name} database.") 
 
 if __name__ == "__main__":
-    import_csv_to_mongodb()
\ No newline at end of file
+    main()
@@ -0,0 +1,195 @@
+import difflib
+import re
+import threading
+
+# Local answers below this confidence are sent to the LLM instead
+INTENT_CONFIDENCE_THRESHOLD = 0.8
+
+COMMANDS = ["list", "switch", "select", "query", "schema_tables", "schema_columns", "schema_sample", "schema", "exit"]
+
+# Words the rules look for; typos of these are corrected before matching
+KEYWORDS = [
+    "list", "show", "display", "view", "switch", "change", "select", "use", "open", "connect",
+    "database", "databases", "schema", "structure", "table", "tables", "collection", "collections",
+    "column", "columns", "field", "fields", "attribute", "attributes", "describe", "sample",
+    "example", "row", "document", "record", "exit", "quit", "mongodb", "mongo", "mysql", "sql",
+]
+
+# Not "q" or "stop": they also end the result pager, and a stray one at the
+# prompt (or a server session) must not quit
+EXIT_WORDS = {"exit", "quit", "bye", "goodbye"}
+DBMS_ALIASES = {"sql": "sql", "mysql": "sql", "mongodb": "mongodb", "mongo": "mongodb"}
+TABLE_WORDS = r"(?:tables?|collections?)"
+COLUMN_WORDS = r"(?:columns?|fields?|attributes?|structure)"
+SAMPLE_WORDS = r"(?:sample|example)(?: (?:row|document|record))?s?"
+# Optional lead-in such as "show me the " or "give me a "
+PREFIX = r"(?:(?:show|display|view|get|give|list|describe|what are|what is) )?(?:me )?(?:(?:all|the|an?|one) )?"
+
+# Phrases that usually start a question about the data
+QUERY_HINTS = [
+    "how many", "how much", "which", "what is", "what are", "who", "when", "where",
+    "find", "get", "give me", "show me", "list all", "top", "average", "avg", "total",
+    "count", "sum", "max", "min", "most", "least", "per", "by", "insert", "add", "update",
+    "delete", "remove", "sorted", "order", "between", "greater", "less",
+]
+
+_stats = {"local": 0, "llm": 0}
+_stats_lock = threading.Lock()
+
+
+def _normalize(text):
+    text = text.lower().strip()
+    text = re.sub(r"[^\w\s.-]", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .")
+
+
+# Correct typos of known keywords, e.g. "lsit databses" -> "list databases";
+# returns the corrected text and how many words were changed
+def _correct_keywords(text, protected):
+    words = []
+    corrections = 0
+    for word in text.split():
+        if len(word) >= 4 and word not in KEYWORDS and word not in protected:
+            match = difflib.get_close_matches(word, KEYWORDS, n=1, cutoff=0.75)
+            if match:
+                word = match[0]
+                corrections += 1
+        words.append(word)
+    return " ".join(words), corrections
+
+
+# Match a name from the input against known database/table names, tolerating
+# case, spaces instead of underscores, plurals and small typos
+def match_name(candidate, names):
+    if not candidate:
+        return None, 0.0
+    candidate = candidate.strip().lower()
+    by_key = {name.lower(): name for name in names}
+    variants = [candidate, candidate.replace(" ", "_"), candidate.replace(" ", "")]
+    for variant in list(variants):
+        if variant.endswith("s"):
+            variants.append(variant[:-1])
+    for variant in variants:
+        if variant in by_key:
+            return by_key[variant], 1.0
+    match = difflib.get_close_matches(variants[1], list(by_key), n=1, cutoff=0.75)
+    if match:
+        return by_key[match[0]], difflib.SequenceMatcher(None, variants[1], match[0]).ratio()
+    return None, 0.0
+
+
+def _target(raw, names):
+    # "in the bike_store database" -> "bike_store"
+    raw = re.sub(r"^(?:the|a|an)\s+", "", raw.strip())
+    raw = re.sub(r"\s+(?:database|db|table|collection)$", "", raw)
+    raw = re.sub(r"^(?:database|db|table|collection)\s+", "", raw)
+    name, score = match_name(raw, names)
+    return (name, score) if name else (raw, 0.0)
+
+
+# Classify input locally; returns (command, target, confidence)
+def classify(user_input, database_names=(), table_names=()):
+    text = _normalize(user_input)
+    if not text:
+        return "unknown", "", 0.0
+    protected = {name.lower() for name in list(database_names) + list(table_names)}
+    text, corrections = _correct_keywords(text, protected)
+    penalty = 0.05 * corrections
+
+    command, target, confidence = _classify_rules(text, user_input.strip(), database_names, table_names)
+    return command, target, max(confidence - penalty, 0.0)
+
+
+def _classify_rules(text, original, database_names, table_names):
+    if text in EXIT_WORDS or re.fullmatch(r"(?:please )?(?:exit|quit)(?: the)?(?: program| chat)?", text):
+        return "exit", "", 1.0
+
+    # A raw SQL statement is a query, not the "select" command
+    if re.match(r"(?:select\s.+\sfrom\s|(?:insert|update|delete)\s)", original, re.IGNORECASE | re.DOTALL):
+        return "query", original, 0.9
+
+    match = re.fullmatch(r"(?:switch|change|go|move)(?: over)?(?: to)? (?:the )?(sql|mysql|mongo|mongodb|mongo db)(?: database| db)?", text)
+    if match:
+        return "switch", DBMS_ALIASES[match.group(1).replace(" ", "")], 0.95
+    match = re.fullmatch(r"use (sql|mysql|mongo|mongodb)", text)
+    if match:
+        return "switch", DBMS_ALIASES[match.group(1)], 0.9
+
+    if re.fullmatch(r"(?:list|show|display|view|what are|which are)(?: me)?(?: all)?(?: the)?(?: available)? databases(?: are there| available)?", text) \
+            or text in ("databases", "what databases are there", "which databases do we have"):
+        return "list", "", 0.95
+
+    match = re.fullmatch(r"(?:list|show|display|view|what are)(?: me)?(?: all)?(?: the)? " + TABLE_WORDS + r"(?: (?:in|of|from) (.+))?", text)
+    if match or text in ("tables", "collections"):
+        target = ""
+        confidence = 0.95
+        if match and match.group(1):
+            target, score = _target(match.group(1), database_names)
+            confidence = 0.9 if score else 0.6
+        return "schema_tables", target, confidence
+
+    match = re.fullmatch(PREFIX + r"(?:(?:full|complete|whole|database) )?schema(?: (?:of|for|in) (.+))?", text) \
+        or re.fullmatch(r"describe (?:the )?database(?: (.+))?", text)
+    if match:
+        target = ""
+        confidence = 0.95
+        if match.group(1):
+            target, score = _target(match.group(1), database_names)
+            confidence = 0.9 if score else 0.6
+        return "schema", target, confidence
+
+    match = re.fullmatch(PREFIX + SAMPLE_WORDS + r" (?:from|of|in|for) (.+)", text)
+    if match:
+        target, score = _target(match.group(1), table_names)
+        return "schema_sample", target, 0.9 if score else 0.6
+
+    match = re.fullmatch(PREFIX + COLUMN_WORDS + r" (?:of|in|for|from) (.+)", text) \
+        or re.fullmatch(r"describe (?:the )?(?:table |collection )?(.+)", text)
+    if match:
+        target, score = _target(match.group(1), table_names)
+        return "schema_columns", target, 0.9 if score else 0.6
+
+    match = re.fullmatch(r"(?:use|select|open|connect to|switch to)(?: the)?(?: database| db)? (.+)", text)
+    if match:
+        target, score = _target(match.group(1), database_names)
+        if score:
+            return "select", target, 0.95 if score == 1.0 else 0.85
+        return "select", target, 0.6
+
+    return "query", original, _query_confidence(text, table_names)
+
+
+# Questions about the data: confident only when they both read like a request
+# and mention a known table/collection
+def _query_confidence(text, table_names):
+    words = text.split()
+    if len(words) < 3:
+        return 0.3
+    confidence = 0.5
+    padded = f" {text} "
+    if any(f" {hint} " in padded for hint in QUERY_HINTS):
+        confidence += 0.2
+    if any(match_name(word, table_names)[1] >= 0.9 for word in words if len(word) > 2):
+        confidence += 0.2
+    return confidence
+
+
+# Record whether a request was answered locally or by the LLM
+def record(local):
+    with _stats_lock:
+        _stats["local" if local else "llm"] += 1
+
+
+def stats():
+    with _stats_lock:
+        local, llm = _stats["local"], _stats["llm"]
+    total = local + llm
+    return {"local": local, "llm": llm, "total": total, "hit_rate": local / total if total else 0.0}
+
+
+def summary():
+    current = stats()
+    return (
+        f"Local intent classifier resolved {current['local']}/{current['total']} requests "
+        f"({current['hit_rate']:.0%}), saving {current['local']} LLM call(s)."
+    )
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")  ## enter your own api key
+LLM_MODEL = "gemini-2.0-flash"
+
+# "gemini" talks to the API, "record" talks to the API and saves every
+# response, "replay" answers from the recording without any network access
+LLM_BACKEND = os.environ.get("CHATDB_LLM_BACKEND", "gemini")
+LLM_RECORDING_PATH = os.environ.get("CHATDB_LLM_RECORDING", "llm_recording.json")
+
+LLM_TIMEOUT = 30  # seconds per call
+LLM_MAX_RETRIES = 3  # extra attempts after a timed out, dropped, rate limited (429) or server error (5xx) call
+LLM_RETRY_BASE_DELAY = 0.5  # seconds; doubled on every retry, with jitter
+LLM_RATE_PER_SECOND = 2.0  # sustained calls per second
+LLM_BURST = 5  # calls allowed back to back before the rate applies
+LLM_MAX_CONCURRENCY = 4  # calls in flight at once
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMReplayMissError(LLMError):
+    pass
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+# Whether a failed call is worth repeating: timeouts, dropped or refused
+# connections, rate limiting and server errors. Anything else (a bad request,
+# a blocked prompt, a missing key) fails the same way again.
+def is_retryable(error):
+    if isinstance(error, (LLMTimeoutError, ConnectionError)):
+        return True
+    # httpx errors only exist once the client has imported httpx
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return isinstance(status, int) and (status == 429 or 500 <= status < 600)
+
+
+# Token bucket: `rate` tokens per second, holding at most `burst`
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class LLMBackend:
+    # Subclasses implement _generate(prompt, timeout) -> text, giving up with
+    # LLMTimeoutError after timeout seconds (None: no limit); generate() adds
+    # rate limiting, a concurrency cap, retries and usage accounting
+    def __init__(self, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, rate=LLM_RATE_PER_SECOND,
+                 burst=LLM_BURST, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.usage = {"calls": 0, "retries": 0, "failures": 0, "prompt_chars": 0, "response_chars": 0, "seconds": 0.0}
+        self.usage_lock = threading.Lock()
+
+    def _generate(self, prompt, timeout):
+        raise NotImplementedError
+
+    def _count(self, **values):
+        with self.usage_lock:
+            for key, value in values.items():
+                self.usage[key] += value
+
+    # The call runs on the caller's thread with the timeout enforced by the
+    # client, so a call that gives up holds no thread or slot afterwards
+    def _call_once(self, prompt, timeout):
+        if self.bucket:
+            self.bucket.acquire()
+        with self.slots:
+            return self._generate(prompt, timeout)
+
+    # timeout, when given, bounds the whole call including retries; each
+    # attempt still gets at most self.timeout
+    def generate(self, prompt, timeout=None):
+        started_at = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempt = 0
+        while True:
+            attempt_timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._count(failures=1, seconds=time.perf_counter() - started_at)
+                    raise LLMTimeoutError("LLM call not made: the time budget for this request is spent")
+                attempt_timeout = remaining if attempt_timeout is None else min(attempt_timeout, remaining)
+            try:
+                text = self._call_once(prompt, attempt_timeout)
+                self._count(calls=1, prompt_chars=len(prompt), response_chars=len(text),
+                            seconds=time.perf_counter() - started_at)
+                return text
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count(failures=1, seconds=time.perf_counter() - started_at)
+                    raise
+                attempt += 1
+                self._count(retries=1)
+                # Exponential backoff with full jitter, within the deadline
+                delay = random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+                if deadline is not None:
+                    delay = max(0, min(delay, deadline - time.monotonic()))
+                time.sleep(delay)
+
+    def stats(self):
+        with self.usage_lock:
+            usage = dict(self.usage)
+        # Roughly four characters per token for English text and code
+        usage["prompt_tokens"] = usage["prompt_chars"] // 4
+        usage["response_tokens"] = usage["response_chars"] // 4
+        return usage
+
+    def summary(self):
+        usage = self.stats()
+        return (
+            f"LLM usage: {usage['calls']} call(s), {usage['retries']} retr(ies), {usage['failures']} failure(s), "
+            f"~{usage['prompt_tokens']} prompt / ~{usage['response_tokens']} response tokens, "
+            f"{usage['seconds']:.1f}s waiting"
+        )
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, api_key=GEMINI_API_KEY, model=LLM_MODEL, **options):
+        super().__init__(**options)
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                from google import genai
+
+                self._client = genai.Client(api_key=self.api_key)
+            return self._client
+
+    def _generate(self, prompt, timeout):
+        import httpx
+        from google.genai import types
+
+        config = None
+        if timeout is not None:
+            # The HTTP client's own timeout, in milliseconds
+            config = types.GenerateContentConfig(http_options=types.HttpOptions(timeout=max(1, int(timeout * 1000))))
+        try:
+            response = self._get_client().models.generate_content(model=self.model, contents=prompt, config=config)
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"LLM call timed out after {timeout:.1f}s") from e
+        return response.text
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def _read_recording(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+# Calls the wrapped backend and appends every prompt/response pair to a JSON file
+class RecordingBackend(LLMBackend):
+    def __init__(self, inner, path=LLM_RECORDING_PATH):
+        # Timeouts, retries and rate limiting are left to the wrapped backend
+        super().__init__(timeout=None, max_retries=0, rate=None)
+        self.inner = inner
+        self.path = path
+        self.entries = _read_recording(path)
+        self.lock = threading.Lock()
+
+    def _generate(self, prompt, timeout):
+        text = self.inner.generate(prompt, timeout)
+        with self.lock:
+            self.entries.append({"key": prompt_key(prompt), "prompt": prompt, "response": text})
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, indent=2)
+        return text
+
+    def stats(self):
+        return self.inner.stats()
+
+
+# Answers from a recording without network access. An entry matches when its
+# key is the hash of the prompt, or else when all of its "contains" texts
+# appear in the prompt (the most specific entry wins), so recordings can be
+# written by hand for a question regardless of the schema text around it.
+class ReplayBackend(LLMBackend):
+    def __init__(self, path=LLM_RECORDING_PATH, latency=0.0, **options):
+        options.setdefault("rate", None)
+        options.setdefault("max_retries", 0)
+        super().__init__(**options)
+        self.latency = latency
+        entries = _read_recording(path)
+        self.by_key = {entry["key"]: entry["response"] for entry in entries if entry.get("key")}
+        self.by_text = []
+        for entry in entries:
+            texts = entry.get("contains")
+            if texts:
+                texts = [texts] if isinstance(texts, str) else texts
+                self.by_text.append((texts, entry["response"]))
+        self.by_text.sort(key=lambda pair: -sum(len(text) for text in pair[0]))
+
+    def _generate(self, prompt, timeout):
+        if self.latency:
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise LLMTimeoutError(f"LLM call timed out after {timeout:.1f}s")
+            time.sleep(self.latency)
+        response = self.by_key.get(prompt_key(prompt))
+        if response is not None:
+            return response
+        for texts, response in self.by_text:
+            if all(text in prompt for text in texts):
+                return response
+        raise LLMReplayMissError(f"No recorded response for prompt {prompt_key(prompt)[:12]}")
+
+
+def create_backend(kind=LLM_BACKEND, path=LLM_RECORDING_PATH):
+    if kind == "gemini":
+        return GeminiBackend()
+    if kind == "record":
+        return RecordingBackend(GeminiBackend(), path)
+    if kind == "replay":
+        return ReplayBackend(path)
+    raise ValueError(f"Unknown LLM backend: {kind}")
@@ -1,61 +1,349 @@
+import argparse
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
-from sqlalchemy import create_engine
 import mysql.connector
 from mysql.connector import errorcode
 
+import analytics_replica
+import connection_manager
+import csv_schema
+import csv_sync
+
 # Database connection details
 db_user = "tempuser" ## Change this to your username
 db_password = "TestPass123!" ## Change this to your password
 db_host = "localhost"  # e.g., "localhost"
 db_name = "famous_painters_db" ## Change this to the name of the database you want to create
 
-# Create a MySQL connection (without selecting a specific database initially)
-conn = mysql.connector.connect(
-    user=db_user, password=db_password, host=db_host
-)
+# Directory containing CSV files
+csv_directory = "FamousPaintingDB"  # Change this to your CSV directory (or pass it on the command line)
+
+LOAD_CHUNK_SIZE = 5000  # CSV rows read and inserted per batch
+LOAD_WORKERS = 4  # tables loaded in parallel, one process each
+
+
+def connect(database=None, **options):
+    return mysql.connector.connect(user=db_user, password=db_password, host=db_host, database=database, **options)
 
-cursor = conn.cursor()
 
 # Check if the database exists, create it if not
-try:
-    cursor.execute(f"USE {db_name}")
-except mysql.connector.Error as err:
-    if err.errno == errorcode.ER_BAD_DB_ERROR:
-        print(f"Database '{db_name}' does not exist. Creating it...")
-        cursor.execute(f"CREATE DATABASE {db_name}")
-        print(f"Database '{db_name}' created successfully.")
+def ensure_database(database):
+    conn = connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"USE `{database}`")
+    except mysql.connector.Error as err:
+        if err.errno != errorcode.ER_BAD_DB_ERROR:
+            raise
+        print(f"Database '{database}' does not exist. Creating it...")
+        cursor.execute(f"CREATE DATABASE `{database}`")
+        print(f"Database '{database}' created successfully.")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# Replace the table with one built from the inferred schema: narrow types,
+# primary key, join column indexes and foreign keys. With keys=False only the
+# primary key is created; csv_schema.add_keys_sql adds the rest.
+def create_table(cursor, table, keys=True):
+    cursor.execute(f"DROP TABLE IF EXISTS `{table['table']}`")
+    cursor.execute(csv_schema.create_table_sql(table, keys=keys))
+
+
+# Stream the CSV in chunks; each chunk is sent as one multi-row INSERT
+def insert_chunks(conn, cursor, path, table, columns, chunk_size):
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    statement = f"INSERT INTO `{table}` ({column_list}) VALUES ({placeholders})"
+    rows = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        cursor.executemany(statement, list(chunk.itertuples(index=False, name=None)))
         conn.commit()
-    else:
-        print(f"Error: {err}")
+        rows += len(chunk)
+    return rows
+
+
+# The line ending of a CSV: "\r\n" for files written on Windows, else "\n"
+def line_terminator(path):
+    with open(path, "rb") as f:
+        return "\\r\\n" if f.readline().endswith(b"\r\n") else "\\n"
+
+
+# Hand the whole file to the server; empty fields become NULL
+def load_data_infile(conn, cursor, path, table, columns):
+    variables = ", ".join(f"@v{i}" for i in range(len(columns)))
+    assignments = []
+    for i, (column, sql_type) in enumerate((column["name"], column["type"]) for column in columns):
+        value = f"NULLIF(@v{i}, '')"
+        if sql_type == "BOOLEAN":
+            # pandas writes booleans as True/False
+            value = f"{value} IN ('True', 'true', '1')"
+        assignments.append(f"`{column}` = {value}")
+    assignments = ", ".join(assignments)
+    cursor.execute(
+        f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table}` "
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+        f"LINES TERMINATED BY '{line_terminator(path)}' IGNORE 1 LINES "
+        f"({variables}) SET {assignments}",
+        (os.path.abspath(path),),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+# Create and fill one table from its inferred schema (see csv_schema.py).
+# Runs in a worker process with its own connection. Returns (table, rows, seconds)
+def load_table(table, database, chunk_size=LOAD_CHUNK_SIZE, use_load_data=False):
+    started_at = time.perf_counter()
+    path = table["path"]
+
+    conn = connect(database, allow_local_infile=use_load_data)
+    cursor = conn.cursor()
+    try:
+        # Skip per-row constraint checks while the table fills. Secondary
+        # indexes and foreign keys are added once the rows are in, as InnoDB
+        # maintains every index row by row (it ignores DISABLE KEYS) but
+        # builds a new one from the whole table in a single sorted pass.
+        cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+        create_table(cursor, table, keys=False)
+        name = table["table"]
+        if use_load_data:
+            rows = load_data_infile(conn, cursor, path, name, table["columns"])
+        else:
+            columns = [column["name"] for column in table["columns"]]
+            rows = insert_chunks(conn, cursor, path, name, columns, chunk_size)
+        statement = csv_schema.add_keys_sql(table)
+        if statement:
+            cursor.execute(statement)
+        cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+    finally:
         cursor.close()
         conn.close()
-        exit()
+    return table["table"], rows, time.perf_counter() - started_at
 
-# Close the initial connection to create the engine with the new database
-cursor.close()
-conn.close()
 
-# Create a SQLAlchemy engine with the newly created or existing database
-engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
+def _row_count(cursor, name):
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM `{name}`")
+    except mysql.connector.Error as err:
+        if err.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+        return None
+    return cursor.fetchone()[0]
 
-# Directory containing CSV files
-csv_directory = "FamousPaintingDB"  # Change this to your CSV directory
-
-# Loop through all CSV files in the directory
-for file in os.listdir(csv_directory):
-    if file.endswith(".csv"):
-        file_path = os.path.join(csv_directory, file)
-        
-        # Load CSV into DataFrame
-        df = pd.read_csv(file_path)
-        
-        # Convert filename to table name (remove extension, replace spaces)
-        table_name = os.path.splitext(file)[0].replace(" ", "_")
-        
-        # Save DataFrame to MySQL
-        df.to_sql(table_name, engine, if_exists="replace", index=False)
-
-        print(f"Table '{table_name}' created successfully with {len(df)} records.")
-
-print("All CSV files have been loaded into MySQL.")
+
+# Apply the rows of a changed CSV that differ from the last sync: one
+# INSERT ... ON DUPLICATE KEY UPDATE for inserted and updated rows, a DELETE
+# by primary key for the rest. Fills rows and counts (see csv_sync.diff_rows)
+def apply_changes(conn, cursor, table, old_rows, rows, counts, chunk_size):
+    name, key = table["table"], table["primary_key"]
+    columns = [column["name"] for column in table["columns"]]
+    updates = [column for column in columns if column not in key] or key[:1]
+    statement = (
+        f"INSERT INTO `{name}` ({', '.join(f'`{column}`' for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON DUPLICATE KEY UPDATE {', '.join(f'`{column}` = VALUES(`{column}`)' for column in updates)}"
+    )
+    # Rows may arrive before the rows they reference, or outlive them
+    cursor.execute("SET SESSION foreign_key_checks = 0")
+    for chunk, positions in csv_sync.diff_rows(table["path"], key, old_rows, rows, counts, chunk_size):
+        chunk = chunk.iloc[positions]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        cursor.executemany(statement, list(chunk.itertuples(index=False, name=None)))
+        conn.commit()
+
+    deleted = csv_sync.deleted_keys(old_rows, rows)
+    statement = f"DELETE FROM `{name}` WHERE " + " AND ".join(f"`{column}` = %s" for column in key)
+    for start in range(0, len(deleted), chunk_size):
+        cursor.executemany(statement, [tuple(values) for values in deleted[start:start + chunk_size]])
+        conn.commit()
+    counts["deleted"] = len(deleted)
+    cursor.execute("SET SESSION foreign_key_checks = 1")
+
+
+# Bring one table up to date with its CSV, given the manifest entry of the
+# last sync: nothing for an unchanged file and only the changed rows for a
+# changed one. Tables that are new, changed schema, have no primary key or
+# whose row count no longer matches the manifest are loaded in full.
+# Returns (table, counts, entry, seconds)
+def sync_table(table, database, entry, chunk_size=LOAD_CHUNK_SIZE, use_load_data=False):
+    started_at = time.perf_counter()
+    name, path, key = table["table"], table["path"], table["primary_key"]
+    schema = csv_schema.create_table_sql(table)
+    counts = csv_sync.new_counts()
+
+    conn = connect(database)
+    cursor = conn.cursor()
+    try:
+        in_sync = (entry and entry["schema"] == schema and entry["key"] == key
+                   and _row_count(cursor, name) == entry["row_count"])
+        if in_sync and csv_sync.unchanged(entry, path):
+            counts["unchanged"] = entry["row_count"]
+            return name, counts, entry, time.perf_counter() - started_at
+        if in_sync and key:
+            rows = {}
+            apply_changes(conn, cursor, table, entry["rows"], rows, counts, chunk_size)
+            return name, counts, csv_sync.new_entry(path, schema, key, rows), time.perf_counter() - started_at
+    finally:
+        cursor.close()
+        conn.close()
+
+    _, counts["reloaded"], _ = load_table(table, database, chunk_size, use_load_data)
+    entry = csv_sync.record_file(path, schema, key, chunk_size, counts["reloaded"])
+    return name, counts, entry, time.perf_counter() - started_at
+
+
+# Load every CSV in directory into database, largest files first so the long
+# tables start early and the small ones fill in around them. With sync, only
+# the changes since the last sync are applied (see sync_table). The
+# analytical replica is then brought up to date (see refresh_replica); with
+# replica, it is created if there is none yet.
+def load_directory(directory, database, workers=LOAD_WORKERS, chunk_size=LOAD_CHUNK_SIZE, use_load_data=False,
+                   sync=False, replica=False):
+    ensure_database(database)
+    started_at = time.perf_counter()
+    tables = csv_schema.infer_directory(directory)
+    print(f"Inferred the schema of {len(tables)} table(s) in {time.perf_counter() - started_at:.2f}s:")
+    for table in tables.values():
+        keys = f"primary key ({', '.join(table['primary_key'])})" if table["primary_key"] else "no primary key"
+        references = ", ".join(f"{fk['column']} -> {fk['ref_table']}" for fk in table["foreign_keys"])
+        print(f"  {table['table']}: {keys}" + (f"; references {references}" if references else ""))
+
+    started_at = time.perf_counter()
+    total_rows = 0
+    ordered = sorted(tables.values(), key=lambda table: os.path.getsize(table["path"]), reverse=True)
+    if sync:
+        synced = sync_directory(directory, database, ordered, workers, chunk_size, use_load_data)
+        # Tables the sync left alone keep their copy as well
+        unchanged = [name for name, counts in synced.items() if counts["unchanged"] and not any(
+            counts[change] for change in ("inserted", "updated", "deleted", "reloaded"))]
+        refresh_replica(database, tables, list(synced), unchanged, replica)
+        return
+    loaded = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(load_table, table, database, chunk_size, use_load_data): table["path"]
+                   for table in ordered}
+        for future in as_completed(futures):
+            try:
+                table, rows, seconds = future.result()
+            except Exception as e:
+                print(f"Failed to load {futures[future]}: {e}")
+                continue
+            total_rows += rows
+            loaded.append(table)
+            print(f"Table '{table}' created successfully with {rows} records "
+                  f"in {seconds:.2f}s ({rows / seconds if seconds else 0:,.0f} rows/s).")
+
+    elapsed = time.perf_counter() - started_at
+    print(f"All CSV files have been loaded into MySQL: {total_rows} records in {elapsed:.2f}s "
+          f"({total_rows / elapsed if elapsed else 0:,.0f} rows/s).")
+    refresh_replica(database, tables, loaded, create=replica)
+
+
+# The server's version of each table, recorded with its copy in the replica
+def server_versions(database, names):
+    conn = connect(database)
+    cursor = conn.cursor(buffered=True)
+
+    def execute(sql):
+        cursor.execute(sql)
+        return cursor
+
+    try:
+        connection_manager.prepare_mysql(conn)
+        return analytics_replica.server_versions(execute, [(database, name) for name in names])
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# Copy the loaded tables (names, of the csv_schema tables) to the analytical
+# replica and drop the copies of tables that failed to load, so a replica is
+# never left holding data the server no longer has. Runs on every load when
+# a replica exists, and creates one with create. Tables in keep stay as they
+# are if their CSV did not change. A replica that cannot be refreshed is
+# removed, and reads go to the server until the next --replica load.
+def refresh_replica(database, tables, loaded, keep=(), create=False):
+    path = analytics_replica.REPLICA_PATH
+    if not create and not os.path.exists(path):
+        return
+    started_at = time.perf_counter()
+    failed = [name for name in tables if name not in loaded]
+    try:
+        if analytics_replica.load_duckdb() is None:
+            raise RuntimeError("the analytical replica needs duckdb (pip install duckdb)")
+        versions = server_versions(database, loaded)
+        results = analytics_replica.refresh(database, [tables[name] for name in loaded], keep=keep,
+                                            versions=versions, drop=failed)
+    except Exception as e:
+        print(f"Failed to refresh the analytical replica: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Removed {path}; reads go to the server until it is rebuilt with --replica.")
+        return
+    copied = {table: rows for table, rows in results.items() if rows is not None}
+    print(f"Analytical replica {analytics_replica.REPLICA_PATH}: {len(copied)} table(s) copied "
+          f"({sum(copied.values())} records), {len(results) - len(copied)} unchanged, {len(failed)} dropped, "
+          f"in {time.perf_counter() - started_at:.2f}s.")
+
+
+# Returns {table: counts} of the tables that synced
+def sync_directory(directory, database, tables, workers=LOAD_WORKERS, chunk_size=LOAD_CHUNK_SIZE,
+                   use_load_data=False):
+    started_at = time.perf_counter()
+    manifest = csv_sync.load_manifest(directory, "mysql", database)
+    totals = csv_sync.new_counts()
+    synced = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for table in tables:
+            file = os.path.basename(table["path"])
+            future = pool.submit(sync_table, table, database, manifest.get(file), chunk_size, use_load_data)
+            futures[future] = file
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                table, counts, entry, seconds = future.result()
+            except Exception as e:
+                print(f"Failed to sync {file}: {e}")
+                # Load it in full next time
+                manifest.pop(file, None)
+                continue
+            manifest[file] = entry
+            synced[table] = counts
+            for name, count in counts.items():
+                totals[name] += count
+            print(f"Table '{table}' synced in {seconds:.2f}s: {csv_sync.describe(counts)}.")
+    for file in set(manifest) - {os.path.basename(table["path"]) for table in tables}:
+        # The CSV is gone; its table is left as it is
+        del manifest[file]
+    csv_sync.save_manifest(directory, "mysql", database, manifest)
+    print(f"{csv_sync.summary(totals)} in {time.perf_counter() - started_at:.2f}s.")
+    return synced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a directory of CSV files into a MySQL database")
+    parser.add_argument("directory", nargs="?", default=csv_directory, help="directory containing CSV files")
+    parser.add_argument("--database", default=db_name)
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=LOAD_CHUNK_SIZE)
+    parser.add_argument("--load-data", action="store_true",
+                        help="use LOAD DATA LOCAL INFILE (the server needs local_infile=1)")
+    parser.add_argument("--sync", action="store_true",
+                        help="apply only the rows that changed since the last --sync run")
+    parser.add_argument("--replica", action="store_true",
+                        help="create the DuckDB analytical replica if there is none (needs duckdb); an existing "
+                             "one is refreshed on every load")
+    args = parser.parse_args()
+    load_directory(args.directory, args.database, args.workers, args.chunk_size, args.load_data, args.sync,
+                   args.replica)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Drive a running chat_server.py with concurrent simulated analysts. Each user
+# opens a session, sends the messages in turn (cycling through them) over a
+# keep-alive connection and closes the session; the report gives requests/sec
+# and latency percentiles per command.
+
+LOAD_TEST_URL = "http://127.0.0.1:8080"
+LOAD_TEST_USERS = 16
+LOAD_TEST_REQUESTS = 50  # messages per user
+# Commands the local intent classifier answers, so the run measures the
+# server rather than the LLM. Pass --messages for a file of real questions.
+LOAD_TEST_MESSAGES = ["list databases", "show tables", "show schema"]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def read_messages(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=300)
+
+    def call(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        self.conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        data = response.read()
+        return response.status, json.loads(data) if data else None
+
+    def close(self):
+        self.conn.close()
+
+
+def run_user(url, messages, requests, dbms, database, records):
+    client = Client(url)
+    try:
+        status, session = client.call("POST", "/sessions", {"dbms": dbms, "database": database})
+        if status != 201:
+            records.append({"command": "session", "status": status, "latency": 0.0, "error": True})
+            return
+        path = f"/sessions/{session['session_id']}/messages"
+        for i in range(requests):
+            started_at = time.perf_counter()
+            try:
+                status, response = client.call("POST", path, {"input": messages[i % len(messages)]})
+                error = status != 200 or bool(response.get("error"))
+                command = response.get("command", "error")
+            except (OSError, http.client.HTTPException, ValueError):
+                status, error, command = None, True, "error"
+                client.close()
+            records.append({"command": command, "status": status, "latency": time.perf_counter() - started_at,
+                            "error": error})
+        client.call("DELETE", f"/sessions/{session['session_id']}")
+    finally:
+        client.close()
+
+
+def run_load_test(url=LOAD_TEST_URL, users=LOAD_TEST_USERS, requests=LOAD_TEST_REQUESTS,
+                  messages=LOAD_TEST_MESSAGES, dbms="sql", database=None):
+    records = []
+    threads = [threading.Thread(target=run_user, args=(url, messages, requests, dbms, database, records))
+               for _ in range(users)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started_at
+
+
+def print_report(records, elapsed):
+    latencies = [record["latency"] for record in records if record["status"] is not None]
+    errors = sum(1 for record in records if record["error"])
+    rejected = sum(1 for record in records if record["status"] == 503)
+    print(f"\n{len(records)} request(s) in {elapsed:.2f}s: {len(records) / elapsed if elapsed else 0:,.1f} req/s, "
+          f"{errors} error(s) ({rejected} rejected as busy)")
+    if not latencies:
+        return
+    print(f"{'command':<16} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    groups = {"all": latencies}
+    for record in records:
+        if record["status"] is not None:
+            groups.setdefault(record["command"], []).append(record["latency"])
+    for command, values in groups.items():
+        print(f"{command:<16} {len(values):>7} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 95) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f} "
+              f"{max(values) * 1000:>9.1f}")
+    print(f"mean latency {statistics.mean(latencies) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running chat_server.py")
+    parser.add_argument("--url", default=LOAD_TEST_URL)
+    parser.add_argument("--users", type=int, default=LOAD_TEST_USERS, help="concurrent sessions")
+    parser.add_argument("--requests", type=int, default=LOAD_TEST_REQUESTS, help="messages per session")
+    parser.add_argument("--messages", help="file with one message per line")
+    parser.add_argument("--dbms", choices=["sql", "mongodb"], default="sql")
+    parser.add_argument("--database", help="database each session starts in")
+    args = parser.parse_args()
+
+    messages = read_messages(args.messages) if args.messages else LOAD_TEST_MESSAGES
+    records, elapsed = run_load_test(args.url, args.users, args.requests, messages, args.dbms, args.database)
+    print_report(records, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Where stage spans go; leave unset to keep metrics in memory only
+METRICS_TRACE_PATH = os.environ.get("CHATDB_TRACE")  # JSONL, one line per span
+METRICS_PROMETHEUS_PATH = os.environ.get("CHATDB_METRICS_FILE")  # rewritten after every request
+METRICS_HTTP_PORT = int(os.environ.get("CHATDB_METRICS_PORT", "0"))  # serves /metrics when set
+PROFILE_PATH = os.environ.get("CHATDB_PROFILE")  # cProfile stats of execute_query, rows fetched included
+
+DURATION_BUCKETS = [0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+COUNT_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000]
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_gauges = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> bucket bounds, per-bucket counts, sum and count
+_help = {}
+_local = threading.local()
+_trace_file = None
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name, value=1, help_text="", **labels):
+    with _lock:
+        key = (name, _labels(labels))
+        _counters[key] = _counters.get(key, 0) + value
+        _help.setdefault(name, (help_text, "counter"))
+
+
+def set_gauge(name, value, help_text="", **labels):
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+        _help.setdefault(name, (help_text, "gauge"))
+
+
+# Sum of a counter over all its label values
+def counter_total(name):
+    with _lock:
+        return sum(value for (counter, _), value in _counters.items() if counter == name)
+
+
+def observe(name, value, buckets=DURATION_BUCKETS, help_text="", **labels):
+    with _lock:
+        key = (name, _labels(labels))
+        entry = _histograms.setdefault(key, {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(entry["buckets"]):
+            if value <= bound:
+                entry["counts"][i] += 1
+        entry["sum"] += value
+        entry["count"] += 1
+        _help.setdefault(name, (help_text, "histogram"))
+
+
+def _write_trace(record):
+    global _trace_file
+    if not METRICS_TRACE_PATH:
+        return
+    line = json.dumps(record, default=str)
+    with _lock:
+        if _trace_file is None:
+            _trace_file = open(METRICS_TRACE_PATH, "a")
+        _trace_file.write(line + "\n")
+        _trace_file.flush()
+
+
+def current_request_id():
+    return getattr(_local, "request_id", None)
+
+
+# Wrap one user request; every span inside it carries the request id. The
+# yielded dict can be filled with attributes such as the command.
+@contextmanager
+def request(**attrs):
+    _local.request_id = uuid.uuid4().hex[:12]
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        command = attrs.get("command", "unknown")
+        observe("chatdb_request_duration_seconds", duration, help_text="End-to-end request latency", command=command)
+        increment("chatdb_requests_total", help_text="Requests handled", command=command)
+        _write_trace({"request_id": _local.request_id, "span": "request", "start": started_at,
+                      "duration": duration, "error": error, **attrs})
+        _local.request_id = None
+        if METRICS_PROMETHEUS_PATH:
+            write_prometheus(METRICS_PROMETHEUS_PATH)
+
+
+# Time one pipeline stage (intent, schema_fetch, generate, execute, repair)
+@contextmanager
+def span(stage, **attrs):
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe("chatdb_stage_duration_seconds", duration, help_text="Time spent per pipeline stage", stage=stage)
+        if error:
+            increment("chatdb_stage_errors_total", help_text="Stages that raised", stage=stage)
+        _write_trace({"request_id": current_request_id(), "span": stage, "start": started_at,
+                      "duration": duration, "error": error, **attrs})
+
+
+def record_rows(rows, dbms):
+    observe("chatdb_rows_returned", rows, buckets=COUNT_BUCKETS, help_text="Rows returned per query", dbms=dbms)
+    _write_trace({"request_id": current_request_id(), "span": "rows", "rows": rows, "dbms": dbms})
+
+
+# Label values escaped as the text format requires: backslash, double quote, newline
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in pairs) + "}"
+
+
+# Render every metric in the Prometheus text exposition format
+def render_prometheus():
+    lines = []
+    with _lock:
+        names = sorted(set(name for name, _ in _counters) | set(name for name, _ in _gauges)
+                       | set(name for name, _ in _histograms))
+        for name in names:
+            help_text, kind = _help.get(name, ("", "untyped"))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(list(_counters.items()) + list(_gauges.items())):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (metric, labels), entry in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(entry["buckets"], entry["counts"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {entry['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {entry['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+# Serve /metrics from a background thread. http.server is imported here
+# because most runs never serve metrics.
+def start_http_server(port=METRICS_HTTP_PORT):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+# Start the exporters configured through the environment
+def start():
+    if METRICS_HTTP_PORT:
+        start_http_server(METRICS_HTTP_PORT)
+        print(f"Metrics served at http://127.0.0.1:{METRICS_HTTP_PORT}/metrics")
+
+
+_profile_stats = None  # pstats.Stats of every profiled call so far
+_profile_lock = threading.Lock()  # held while merging a finished call into the stats file
+
+
+def _save_profile(profile, path):
+    global _profile_stats
+    import pstats
+
+    with _profile_lock:
+        if _profile_stats is None:
+            _profile_stats = pstats.Stats(profile)
+        else:
+            _profile_stats.add(profile)
+        _profile_stats.dump_stats(path)
+
+
+# Run one step of a profiled call; calls overlapping another thread's are
+# not profiled (Python 3.12 allows one active profiler per process)
+def _profile_step(profile, func, *args, **kwargs):
+    try:
+        profile.enable()
+    except ValueError:
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+
+
+def _profile_stream(profile, rows, path):
+    try:
+        while True:
+            try:
+                row = _profile_step(profile, next, rows)
+            except StopIteration:
+                return
+            yield row
+    finally:
+        # A consumer that stops early releases the cursor (and its connection) now
+        close = getattr(rows, "close", None)
+        if close:
+            close()
+        _save_profile(profile, path)
+
+
+# Profile every call of func with cProfile, accumulating the stats in `path`
+# (inspect with `python -m pstats path`). When func returns a row stream,
+# alone or first in a tuple as execute_query does, fetching the rows is
+# profiled too and the call is saved once the stream is done. Each call has
+# its own profiler, so concurrent calls, and prompts they wait on, do not
+# hold each other up.
+def profiled(func, path=PROFILE_PATH):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        result = _profile_step(profile, func, *args, **kwargs)
+        rows = result[0] if isinstance(result, tuple) and result else result
+        if not hasattr(rows, "__next__"):
+            _save_profile(profile, path)
+            return result
+        stream = _profile_stream(profile, rows, path)
+        return (stream,) + result[1:] if isinstance(result, tuple) else stream
+    return wrapper
@@ -0,0 +1,375 @@
+import ast
+import copy
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from bson.objectid import ObjectId
+
+import result_stream
+
+# Compile generated MongoDB queries, written shell-style as
+# db.work.find({"style": "Baroque"}, {"name": 1}).sort("name", 1).limit(5),
+# into typed plans without evaluating them. Only the calls below and
+# literal arguments are accepted; anything else raises UnsupportedQuery
+# before the database is touched. Plans can be inspected (cost_guard.py),
+# corrected (query_validator.py) and are executed directly with pymongo.
+
+MONGO_BATCH_SIZE = result_stream.RESULT_BATCH_SIZE  # documents per cursor batch
+MONGO_PLAN_CACHE_SIZE = 256  # compiled plans kept, keyed by normalized text
+
+READ_METHODS = {"find", "find_one", "aggregate", "count_documents", "estimated_document_count", "distinct"}
+WRITE_METHODS = {"insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many"}
+DATABASE_METHODS = {"list_collection_names"}
+CURSOR_METHODS = {"sort", "skip", "limit"}
+# Shell spellings of pymongo methods
+METHOD_ALIASES = {"count": "count_documents", "findOne": "find_one", "insertOne": "insert_one",
+                  "insertMany": "insert_many", "updateOne": "update_one", "updateMany": "update_many",
+                  "replaceOne": "replace_one", "deleteOne": "delete_one", "deleteMany": "delete_many",
+                  "countDocuments": "count_documents", "estimatedDocumentCount": "estimated_document_count"}
+# Keyword arguments passed through to pymongo
+METHOD_OPTIONS = {"upsert", "ordered", "collation", "hint", "allowDiskUse", "bypass_document_validation",
+                  "array_filters", "let", "comment"}
+LITERAL_NAMES = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+_cache = OrderedDict()  # normalized text -> MongoQuery
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+STRING_OR_SPACE = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|\s+")
+
+
+class UnsupportedQuery(ValueError):
+    pass
+
+
+# One operation on a collection (or the database, when collection is None)
+class MongoCall:
+    def __init__(self, collection, method, filter=None, projection=None, pipeline=None, documents=None,
+                 update=None, key=None, sort=None, skip=None, limit=None, options=None):
+        self.collection = collection
+        self.method = method
+        self.filter = filter if filter is not None else {}
+        self.projection = projection
+        self.pipeline = pipeline if pipeline is not None else []
+        self.documents = documents if documents is not None else []  # insert_*; replace_one's replacement
+        self.update = update
+        self.key = key  # distinct
+        self.sort = sort  # [(field, direction)]
+        self.skip = skip
+        self.limit = limit
+        self.options = options or {}
+
+    @property
+    def is_read(self):
+        return self.method in READ_METHODS or self.method in DATABASE_METHODS
+
+    # Whether the query already caps the documents it returns
+    @property
+    def has_limit(self):
+        if self.method == "aggregate":
+            return any("$limit" in stage for stage in self.pipeline)
+        return self.limit is not None
+
+
+# The calls a query text makes. batch is True for a list of operations
+# ([db.a.insert_one(...), db.b.delete_one(...)])
+class MongoQuery:
+    def __init__(self, calls, batch=False):
+        self.calls = calls
+        self.batch = batch
+
+
+# --- Compiling ---
+
+def _unsupported(node, what=None):
+    text = ast.unparse(node) if isinstance(node, ast.AST) else str(node)
+    raise UnsupportedQuery(f"Unsupported in a MongoDB query: {what or text}")
+
+
+# Literal argument values: JSON/Python constants, containers and ObjectId("...")
+def _literal(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float, bool, type(None))):
+        return node.value
+    if isinstance(node, ast.Dict):
+        if any(key is None for key in node.keys):
+            _unsupported(node, "** in a document")
+        return {_literal(key): _literal(value) for key, value in zip(node.keys, node.values)}
+    if isinstance(node, ast.List):
+        return [_literal(item) for item in node.elts]
+    if isinstance(node, ast.Tuple):
+        return tuple(_literal(item) for item in node.elts)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _literal(node.operand)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.Name) and node.id in LITERAL_NAMES:
+        return LITERAL_NAMES[node.id]
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "ObjectId"
+            and len(node.args) == 1 and not node.keywords):
+        return ObjectId(_literal(node.args[0]))
+    _unsupported(node)
+
+
+def _collection(node):
+    if isinstance(node, ast.Name) and node.id == "db":
+        return None
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "db":
+        return node.attr
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "db":
+        name = _literal(node.slice)
+        if isinstance(name, str):
+            return name
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "get_collection"
+            and isinstance(node.func.value, ast.Name) and node.func.value.id == "db" and len(node.args) == 1):
+        return _literal(node.args[0])
+    _unsupported(node, f"{ast.unparse(node)} (expected db.<collection>)")
+
+
+def _sort_spec(args):
+    if len(args) == 2:
+        return [(args[0], args[1])]
+    spec = args[0] if args else None
+    if isinstance(spec, str):
+        return [(spec, 1)]
+    if isinstance(spec, dict):
+        return list(spec.items())
+    if isinstance(spec, (list, tuple)) and all(isinstance(item, (list, tuple)) and len(item) == 2 for item in spec):
+        return [tuple(item) for item in spec]
+    raise UnsupportedQuery(f"Unsupported sort specification: {spec!r}")
+
+
+def _arguments(call, positional, keywords):
+    args = [_literal(arg) for arg in call.args]
+    kwargs = {}
+    for keyword in call.keywords:
+        if keyword.arg is None:
+            _unsupported(call, "**keyword arguments")
+        kwargs[keyword.arg] = _literal(keyword.value)
+    values = dict(zip(positional, args))
+    if len(args) > len(positional):
+        _unsupported(call, f"too many arguments to {ast.unparse(call.func)}")
+    for name, value in kwargs.items():
+        if name in positional or name in keywords:
+            values[name] = value
+        elif name in METHOD_OPTIONS:
+            values.setdefault("options", {})[name] = value
+        else:
+            _unsupported(call, f"argument {name}=")
+    return values
+
+
+# Positional parameters of each method, in pymongo order
+SIGNATURES = {
+    "find": ["filter", "projection"],
+    "find_one": ["filter", "projection"],
+    "aggregate": ["pipeline"],
+    "count_documents": ["filter"],
+    "estimated_document_count": [],
+    "distinct": ["key", "filter"],
+    "insert_one": ["document"],
+    "insert_many": ["documents"],
+    "update_one": ["filter", "update"],
+    "update_many": ["filter", "update"],
+    "replace_one": ["filter", "replacement"],
+    "delete_one": ["filter"],
+    "delete_many": ["filter"],
+    "list_collection_names": [],
+}
+
+
+def _compile_call(node):
+    # Unwind chained cursor methods: db.c.find(...).sort(...).limit(...)
+    chain = []
+    while (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+           and node.func.attr in CURSOR_METHODS and isinstance(node.func.value, ast.Call)):
+        chain.append(node)
+        node = node.func.value
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+        _unsupported(node, f"{ast.unparse(node)} (expected db.<collection>.<method>(...))")
+
+    method = METHOD_ALIASES.get(node.func.attr, node.func.attr)
+    if method not in SIGNATURES:
+        _unsupported(node, f"method {node.func.attr}()")
+    collection = _collection(node.func.value)
+    if (collection is None) != (method in DATABASE_METHODS):
+        _unsupported(node, f"method {node.func.attr}()")
+    values = _arguments(node, SIGNATURES[method], {"sort", "skip", "limit"})
+
+    call = MongoCall(collection, method, filter=values.get("filter"), projection=values.get("projection"),
+                     key=values.get("key"), update=values.get("update"), options=values.get("options"))
+    if method == "aggregate":
+        pipeline = values.get("pipeline", [])
+        if not isinstance(pipeline, (list, tuple)) or not all(isinstance(stage, dict) for stage in pipeline):
+            raise UnsupportedQuery("aggregate() expects a list of pipeline stages")
+        call.pipeline = list(pipeline)
+    elif method == "insert_one":
+        call.documents = [values.get("document")]
+    elif method == "insert_many":
+        call.documents = list(values.get("documents") or [])
+    elif method == "replace_one":
+        call.documents = [values.get("replacement")]
+    if not isinstance(call.filter, dict):
+        raise UnsupportedQuery(f"{method}() expects a filter document")
+    if "sort" in values:
+        call.sort = _sort_spec([values["sort"]])
+    call.skip, call.limit = values.get("skip"), values.get("limit")
+
+    for chained in reversed(chain):
+        if method not in ("find",):
+            _unsupported(chained, f".{chained.func.attr}() after {method}()")
+        args = [_literal(arg) for arg in chained.args]
+        if chained.keywords:
+            _unsupported(chained, f"keyword arguments to .{chained.func.attr}()")
+        if chained.func.attr == "sort":
+            call.sort = _sort_spec(args)
+        elif len(args) != 1 or not isinstance(args[0], int):
+            _unsupported(chained, f".{chained.func.attr}() expects a number")
+        else:
+            setattr(call, chained.func.attr, args[0])
+    return call
+
+
+def _compile(query):
+    try:
+        tree = ast.parse(query.strip(), mode="eval").body
+    except SyntaxError as e:
+        raise UnsupportedQuery(f"Invalid MongoDB query syntax: {e.msg} (line {e.lineno})")
+    if isinstance(tree, (ast.List, ast.Tuple)):
+        return MongoQuery([_compile_call(item) for item in tree.elts], batch=True)
+    return MongoQuery([_compile_call(tree)])
+
+
+# Cache key: the text without whitespace outside string literals
+def normalize(query):
+    return STRING_OR_SPACE.sub(lambda match: match.group(1) or "", query)
+
+
+# Compile query text into a MongoQuery. Plans are cached and shared between
+# callers, so they are read-only; copy.deepcopy one before changing it.
+def parse(query):
+    key = normalize(query)
+    with _cache_lock:
+        plan = _cache.get(key)
+        if plan is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return plan
+        _stats["misses"] += 1
+    plan = _compile(query)
+    with _cache_lock:
+        _cache[key] = plan
+        while len(_cache) > MONGO_PLAN_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return plan
+
+
+def stats():
+    with _cache_lock:
+        return dict(_stats, size=len(_cache))
+
+
+# --- Executing ---
+
+# Run a compiled call on db. limit caps the documents returned by find and
+# aggregate unless the query sets its own; max_time_ms is sent as maxTimeMS
+# so the server stops the query when it runs too long
+def execute(db, call, limit=None, max_time_ms=None, batch_size=MONGO_BATCH_SIZE):
+    if call.collection is None:
+        return getattr(db, call.method)()
+    collection = db[call.collection]
+    options = dict(call.options)
+    time_limit = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+    method = call.method
+
+    if method == "find":
+        cursor = collection.find(call.filter, call.projection, batch_size=batch_size, **options)
+        if call.sort:
+            cursor = cursor.sort(call.sort)
+        if call.skip:
+            cursor = cursor.skip(call.skip)
+        if call.limit is not None or limit:
+            cursor = cursor.limit(call.limit if call.limit is not None else limit)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        return cursor
+    if method == "find_one":
+        if call.sort:
+            options["sort"] = call.sort
+        return collection.find_one(call.filter, call.projection, **options, **time_limit)
+    if method == "aggregate":
+        pipeline = call.pipeline + ([{"$limit": limit}] if limit and not call.has_limit else [])
+        return collection.aggregate(pipeline, batchSize=batch_size, **options, **time_limit)
+    if method == "count_documents":
+        return collection.count_documents(call.filter, **options, **time_limit)
+    if method == "estimated_document_count":
+        return collection.estimated_document_count()
+    if method == "distinct":
+        return collection.distinct(call.key, call.filter, **options, **time_limit)
+    # pymongo adds _id to inserted documents; keep the cached plan unchanged
+    if method == "insert_one":
+        return collection.insert_one(copy.deepcopy(call.documents[0]), **options)
+    if method == "insert_many":
+        return collection.insert_many(copy.deepcopy(call.documents), **options)
+    if method in ("update_one", "update_many"):
+        return getattr(collection, method)(call.filter, call.update, **options)
+    if method == "replace_one":
+        return collection.replace_one(call.filter, call.documents[0], **options)
+    return getattr(collection, method)(call.filter, **options)
+
+
+# --- Text ---
+
+# Python literal for a query argument, with JSON-style double quotes
+def _text(value):
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{_text(key)}: {_text(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        items = ", ".join(_text(item) for item in value)
+        return f"[{items}]" if isinstance(value, list) else f"({items}{',' if len(value) == 1 else ''})"
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, ObjectId):
+        return f'ObjectId("{value}")'
+    return repr(value)
+
+
+def call_to_text(call):
+    if call.collection is None:
+        return f"db.{call.method}()"
+    target = f"db.{call.collection}" if call.collection.isidentifier() else f"db[{_text(call.collection)}]"
+    method = call.method
+    if method == "aggregate":
+        args = [call.pipeline]
+    elif method == "distinct":
+        args = [call.key, call.filter]
+    elif method in ("insert_one", "replace_one"):
+        args = ([call.filter] if method == "replace_one" else []) + [call.documents[0]]
+    elif method == "insert_many":
+        args = [call.documents]
+    elif method in ("update_one", "update_many"):
+        args = [call.filter, call.update]
+    elif method == "estimated_document_count":
+        args = []
+    else:
+        args = [call.filter] + ([call.projection] if call.projection is not None else [])
+    arguments = [_text(arg) for arg in args] + [f"{name}={_text(value)}" for name, value in call.options.items()]
+    if method == "find_one" and call.sort:
+        arguments.append(f"sort={_text(call.sort)}")
+    text = f"{target}.{method}({', '.join(arguments)})"
+    if method == "find":
+        if call.sort:
+            text += f".sort({_text(call.sort)})"
+        if call.skip:
+            text += f".skip({call.skip})"
+        if call.limit is not None:
+            text += f".limit({call.limit})"
+    return text
+
+
+# Query text for a compiled query; parse(to_text(query)) gives the same plan
+def to_text(query):
+    if query.batch:
+        return "[" + ", ".join(call_to_text(call) for call in query.calls) + "]"
+    return call_to_text(query.calls[0])
@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson.objectid import ObjectId
+
+MONGO_SAMPLE_SIZE = 200  # documents sampled per collection with $sample
+MONGO_SCHEMA_TTL = 3600  # seconds before a persisted summary is inferred again
+MONGO_COUNT_DRIFT = 0.1  # re-infer a collection when its count moved by more than 10%
+MONGO_SCHEMA_WORKERS = 4  # collections inferred in parallel
+MONGO_SCHEMA_CACHE_DIR = ".schema_cache"
+# Written by import_csv_to_mongodb.py --mode embed: one document per
+# collection, {"_id": collection, "fields": {field: description}}, naming the
+# related documents embedded in it. Not a collection to query.
+EMBEDDED_NOTES_COLLECTION = "_embedded_fields"
+
+
+def _type_name(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    return type(value).__name__
+
+
+# Record the type of every field path in a document; nested documents use
+# dotted paths and array elements are described under "path[]"
+def _walk(value, path, fields):
+    stats = fields.setdefault(path, {"types": {}, "nulls": 0, "present": 0})
+    stats["present"] += 1
+    type_name = _type_name(value)
+    stats["types"][type_name] = stats["types"].get(type_name, 0) + 1
+    if type_name == "null":
+        stats["nulls"] += 1
+    elif type_name == "object":
+        for key, child in value.items():
+            _walk(child, f"{path}.{key}", fields)
+    elif type_name == "array":
+        for item in value:
+            _walk(item, f"{path}[]", fields)
+
+
+def _json_safe(doc):
+    return json.loads(json.dumps(doc, default=str))
+
+
+# Build the field summary of a collection holding `count` documents from
+# the documents sampled out of it
+def infer_documents(docs, count):
+    fields = {}
+    sampled = 0
+    sample = None
+    for doc in docs:
+        if sample is None:
+            sample = _json_safe(doc)
+        sampled += 1
+        for key, value in doc.items():
+            _walk(value, key, fields)
+    return {"count": count, "sampled": sampled, "fields": fields, "sample": sample}
+
+
+# Infer the field summary of one collection from a $sample of its documents
+def infer_collection(collection, sample_size=MONGO_SAMPLE_SIZE):
+    count = collection.estimated_document_count()
+    return infer_documents(collection.aggregate([{"$sample": {"size": sample_size}}]), count)
+
+
+# Infer every collection of a database in parallel
+def infer_database(db, sample_size=MONGO_SAMPLE_SIZE, workers=MONGO_SCHEMA_WORKERS, names=None):
+    if names is None:
+        names = [name for name in db.list_collection_names() if name != EMBEDDED_NOTES_COLLECTION]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda name: infer_collection(db[name], sample_size), names)
+        return dict(zip(names, results))
+
+
+def _cache_path(db_name):
+    return os.path.join(MONGO_SCHEMA_CACHE_DIR, f"mongo_{db_name}.json")
+
+
+def _read_summary(db_name):
+    try:
+        with open(_cache_path(db_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_summary(db_name, summary):
+    os.makedirs(MONGO_SCHEMA_CACHE_DIR, exist_ok=True)
+    tmp_path = _cache_path(db_name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, _cache_path(db_name))
+
+
+def _drifted(old_count, new_count):
+    return abs(new_count - old_count) > MONGO_COUNT_DRIFT * max(old_count, 1)
+
+
+# {collection: {field: description}} of the embedded documents recorded by
+# the importer
+def read_embedded_notes(db):
+    return {note["_id"]: note.get("fields", {}) for note in db[EMBEDDED_NOTES_COLLECTION].find()}
+
+
+# Load the persisted summary of a database, re-inferring the collections that
+# are new, older than the TTL, whose document counts drifted or that were
+# reloaded with a different embedded shape
+def load_summary(client, db_name, sample_size=MONGO_SAMPLE_SIZE, ttl=MONGO_SCHEMA_TTL):
+    db = client[db_name]
+    summary = _read_summary(db_name) or {"database": db_name, "collections": {}}
+    cached = summary["collections"]
+    names = db.list_collection_names()
+    notes = read_embedded_notes(db) if EMBEDDED_NOTES_COLLECTION in names else {}
+    names = [name for name in names if name != EMBEDDED_NOTES_COLLECTION]
+    with ThreadPoolExecutor(max_workers=MONGO_SCHEMA_WORKERS) as pool:
+        counts = dict(zip(names, pool.map(lambda name: db[name].estimated_document_count(), names)))
+
+    now = time.time()
+    stale = [
+        name for name in names
+        if name not in cached
+        or now - cached[name].get("inferred_at", 0) > ttl
+        or _drifted(cached[name]["count"], counts[name])
+        or cached[name].get("embedded", {}) != notes.get(name, {})
+    ]
+    if stale or set(cached) != set(names):
+        for name, info in infer_database(db, sample_size, names=stale).items():
+            info["inferred_at"] = now
+            info["embedded"] = notes.get(name, {})
+            cached[name] = info
+        summary["collections"] = {name: cached[name] for name in names}
+        _write_summary(db_name, summary)
+    return summary
+
+
+# Dominant type first, e.g. "int 98%, double 2%"
+def describe_types(stats):
+    types = sorted(stats["types"].items(), key=lambda item: -item[1])
+    types = [(name, count) for name, count in types if name != "null"] or types
+    if len(types) == 1:
+        return types[0][0]
+    total = sum(count for _, count in types)
+    return ", ".join(f"{name} {count * 100 // total}%" for name, count in types)
+
+
+# Convert a summary into the catalog shape used by schema_catalog
+def summary_to_catalog(summary):
+    tables = {}
+    for name, info in summary["collections"].items():
+        sampled = info["sampled"]
+        columns = []
+        # Sampling order is random, so list fields in a stable order
+        for path, stats in sorted(info["fields"].items(), key=lambda item: (item[0] != "_id", item[0])):
+            columns.append({
+                "name": path,
+                "type": describe_types(stats),
+                "null_rate": stats["nulls"] / stats["present"] if stats["present"] else 0.0,
+                "presence": stats["present"] / sampled if sampled and "[]" not in path else 1.0,
+            })
+        tables[name] = {
+            "columns": columns,
+            "foreign_keys": [],
+            "row_count": info["count"],
+            "sample": info["sample"],
+            "sampled": sampled,
+            "embedded": info.get("embedded", {}),
+        }
+    return {"dbms": "mongodb", "database": summary["database"], "tables": tables}
+
+
+def load_mongodb_catalog(client, db_name):
+    return summary_to_catalog(load_summary(client, db_name))
+
+
+# One line naming the embedded documents of a collection, or ""
+def format_embedded(table):
+    embedded = table.get("embedded")
+    if not embedded:
+        return ""
+    fields = "; ".join(f"{field} = {description}" for field, description in embedded.items())
+    return f"Embedded, query in place without $lookup: {fields}"
+
+
+# Format one inferred field, flagging sparse and nullable fields
+def format_field(column):
+    text = f"{column['name']} ({column['type']})"
+    notes = []
+    if column["presence"] < 1.0:
+        notes.append(f"present in {column['presence']:.0%}")
+    if column["null_rate"] > 0:
+        notes.append(f"null {column['null_rate']:.0%}")
+    if notes:
+        text += " [" + ", ".join(notes) + "]"
+    return text
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import cost_guard
+import mongo_query
+import result_cache
+
+QUERY_CACHE_PATH = os.path.join(".schema_cache", "query_cache.sqlite3")
+QUERY_CACHE_MAX_ENTRIES = 1000  # least recently used entries are evicted past this
+QUERY_CACHE_MAX_AGE = 7 * 24 * 3600  # seconds before a generated query is generated again
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+FILLER = re.compile(r"^(?:please |can you |could you |would you |show me |tell me |give me )+")
+# Statements a SELECT or WITH can still write with (MySQL 8 has WITH ... UPDATE)
+SQL_MODIFIES = re.compile(r"\b(insert|update|delete|into\s+(outfile|dumpfile))\b", re.IGNORECASE)
+
+
+# Only reads are cached: a cached write would run again on every hit. Errs
+# towards not caching, e.g. SELECT ... FOR UPDATE
+def is_read(dbms, query):
+    if dbms == "sql":
+        return bool(cost_guard.SQL_READ.match(query)) and not SQL_MODIFIES.search(query)
+    try:
+        return not result_cache.mongo_writes(mongo_query.parse(query))
+    except mongo_query.UnsupportedQuery:
+        return False
+
+
+# Lower-case and strip punctuation outside quoted values so that trivial
+# rewordings map to the same entry; quoted values keep their case
+def normalize_question(question):
+    parts = re.split(r"""('[^']*'|"[^"]*")""", question.strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+        else:
+            part = re.sub(r"[^\w\s*.<>=!-]", " ", part.lower())
+            normalized.append(re.sub(r"\s+", " ", part))
+    text = re.sub(r"\s+", " ", "".join(normalized)).strip(" .?!")
+    return FILLER.sub("", text)
+
+
+def cache_key(dbms, db_name, schema_fingerprint, question):
+    raw = "\x1f".join([dbms, db_name, schema_fingerprint, normalize_question(question)])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        directory = os.path.dirname(QUERY_CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _conn = sqlite3.connect(QUERY_CACHE_PATH, check_same_thread=False)
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS queries (
+                key TEXT PRIMARY KEY,
+                dbms TEXT, database TEXT, question TEXT, query TEXT,
+                created_at REAL, last_used REAL, hits INTEGER DEFAULT 0
+            )"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS queries_last_used ON queries (last_used)")
+        _conn.commit()
+    return _conn
+
+
+# Return the cached query for a question, or None
+def get(dbms, db_name, schema_fingerprint, question):
+    key = cache_key(dbms, db_name, schema_fingerprint, question)
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        row = conn.execute("SELECT query, created_at FROM queries WHERE key = ?", (key,)).fetchone()
+        if row and (now - row[1] > QUERY_CACHE_MAX_AGE or not is_read(dbms, row[0])):
+            conn.execute("DELETE FROM queries WHERE key = ?", (key,))
+            conn.commit()
+            row = None
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        conn.execute("UPDATE queries SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        conn.commit()
+        _stats["hits"] += 1
+        return row[0]
+
+
+# Store the query that executed successfully for a question, replacing any
+# earlier entry (e.g. when the cached query had to be fixed). Writes are not
+# stored, and drop the earlier entry.
+def put(dbms, db_name, schema_fingerprint, question, query):
+    if not is_read(dbms, query):
+        delete(dbms, db_name, schema_fingerprint, question)
+        return
+    key = cache_key(dbms, db_name, schema_fingerprint, question)
+    now = time.time()
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO queries (key, dbms, database, question, query, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, dbms, db_name, question, query, now, now),
+        )
+        _evict(conn, now)
+        conn.commit()
+
+
+def delete(dbms, db_name, schema_fingerprint, question):
+    key = cache_key(dbms, db_name, schema_fingerprint, question)
+    with _lock:
+        conn = _connection()
+        conn.execute("DELETE FROM queries WHERE key = ?", (key,))
+        conn.commit()
+
+
+def _evict(conn, now):
+    conn.execute("DELETE FROM queries WHERE created_at < ?", (now - QUERY_CACHE_MAX_AGE,))
+    conn.execute(
+        "DELETE FROM queries WHERE key IN ("
+        "SELECT key FROM queries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+        (QUERY_CACHE_MAX_ENTRIES,),
+    )
+
+
+def stats():
+    with _lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+        size = _connection().execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "entries": size, "hit_rate": hits / total if total else 0.0}
+
+
+def summary():
+    current = stats()
+    return (
+        f"Query cache: {current['hits']} hit(s), {current['misses']} miss(es) "
+        f"({current['hit_rate']:.0%} hit rate), {current['entries']} entries stored."
+    )
@@ -0,0 +1,360 @@
+import copy
+import re
+
+import mongo_query
+import mongo_schema
+import schema_catalog
+
+
+# Check generated queries against the cached schema before they reach the
+# database. Table, collection and column names that differ only in case, or
+# by a typo that leaves a single candidate the query does not already use,
+# are corrected locally; anything else raises
+# ValidationError so execute_query can ask the LLM to fix the query, with the
+# schema slice from schema_slice() attached.
+
+# Single-character edits (insert, delete, replace, swap) a typo may be from
+# the name it is corrected to, and at most one per three characters of it;
+# category is not corrected to category_id
+NAME_MAX_EDITS = 2
+SQL_DIALECT = "mysql"
+
+# Pipeline stages that keep the collection's fields; checking stops at the
+# first stage that reshapes documents
+MONGO_PASSTHROUGH_STAGES = {"$match", "$sort", "$limit", "$skip", "$lookup", "$unwind", "$sample"}
+
+_sqlglot = None  # the sqlglot module once imported, False when not installed
+
+
+class ValidationError(Exception):
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+    # A table or collection missing from the catalog may just be newer than
+    # the cached catalog
+    @property
+    def unknown_table(self):
+        return any(problem.startswith(("Unknown table '", "Unknown collection '")) for problem in self.problems)
+
+
+# sqlglot, or None when it is not installed (SQL then goes to the database
+# unchecked). It takes longer to import than the rest of the program, so it
+# is imported when the first statement is checked rather than at startup.
+def load_sqlglot():
+    global _sqlglot
+    if _sqlglot is None:
+        try:
+            import sqlglot
+        except ImportError:
+            sqlglot = False
+        _sqlglot = sqlglot
+    return _sqlglot or None
+
+
+# Optimal string alignment distance: insertions, deletions, replacements and
+# swaps of adjacent characters
+def edit_distance(a, b):
+    before, previous = None, list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+            if before is not None and j > 1 and x == b[j - 2] and a[i - 2] == y:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        before, previous = previous, current
+    return previous[-1]
+
+
+# Resolve name against known names: exact, then case-insensitive, then a
+# typo with a single candidate (see NAME_MAX_EDITS). A typo is not resolved
+# to a name in taken, the names the query already uses: SELECT state, stat
+# is more likely to mean another column than state twice. Returns None when
+# there is no single safe match, leaving the name to the LLM.
+def resolve_name(name, names, taken=()):
+    if name in names:
+        return name
+    same = [known for known in names if known.lower() == name.lower()]
+    if same:
+        return same[0] if len(same) == 1 else None
+    limit = min(NAME_MAX_EDITS, len(name) // 3)
+    close = [known for known in names if abs(len(known) - len(name)) <= limit
+             and edit_distance(name.lower(), known.lower()) <= limit]
+    if len(close) != 1 or close[0] in taken:
+        return None
+    return close[0]
+
+
+# Validate query against the catalog of its database. Returns the query,
+# rewritten when names were corrected, and the corrections made
+def validate(query, dbms, catalog):
+    if not catalog or not catalog.get("tables"):
+        return query, []
+    if dbms == "sql":
+        return validate_sql(query, catalog)
+    return validate_mongodb(query, catalog)
+
+
+# --- SQL ---
+
+def validate_sql(query, catalog):
+    sqlglot = load_sqlglot()
+    if sqlglot is None:
+        return query, []
+    exp = sqlglot.exp
+    try:
+        statements = sqlglot.parse(query, read=SQL_DIALECT)
+    except sqlglot.errors.ParseError as e:
+        description = e.errors[0].get("description") if e.errors else str(e).splitlines()[0]
+        raise ValidationError([f"SQL syntax error: {description}"])
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.Union, exp.Insert, exp.Update,
+                                                              exp.Delete)):
+        return query, []
+
+    tree = statements[0]
+    tables = catalog["tables"]
+    fixes, problems = [], []
+    derived = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    derived |= {subquery.alias_or_name for subquery in tree.find_all(exp.Subquery) if subquery.alias_or_name}
+
+    sources = {}  # alias or name -> catalog table
+    used_tables = {table.name for table in tree.find_all(exp.Table)}
+    used_columns = {column.name for column in tree.find_all(exp.Column)}
+    for table in tree.find_all(exp.Table):
+        name = table.name
+        if table.db and table.db != catalog.get("database"):
+            # Another database (information_schema, ...) is not in the catalog
+            derived.add(table.alias_or_name)
+            continue
+        if name in derived or not name or name.lower() == "dual":
+            continue
+        resolved = resolve_name(name, tables, used_tables)
+        if resolved is None:
+            problems.append(f"Unknown table '{name}'")
+            continue
+        if resolved != name:
+            table.set("this", exp.to_identifier(resolved))
+            fixes.append(f"{name} -> {resolved}")
+        sources[table.alias_or_name if table.alias else resolved] = resolved
+        sources.setdefault(resolved, resolved)
+
+    aliases = {alias.alias for alias in tree.find_all(exp.Alias)}
+    columns_of = {name: [column["name"] for column in tables[name]["columns"]] for name in set(sources.values())}
+    for column in tree.find_all(exp.Column):
+        name = column.name
+        if not name or isinstance(column.this, exp.Star):
+            continue
+        qualifier = column.table
+        if qualifier:
+            if qualifier in derived:
+                continue
+            if qualifier not in sources:
+                resolved_qualifier = resolve_name(qualifier, list(sources))
+                if resolved_qualifier is None:
+                    problems.append(f"Unknown table or alias '{qualifier}' in '{qualifier}.{name}'")
+                    continue
+                column.set("table", exp.to_identifier(resolved_qualifier))
+                fixes.append(f"{qualifier} -> {resolved_qualifier}")
+                qualifier = resolved_qualifier
+            candidates = columns_of[sources[qualifier]]
+        else:
+            if name in aliases:
+                continue
+            candidates = [candidate for names in columns_of.values() for candidate in names]
+        if name in candidates:
+            continue
+        resolved = resolve_name(name, candidates, used_columns)
+        if resolved is not None:
+            column.set("this", exp.to_identifier(resolved))
+            fixes.append(f"{name} -> {resolved}")
+        elif qualifier or not derived:
+            # Unqualified names may come from a derived table we cannot see into
+            where = f" in table '{sources[qualifier]}'" if qualifier else ""
+            problems.append(f"Unknown column '{name}'{where}")
+
+    if problems:
+        raise ValidationError(list(dict.fromkeys(problems)))
+    if not fixes:
+        return query, []
+    return tree.sql(dialect=SQL_DIALECT), list(dict.fromkeys(fixes))
+
+
+# --- MongoDB ---
+
+def _known_fields(info):
+    fields = set()
+    for column in info["columns"]:
+        path = column["name"].replace("[]", "")
+        fields.add(path)
+        # Parents of nested paths can be queried too
+        while "." in path:
+            path = path.rsplit(".", 1)[0]
+            fields.add(path)
+    return fields
+
+
+# Correct the keys of a filter, projection or sort document in place; a key
+# is never corrected to one the document already has
+def _fix_keys(document, fields, fixes):
+    if not isinstance(document, dict):
+        return
+    for key in list(document):
+        value = document[key]
+        if key.startswith("$"):
+            # $and / $or / $nor take lists of filters
+            for item in value if isinstance(value, list) else []:
+                _fix_keys(item, fields, fixes)
+            continue
+        if key in fields or key.split(".")[0] in fields:
+            # Paths under a known field may reach into arrays the sample missed
+            continue
+        resolved = resolve_name(key, fields, set(document))
+        if resolved is not None:
+            document[resolved] = document.pop(key)
+            fixes.append(f"{key} -> {resolved}")
+
+
+# Correct "$field" references of a $group stage in place
+def _fix_references(value, fields, fixes):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, str):
+                value[key] = _fix_reference(item, fields, fixes)
+            else:
+                _fix_references(item, fields, fixes)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            if isinstance(item, str):
+                value[i] = _fix_reference(item, fields, fixes)
+            else:
+                _fix_references(item, fields, fixes)
+
+
+def _fix_reference(value, fields, fixes):
+    if not value.startswith("$") or value.startswith("$$") or value[1:] in fields:
+        return value
+    resolved = resolve_name(value[1:], fields)
+    if resolved is None:
+        return value
+    fixes.append(f"{value[1:]} -> {resolved}")
+    return "$" + resolved
+
+
+def _fix_call(call, tables, fixes, problems):
+    if call.collection is None:
+        return
+    resolved = resolve_name(call.collection, tables)
+    if resolved is None:
+        # Inserts create the collection
+        if call.method not in ("insert_one", "insert_many"):
+            problems.append(f"Unknown collection '{call.collection}'")
+        return
+    if resolved != call.collection:
+        fixes.append(f"{call.collection} -> {resolved}")
+        call.collection = resolved
+    fields = _known_fields(tables[resolved])
+
+    if call.method == "aggregate":
+        for stage in call.pipeline:
+            if not isinstance(stage, dict) or len(stage) != 1:
+                break
+            name, body = next(iter(stage.items()))
+            if name == "$match":
+                _fix_keys(body, fields, fixes)
+            elif name == "$sort":
+                _fix_keys(body, fields, fixes)
+            elif name == "$lookup" and isinstance(body, dict):
+                if "localField" in body and body["localField"] not in fields:
+                    body["localField"] = _fix_reference("$" + body["localField"], fields, fixes)[1:]
+                joined = resolve_name(body.get("from", ""), tables)
+                if joined is None:
+                    problems.append(f"Unknown collection '{body.get('from')}' in $lookup")
+                else:
+                    if joined != body["from"]:
+                        fixes.append(f"{body['from']} -> {joined}")
+                        body["from"] = joined
+                    if "foreignField" in body:
+                        joined_fields = _known_fields(tables[joined])
+                        body["foreignField"] = _fix_reference("$" + body["foreignField"], joined_fields, fixes)[1:]
+                if "as" in body:
+                    fields = fields | {body["as"]}
+            elif name == "$group":
+                _fix_references(body, fields, fixes)
+                break
+            if name not in MONGO_PASSTHROUGH_STAGES:
+                break
+        return
+
+    if call.method in ("insert_one", "insert_many"):
+        return
+    _fix_keys(call.filter, fields, fixes)
+    if isinstance(call.projection, dict):
+        # Keys with computed values name new output fields
+        included = {key: value for key, value in call.projection.items() if value in (0, 1)}
+        _fix_keys(included, fields, fixes)
+        for key, value in list(call.projection.items()):
+            if value in (0, 1):
+                del call.projection[key]
+        call.projection.update(included)
+    if call.sort:
+        keys = []
+        sorted_by = {key for key, _ in call.sort}
+        for key, direction in call.sort:
+            resolved = key if key in fields else resolve_name(key, fields, sorted_by) or key
+            if resolved != key:
+                fixes.append(f"{key} -> {resolved}")
+            keys.append((resolved, direction))
+        call.sort = keys
+
+
+# Collections must exist; field names are only corrected when they are a
+# near miss, because the schema is inferred from a sample and a field
+# missing from it may still exist
+def validate_mongodb(query, catalog):
+    try:
+        # Plans are shared through the plan cache; fix a copy
+        plan = copy.deepcopy(mongo_query.parse(query))
+    except mongo_query.UnsupportedQuery as e:
+        raise ValidationError([str(e)])
+    fixes, problems = [], []
+    for call in plan.calls:
+        _fix_call(call, catalog["tables"], fixes, problems)
+    if problems:
+        raise ValidationError(list(dict.fromkeys(problems)))
+    if not fixes:
+        return query, []
+    return mongo_query.to_text(plan), list(dict.fromkeys(fixes))
+
+
+# --- Schema slice for repairs ---
+
+# The part of the schema a repair needs: the tables the query or the error
+# mentions, plus near misses of names that did not resolve. Falls back to the
+# list of table names.
+def schema_slice(query, dbms, catalog, error=""):
+    if not catalog or not catalog.get("tables"):
+        return ""
+    tables = catalog["tables"]
+    text = f"{query}\n{error}"
+    words = set(re.findall(r"\w+", text))
+    chosen = [name for name in tables if re.search(rf"\b{re.escape(name)}\b", text, re.IGNORECASE)]
+    for word in words:
+        match = resolve_name(word, tables)
+        if match and match not in chosen and len(word) > 3:
+            chosen.append(match)
+    if not chosen:
+        return "Tables: " + ", ".join(tables)
+
+    lines = []
+    for name in chosen:
+        table = tables[name]
+        if dbms == "sql":
+            columns = ", ".join(schema_catalog.format_column(column, table) for column in table["columns"])
+        else:
+            columns = ", ".join(mongo_schema.format_field(column) for column in table["columns"])
+        lines.append(f"{name}: {columns}")
+    others = [name for name in tables if name not in chosen]
+    if others:
+        lines.append("Other tables: " + ", ".join(others))
+    return "\n".join(lines)
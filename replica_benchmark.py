@@ -0,0 +1,152 @@
+import argparse
+import decimal
+import json
+import os
+import tempfile
+import time
+
+import analytics_replica
+import benchmark
+import cost_guard
+import csv_schema
+import load_sqldb
+import query_validator
+import run_full_interface_with_error_correction as interface
+
+# Latency of read-only SQL on the analytical replica against the server, on
+# the bundled datasets. The reads are the SQL answers recorded for the
+# benchmark questions. The server is MySQL with the datasets loaded by
+# load_sqldb.py; when it cannot be reached, benchmark.py's SQLite stand-in
+# takes its place and the report says so. The replica is built in a
+# temporary file, so the one the interface uses is left alone.
+
+REPLICA_BENCHMARK_RUNS = 20  # timed runs of every read on each side
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+# (id, database, SQL) of every recorded read for a SQL benchmark question
+def recorded_reads(questions_path, recording_path):
+    with open(recording_path) as f:
+        recording = json.load(f)
+    reads = []
+    with open(questions_path) as f:
+        for item in (json.loads(line) for line in f if line.strip()):
+            if item["dbms"] != "sql":
+                continue
+            marker = f"Natural Language Query:\n{item['question']}\n"
+            for entry in recording:
+                if "into SQL format" in entry["contains"] and marker in entry["contains"]:
+                    query = interface.extract_query(entry["response"])
+                    if cost_guard.SQL_READ.match(query):
+                        reads.append((item["id"], item["database"], query))
+                    break
+    return reads
+
+
+# {database: DB-API connection} to MySQL, or to SQLite stand-ins when MySQL
+# is unreachable. Returns (connections, name of the server).
+def server_connections(datasets):
+    try:
+        return {database: load_sqldb.connect(database) for database in datasets}, "MySQL"
+    except Exception as e:
+        print(f"MySQL is unreachable ({e}); comparing against the SQLite stand-in instead.")
+        return benchmark.load_sqlite(datasets), "SQLite stand-in"
+
+
+# Seconds per run and the rows of the last run
+def time_server(connection, query, runs):
+    seconds, rows = [], []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        cursor = connection.cursor()
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        seconds.append(time.perf_counter() - started_at)
+    return seconds, rows
+
+
+# Same for the replica; None when the read would go to the server
+def time_replica(database, query, runs):
+    seconds, rows = [], []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        cursor = analytics_replica.execute(query, database)
+        if cursor is None:
+            return None, None
+        rows = cursor.fetchall()
+        seconds.append(time.perf_counter() - started_at)
+    return seconds, rows
+
+
+def _comparable_value(value):
+    if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+        return round(float(value), 6)
+    return str(value)
+
+
+# Rows compared without order and with numbers rounded, as the engines may
+# order ties differently and return sums as integers, decimals or floats
+def _comparable(rows):
+    return sorted(repr(tuple(_comparable_value(value) for value in row)) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare read latency on the analytical replica and the server")
+    parser.add_argument("--runs", type=int, default=REPLICA_BENCHMARK_RUNS)
+    parser.add_argument("--questions", default=benchmark.BENCHMARK_QUESTIONS)
+    parser.add_argument("--recording", default=benchmark.BENCHMARK_RECORDING)
+    args = parser.parse_args()
+    if analytics_replica.load_duckdb() is None:
+        parser.error("the analytical replica needs duckdb (pip install duckdb)")
+    query_validator.load_sqlglot()
+
+    with tempfile.TemporaryDirectory() as directory:
+        analytics_replica.REPLICA_PATH = os.path.join(directory, "replica.duckdb")
+        started_at = time.perf_counter()
+        for database, dataset in benchmark.DATASETS.items():
+            analytics_replica.refresh(database, csv_schema.infer_directory(dataset).values())
+        print(f"Built the replica in {time.perf_counter() - started_at:.1f}s")
+        connections, server = server_connections(benchmark.DATASETS)
+
+        reads = recorded_reads(args.questions, args.recording)
+        print(f"{len(reads)} read(s), {args.runs} run(s) each")
+        print(f"{'read':<10} {server + ' p50 ms':>22} {'replica p50 ms':>15} {'speedup':>8} {'rows':>6}  same")
+        server_total, replica_total, routed, mismatches = 0.0, 0.0, 0, []
+        for read_id, database, query in reads:
+            try:
+                server_seconds, server_rows = time_server(connections[database], query, args.runs)
+            except Exception as e:
+                # Recorded answers the benchmark repairs fail on the server too
+                print(f"{read_id:<10} fails on the server: {e}")
+                continue
+            replica_seconds, replica_rows = time_replica(database, query, args.runs)
+            server_p50 = percentile(server_seconds, 50) * 1000
+            if replica_seconds is None:
+                print(f"{read_id:<10} {server_p50:>22.2f} {'server only':>15}")
+                continue
+            replica_p50 = percentile(replica_seconds, 50) * 1000
+            same = _comparable(server_rows) == _comparable(replica_rows)
+            if not same:
+                mismatches.append(read_id)
+            server_total += server_p50
+            replica_total += replica_p50
+            routed += 1
+            print(f"{read_id:<10} {server_p50:>22.2f} {replica_p50:>15.2f} {server_p50 / replica_p50:>7.1f}x "
+                  f"{len(replica_rows):>6}  {'yes' if same else 'NO'}")
+
+        print(f"\n{routed}/{len(reads)} read(s) ran on the replica: {server_total:.1f} ms on {server}, "
+              f"{replica_total:.1f} ms on the replica (sum of p50s)")
+        if mismatches:
+            print(f"Results differ for: {', '.join(mismatches)}")
+        for connection in connections.values():
+            connection.close()
+        analytics_replica.close()
+
+
+if __name__ == "__main__":
+    main()
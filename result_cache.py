@@ -0,0 +1,252 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import cost_guard
+import metrics
+import mongo_query
+import query_validator
+import schema_catalog
+
+# Results of read queries, kept in memory and shared by all sessions. Entries
+# are keyed by the database and the normalized SQL or the compiled MongoDB
+# plan, and remember the tables they read. A write or DDL statement run
+# through execute_query drops the entries of the tables it touches; entries
+# also expire after RESULT_CACHE_TTL, for writes made outside this process.
+
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_MAX_ENTRIES = 256  # least recently used entries are evicted past this
+RESULT_CACHE_TTL = 60  # seconds a result is served from the cache
+RESULT_CACHE_MAX_ROWS = 1000  # larger results are not kept
+
+SQL_WRITE = re.compile(r"^\s*(insert|replace|update|delete|load|call|create|alter|drop|rename|truncate)\b",
+                       re.IGNORECASE)
+# Reads whose result changes without a write, or which lock or write rows
+SQL_UNCACHEABLE = re.compile(
+    r"\b(now|sysdate|curdate|curtime|current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"utc_date|utc_time|utc_timestamp|unix_timestamp|rand|uuid|uuid_short|connection_id|last_insert_id|"
+    r"found_rows|row_count|sleep|get_lock)\b|\bfor\s+update\b|\block\s+in\s+share\s+mode\b|\binto\s+(outfile|"
+    r"dumpfile|@)",
+    re.IGNORECASE,
+)
+SQL_TABLE = re.compile(r"\b(?:into|update|from|join|table)\s+`?(\w+)`?(?:\s*\.\s*`?(\w+)`?)?", re.IGNORECASE)
+SQL_TOKEN = re.compile(r"('(?:''|\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|`[^`]*`)|\s+")
+MONGO_WRITE_STAGES = ("$out", "$merge")
+
+_entries = OrderedDict()  # key -> {"value", "stream", "tables", "stored_at"}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+_generation = 0  # bumped by every invalidation; reads started earlier are not stored
+
+
+# One space between tokens outside quoted values and no trailing semicolon
+def normalize_sql(query):
+    return SQL_TOKEN.sub(lambda match: match.group(1) or " ", query).strip().rstrip(";").rstrip()
+
+
+# (database, table) pairs a statement names, lower-cased; None when unknown.
+# Without sqlglot, SQL reads depend on every table of their database.
+def sql_tables(query, database):
+    sqlglot = query_validator.load_sqlglot()
+    if sqlglot is not None:
+        exp = sqlglot.exp
+        try:
+            tree = sqlglot.parse_one(query, read="mysql")
+        except sqlglot.errors.ParseError:
+            tree = None
+        if tree is not None and not isinstance(tree, exp.Command):
+            derived = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+            tables = {((table.db or database or "").lower(), table.name.lower())
+                      for table in tree.find_all(exp.Table) if table.name and table.name not in derived}
+            return tables or None
+    if cost_guard.SQL_READ.match(query):
+        return None  # comma joins and subqueries are beyond a regex
+    tables = {((db if name else database or "").lower(), (name or db).lower())
+              for db, name in SQL_TABLE.findall(query)}
+    return tables or None
+
+
+def _stage_targets(pipeline):
+    for stage in pipeline:
+        if not isinstance(stage, dict):
+            continue
+        for name, body in stage.items():
+            if name in ("$lookup", "$graphLookup") and isinstance(body, dict) and body.get("from"):
+                yield body["from"]
+            elif name == "$unionWith":
+                yield body.get("coll") if isinstance(body, dict) else body
+            elif name == "$out":
+                yield body.get("coll") if isinstance(body, dict) else body
+            elif name == "$merge":
+                target = body.get("into") if isinstance(body, dict) else body
+                yield target.get("coll") if isinstance(target, dict) else target
+            if isinstance(body, dict) and isinstance(body.get("pipeline"), list):
+                yield from _stage_targets(body["pipeline"])
+
+
+# Collections a plan reads or writes; None when it reaches the whole database
+def mongo_tables(plan, database):
+    tables = set()
+    for call in plan.calls:
+        if call.collection is None:
+            return None
+        tables.add((database.lower(), call.collection.lower()))
+        tables |= {(database.lower(), name.lower()) for name in _stage_targets(call.pipeline) if name}
+    return tables
+
+
+def mongo_writes(plan):
+    return any(not call.is_read or any(name in stage for stage in call.pipeline for name in MONGO_WRITE_STAGES)
+               for call in plan.calls)
+
+
+# Cache key and tables of a cacheable read, or None
+def lookup_key(dbms, database, query):
+    if not RESULT_CACHE_ENABLED or not database:
+        return None
+    if dbms == "sql":
+        if not cost_guard.SQL_READ.match(query) or SQL_UNCACHEABLE.search(query):
+            return None
+        key = ("sql", database, normalize_sql(query))
+        tables = sql_tables(query, database)
+    else:
+        plan = mongo_query.parse(query)
+        if plan.batch or mongo_writes(plan):
+            return None
+        key = ("mongodb", database, mongo_query.to_text(plan))
+        tables = mongo_tables(plan, database)
+    with _lock:
+        generation = _generation
+    return {"key": key, "tables": tables, "generation": generation}
+
+
+# Returns (True, result) on a hit and (False, None) on a miss
+def get(read):
+    with _lock:
+        entry = _entries.get(read["key"])
+        if entry and time.time() - entry["stored_at"] > RESULT_CACHE_TTL:
+            del _entries[read["key"]]
+            entry = None
+        if entry is None:
+            _stats["misses"] += 1
+        else:
+            _entries.move_to_end(read["key"])
+            _stats["hits"] += 1
+    dbms = read["key"][0]
+    if entry is None:
+        metrics.increment("chatdb_result_cache_misses_total", help_text="Reads not answered from the result cache",
+                          dbms=dbms)
+        return False, None
+    metrics.increment("chatdb_result_cache_hits_total", help_text="Reads answered from the result cache", dbms=dbms)
+    if entry["stream"]:
+        return True, iter(entry["value"])
+    return True, copy.deepcopy(entry["value"])
+
+
+def _put(read, value, stream):
+    with _lock:
+        if read["generation"] != _generation:
+            return  # a write ran while the query did
+        _entries[read["key"]] = {"value": value, "stream": stream, "tables": read["tables"],
+                                 "stored_at": time.time()}
+        _entries.move_to_end(read["key"])
+        while len(_entries) > RESULT_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+# Pass rows through, keeping them when the consumer reads them all
+def _recording(read, rows):
+    kept = []
+    complete = False
+    try:
+        for row in rows:
+            if kept is not None:
+                kept.append(row)
+                if len(kept) > RESULT_CACHE_MAX_ROWS:
+                    kept = None
+            yield row
+        complete = True
+    finally:
+        if hasattr(rows, "close"):
+            rows.close()
+        if complete and kept is not None:
+            _put(read, kept, stream=True)
+
+
+# Remember the result of a read. Row streams are kept once fully consumed;
+# {"message": ...} results are never kept.
+def store(read, results):
+    if isinstance(results, dict) and "message" in results:
+        return results
+    if hasattr(results, "__next__"):
+        return _recording(read, results)
+    _put(read, copy.deepcopy(results), stream=False)
+    return results
+
+
+# Drop entries reading any of tables ((database, table) pairs), and entries
+# with unknown tables in the databases involved. With tables None every entry
+# of database is dropped, and with database None everything of dbms.
+def invalidate(dbms, database=None, tables=None):
+    global _generation
+    database = database.lower() if database else None
+    databases = {database} | {db for db, _ in tables or ()}
+    with _lock:
+        _generation += 1
+        _stats["invalidations"] += 1
+        for key, entry in list(_entries.items()):
+            if key[0] != dbms:
+                continue
+            if database is None:
+                stale = True
+            elif tables is None or entry["tables"] is None:
+                stale = key[1].lower() in databases
+            else:
+                stale = bool(entry["tables"] & tables)
+            if stale:
+                del _entries[key]
+
+
+# Invalidate what a write or DDL statement may have changed; reads are ignored
+def invalidate_query(dbms, database, query):
+    if dbms == "sql":
+        if not SQL_WRITE.match(query):
+            return
+        if schema_catalog.is_ddl(query):
+            # Like the schema catalog, DDL may name any database
+            invalidate("sql")
+        else:
+            invalidate("sql", database, sql_tables(query, database))
+        return
+    try:
+        plan = mongo_query.parse(query)
+    except mongo_query.UnsupportedQuery:
+        return  # never ran
+    if mongo_writes(plan):
+        invalidate("mongodb", database, mongo_tables(plan, database))
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def stats():
+    with _lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+        current = {"hits": hits, "misses": misses, "invalidations": _stats["invalidations"],
+                   "entries": len(_entries)}
+    total = hits + misses
+    current["hit_rate"] = hits / total if total else 0.0
+    return current
+
+
+def summary():
+    current = stats()
+    return (
+        f"Result cache: {current['hits']} hit(s), {current['misses']} miss(es) "
+        f"({current['hit_rate']:.0%} hit rate), {current['invalidations']} invalidation(s), "
+        f"{current['entries']} entries stored."
+    )
@@ -0,0 +1,104 @@
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULT_BATCH_SIZE = 500  # rows fetched from the server per round trip
+RESULT_PAGE_SIZE = 50  # rows printed before asking for "more"
+RESULT_ROW_CAP = 10000  # never print more than this many rows for one query
+
+
+# Stream rows from a MySQL cursor in batches instead of fetchall(). When the
+# consumer stops early the rest is never fetched: the cursor is closed, and
+# the pool drops a MySQL connection left with an unread result.
+def iter_sql_rows(cursor, batch_size=RESULT_BATCH_SIZE):
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass  # mysql-connector refuses while rows are unread
+
+
+# Stream documents from a MongoDB cursor, closing it when the consumer stops early
+def iter_mongo_cursor(cursor, batch_size=RESULT_BATCH_SIZE):
+    cursor.batch_size(batch_size)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+# Collect at most row_cap rows from a stream into a list
+def collect(rows, row_cap=RESULT_ROW_CAP):
+    collected = []
+    try:
+        for row in rows:
+            collected.append(row)
+            if len(collected) >= row_cap:
+                break
+    finally:
+        close = getattr(rows, "close", None)
+        if close:
+            close()
+    return collected
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Print rows as they arrive, pausing every page_size rows. Returns the number
+# of rows printed and timing information.
+def render_rows(rows, started_at=None, page_size=RESULT_PAGE_SIZE, row_cap=RESULT_ROW_CAP, ask=input):
+    started_at = time.perf_counter() if started_at is None else started_at
+    first_row_at = None
+    count = 0
+    capped = False
+    try:
+        for row in rows:
+            if first_row_at is None:
+                first_row_at = time.perf_counter()
+            print(row)
+            count += 1
+            if count >= row_cap:
+                capped = True
+                break
+            if page_size and count % page_size == 0:
+                answer = ask(f"-- {count} rows shown. Press Enter for more, or 'q' to stop: ")
+                if answer.strip().lower() in ("q", "quit", "stop", "n", "no"):
+                    break
+    finally:
+        close = getattr(rows, "close", None)
+        if close:
+            close()
+
+    stats = {
+        "rows": count,
+        "capped": capped,
+        "elapsed": time.perf_counter() - started_at,
+        "first_row": first_row_at - started_at if first_row_at else None,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+    if count == 0:
+        print("Query executed successfully but returned no results.")
+        return stats
+
+    summary = f"-- {count} row(s) in {stats['elapsed']:.2f}s"
+    if stats["first_row"] is not None:
+        summary += f" (first row after {stats['first_row']:.2f}s)"
+    if stats["peak_memory_mb"] is not None:
+        summary += f", peak memory {stats['peak_memory_mb']:.1f} MB"
+    if capped:
+        summary += f"; stopped at the row cap of {row_cap}"
+    print(summary)
+    return stats
@@ -1,21 +1,41 @@
-from google import genai
 import json
-import pymongo
-from bson.objectid import ObjectId
-import mysql.connector
-
-# Configure Gemini API
-client = genai.Client(api_key="") ## enter your own api key
-
-# Interpret user intent
-def interpret_user_input(user_input):
-    prompt = f"""
-You are a database assistant.
-
-Given this user input: \"{user_input}\"
-
-Classify it into one of the following commands:
-- list: if the user wants to list available databases or collections.
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import time
+import analytics_replica
+import connection_manager
+import cost_guard
+import intent_classifier
+import llm_backend
+import metrics
+import mongo_query
+import mongo_schema
+import query_cache
+import query_validator
+import result_cache
+import result_stream
+import schema_catalog
+import schema_retrieval
+
+# Configure Gemini API (api key, model, timeouts and rate limits live in llm_backend.py)
+llm = llm_backend.create_backend()
+
+# Classify and generate a query in one Gemini call instead of two
+FUSED_MODE = False
+
+# Opt-in: when a query fails, ask for this many fixes at once instead of one
+# at a time, and run the valid ones cheapest first until one succeeds
+REPAIR_CANDIDATES = 0
+CANDIDATE_GRACE_SECONDS = 2.0  # wait for slower candidates after the first arrives
+# Appended to the fix_query prompt of each candidate so they differ
+CANDIDATE_HINTS = [
+    "",
+    "Prefer the simplest query that answers the same question, checking every name against the schema.",
+    "If possible, take a different approach than the original query (other joins, subqueries or operators).",
+]
+candidate_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="candidate")
+
+# Commands the user input is classified into
+COMMAND_DESCRIPTIONS = """- list: if the user wants to list available databases or collections.
 - switch: if the user wants to switch between SQL and MongoDB.
 - select: if the user wants to use or switch to a specific database.
 - query: if the user is asking a natural language query to be converted to SQL or MongoDB.
@@ -24,7 +44,103 @@ Classify it into one of the following commands:
 - schema_sample: if the user wants to view only a sample row from a specific table/collection.
 - schema: if the user wants to view the complete schema of a database.
 - exit: if the user wants to quit.
+"""
+
+# How generated queries must be returned, shared by the query prompts
+QUERY_FORMAT_INSTRUCTIONS = """Return ONLY the query and nothing else, inside triple backticks with a 'sql' or 'json' tag depending on the DBMS.
+If the query is for MongoDB, use the proper MongoDB syntax in Python, not JSON. For example:
+- For regular queries: db.collection.find({"field": "value"})
+- For aggregation: db.collection.aggregate([
+    {"$match": {"field": "value"}},
+    {"$group": {"_id": "$field", "count": {"$sum": 1}}}
+])
+- For updates: 
+  # Update one document
+  db.collection.update_one(
+    {"field": "value"},
+    {"$set": {"field": "new_value"}}
+  )
+  # Update multiple documents
+  db.collection.update_many(
+    {"field": "value"},
+    {"$set": {"field": "new_value"}}
+  )
+- For inserts: 
+    db.collection.insert_one({"field": "value"})
+    # For multiple inserts, use:
+    db.collection.insert_many([
+        {"field": "value1"},
+        {"field": "value2"}
+    ])
+
+- For deletes: db.collection.delete_one({"field": "value"})
+
+For SQL, use proper SQL syntax. For example: SELECT * FROM table WHERE field = 'value'
+"""
+
+# Fingerprint of the current schema, used to key cached queries
+def get_schema_fingerprint(dbms, db_name):
+    try:
+        catalog = get_mysql_catalog(db_name) if dbms == "sql" else get_mongodb_catalog(db_name)
+        return schema_catalog.fingerprint(catalog)
+    except Exception:
+        return ""
+
+# Names of the databases on the server (uncached)
+def fetch_database_names(dbms):
+    if dbms == "sql":
+        with connections.mysql() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SHOW DATABASES")
+            return [db[0] for db in cursor.fetchall()]
+    return get_mongo_client().list_database_names()
+
+# Names the local intent classifier can match targets against
+def get_known_names(session):
+    if connections.unreachable_error(session.dbms):
+        return [], []
+    try:
+        database_names = schema_catalog.get_cached(
+            ("databases", session.dbms), lambda: fetch_database_names(session.dbms)
+        )
+        table_names = []
+        if session.database:
+            catalog = get_mysql_catalog(session.database) if session.dbms == "sql" else get_mongodb_catalog(session.database)
+            table_names = list(catalog["tables"])
+        return database_names, table_names
+    except Exception:
+        return [], []
+
+# Try the local intent classifier; returns (command, target) or None when unsure
+def classify_locally(user_input, session):
+    command, target, confidence = intent_classifier.classify(user_input, *get_known_names(session))
+    if confidence >= intent_classifier.INTENT_CONFIDENCE_THRESHOLD:
+        intent_classifier.record(local=True)
+        return command, target
+    intent_classifier.record(local=False)
+    return None
+
+# Interpret user intent
+def interpret_user_input(user_input, use_local=True, session=None):
+    session = session or console_session
+    # Resolve common commands locally and only ask Gemini when unsure
+    with metrics.span("intent") as span:
+        if use_local:
+            local_result = classify_locally(user_input, session)
+            if local_result:
+                span["local"] = True
+                return local_result
+        span["local"] = False
+        return _interpret_with_llm(user_input)
+
+def _interpret_with_llm(user_input):
+    prompt = f"""
+You are a database assistant.
+
+Given this user input: \"{user_input}\"
 
+Classify it into one of the following commands:
+{COMMAND_DESCRIPTIONS}
 If you are unsure or the input does not fit any category, respond with:
 {{"command": "unknown", "target": ""}}
 
@@ -32,17 +148,13 @@ Respond ONLY in this JSON format:
 {{"command": "COMMAND", "target": "EXTRACTED_TARGET_OR_QUERY"}}
 """
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        text = response.text.strip("```json\n").strip("```").strip()
+        text = ask_llm(prompt).strip("```json\n").strip("```").strip()
         data = json.loads(text)
 
         command = data.get("command", "unknown").lower()
         target = data.get("target", "")
 
-        if command not in ["list", "switch", "select", "query", "schema_tables", "schema_columns", "schema_sample", "schema", "exit"]:
+        if command not in intent_classifier.COMMANDS:
             command = "unknown"
 
         return command, target
@@ -51,36 +163,95 @@ Respond ONLY in this JSON format:
         print("Could not parse Gemini response:", e)
         return "unknown", ""
 
+# Interpret user intent and, for queries, generate the query in the same call.
+# Returns (command, target, query); query is None when nothing was generated
+def interpret_and_convert(user_input, use_local=True, session=None):
+    session = session or console_session
+    with metrics.span("intent", fused=True) as span:
+        if use_local:
+            local_result = classify_locally(user_input, session)
+            if local_result:
+                span["local"] = True
+                return local_result + (None,)
+        span["local"] = False
+        return _interpret_and_convert_with_llm(user_input, session)
+
+def _interpret_and_convert_with_llm(user_input, session):
+    db_type = "SQL" if session.dbms == "sql" else "MongoDB"
+    schema_info = "(no database selected)"
+    if session.database:
+        schema_info = get_prompt_schema(session.dbms, session.database, user_input)
+    prompt = f"""
+You are a database assistant working with {db_type}.
+
+Given this user input: \"{user_input}\"
+
+Classify it into one of the following commands:
+{COMMAND_DESCRIPTIONS}
+If you are unsure or the input does not fit any category, use the command "unknown".
+
+Start your answer with ONLY this JSON object on a single line, without backticks:
+{{"command": "COMMAND", "target": "EXTRACTED_TARGET_OR_QUERY"}}
+
+If the command is "query", follow the JSON with the {db_type} query for the request.
+The JSON line always comes first; format the query itself as follows.
+
+Database Schema:
+{schema_info}
+
+{QUERY_FORMAT_INSTRUCTIONS}"""
+    try:
+        text = ask_llm(prompt)
+        start = text.index("{")
+        data, end = json.JSONDecoder().raw_decode(text, start)
+
+        command = data.get("command", "unknown").lower()
+        target = data.get("target", "")
+        if command not in intent_classifier.COMMANDS:
+            command = "unknown"
+
+        query = None
+        if command == "query" and "```" in text[end:]:
+            query = extract_query(text[end:])
+        return command, target, query
+
+    except Exception as e:
+        print("Could not parse Gemini response:", e)
+        return "unknown", "", None
+
 # List databases or collections
-def list_databases():
-    if current_dbms == "mongodb":
+def list_databases(session=None):
+    session = session or console_session
+    if session.dbms == "mongodb":
         print("MongoDB Databases:")
-        print(mongo_client.list_database_names())
-    elif current_dbms == "sql":
-        mysql_cursor.execute("SHOW DATABASES")
+        print(fetch_database_names("mongodb"))
+    elif session.dbms == "sql":
         print("MySQL Databases:")
-        for db in mysql_cursor.fetchall():
-            print(db[0])
+        for db in fetch_database_names("sql"):
+            print(db)
+
+# Get the cached MongoDB catalog inferred from sampled documents
+def get_mongodb_catalog(db_name):
+    return schema_catalog.get_catalog(
+        "mongodb", db_name, lambda: mongo_schema.load_mongodb_catalog(get_mongo_client(), db_name)
+    )
 
 # Get MongoDB schema
 def get_mongodb_schema(db_name):
     try:
-        db = mongo_client[db_name]
-        collections = db.list_collection_names()
+        catalog = get_mongodb_catalog(db_name)
         
         schema_info = f"Database: {db_name}\nCollections:\n"
         
-        for collection in collections:
-            # Get a sample document to understand the structure
-            sample_doc = db[collection].find_one()
-            if sample_doc:
-                # Convert ObjectId to string for JSON serialization
-                for key, value in sample_doc.items():
-                    if isinstance(value, ObjectId):
-                        sample_doc[key] = str(value)
-                
-                schema_info += f"\nCollection: {collection}\n"
-                schema_info += f"Sample document structure: {json.dumps(sample_doc, indent=2)}\n"
+        for collection, info in catalog["tables"].items():
+            if info["sample"]:
+                schema_info += f"\nCollection: {collection} ({info['row_count']} documents, {info['sampled']} sampled)\n"
+                schema_info += "Fields:\n"
+                for column in info["columns"]:
+                    schema_info += f"  - {mongo_schema.format_field(column)}\n"
+                if info.get("embedded"):
+                    schema_info += mongo_schema.format_embedded(info) + "\n"
+                schema_info += f"Sample document structure: {json.dumps(info['sample'], indent=2)}\n"
             else:
                 schema_info += f"\nCollection: {collection} (empty)\n"
         
@@ -88,71 +259,88 @@ def get_mongodb_schema(db_name):
     except Exception as e:
         return f"Error getting MongoDB schema: {str(e)}"
 
+# Get the cached MySQL catalog (columns, keys, types and sample rows)
+def get_mysql_catalog(db_name):
+    def load():
+        with connections.mysql() as conn:
+            return schema_catalog.load_mysql_catalog(conn.cursor(), db_name)
+    return schema_catalog.get_catalog("sql", db_name, load)
+
 # Get MySQL schema
 def get_mysql_schema(db_name):
     try:
-        # Switch to the specified database
-        mysql_cursor.execute(f"USE {db_name}")
-        
-        # Get all tables
-        mysql_cursor.execute("SHOW TABLES")
-        tables = mysql_cursor.fetchall()
+        catalog = get_mysql_catalog(db_name)
         
         schema_info = f"Database: {db_name}\nTables:\n"
         
-        for table in tables:
-            table_name = table[0]
+        for table_name, table in catalog["tables"].items():
             schema_info += f"\nTable: {table_name}\n"
             
-            # Get table structure
-            mysql_cursor.execute(f"DESCRIBE {table_name}")
-            columns = mysql_cursor.fetchall()
-            
             schema_info += "Columns:\n"
-            for column in columns:
-                schema_info += f"  - {column[0]} ({column[1]})"
-                if column[2] == "NO":
-                    schema_info += " NOT NULL"
-                if column[3] == "PRI":
-                    schema_info += " PRIMARY KEY"
-                if column[4] == "auto_increment":
-                    schema_info += " AUTO_INCREMENT"
-                schema_info += "\n"
+            for column in table["columns"]:
+                schema_info += f"  - {schema_catalog.format_column(column, table)}\n"
             
-            # Get a sample row
-            mysql_cursor.execute(f"SELECT * FROM {table_name} LIMIT 1")
-            sample_row = mysql_cursor.fetchone()
-            if sample_row:
+            if table["sample"]:
                 schema_info += "Sample row:\n"
-                schema_info += f"  {sample_row}\n"
+                schema_info += f"  {tuple(table['sample'].values())}\n"
         
         return schema_info
     except Exception as e:
         return f"Error getting MySQL schema: {str(e)}"
 
 # Switch database
-def switch_database(db_name):
-    global current_mongo_db, current_sql_db
-    if current_dbms == "mongodb":
-        current_mongo_db = mongo_client[db_name]
+def switch_database(db_name, session=None):
+    session = session or console_session
+    if session.dbms == "mongodb":
+        session.use(db_name)
         print(f"Switched to MongoDB database: {db_name}")
-    elif current_dbms == "sql":
+    elif session.dbms == "sql":
+        import mysql.connector
+
         try:
-            mysql_conn.database = db_name
-            current_sql_db = db_name
+            session.use(db_name)
             print(f"Switched to SQL database: {db_name}")
         except mysql.connector.Error as err:
             print("Failed to switch SQL database:", err)
 
+# Extract the query from a Gemini response
+def extract_query(query_text):
+    # Extract only inside ```sql ... ```
+    if "```" in query_text:
+        query_text = query_text.split("```")[1]
+        query_text = query_text.strip().split("\n", 1)[1]  # Remove "sql" or "json" line
+    return query_text.strip()
+
+# Get the (cached) schema description of a database
+def get_schema_info(dbms, db_name):
+    if dbms == "mongodb":
+        return get_mongodb_schema(db_name)
+    return get_mysql_schema(db_name)
+
+# Schema for the prompt of a question: the tables relevant to it, or the full
+# description when retrieval is off or fails
+def get_prompt_schema(dbms, db_name, question):
+    if not schema_retrieval.SCHEMA_RETRIEVAL_ENABLED:
+        return get_schema_info(dbms, db_name)
+    try:
+        catalog = get_mysql_catalog(db_name) if dbms == "sql" else get_mongodb_catalog(db_name)
+        schema_info, _ = schema_retrieval.relevant_schema(catalog, question)
+    except Exception:
+        return get_schema_info(dbms, db_name)
+    metrics.observe("chatdb_prompt_schema_tokens", schema_retrieval.estimate_tokens(schema_info),
+                    buckets=metrics.COUNT_BUCKETS, help_text="Estimated tokens of schema text per prompt",
+                    dbms=dbms)
+    return schema_info
+
 # Run natural language query
-def convert_to_query(natural_query, db_type):
+def convert_to_query(natural_query, db_type, dbms=None, database=None):
+    dbms = dbms or console_session.dbms
+    database = database or console_session.database
     # Get schema information based on the current database
     schema_info = ""
-    if current_database:
-        if current_dbms == "mongodb":
-            schema_info = get_mongodb_schema(current_database)
-        elif current_dbms == "sql":
-            schema_info = get_mysql_schema(current_database)
+    if database:
+        with metrics.span("schema_fetch", dbms=dbms, database=database):
+            schema_info = get_prompt_schema(dbms, database, natural_query)
     
     prompt = f"""
 You are a database assistant. Convert this natural language query into {db_type} format.
@@ -163,48 +351,36 @@ Database Schema:
 Natural Language Query:
 {natural_query}
 
-Return ONLY the query and nothing else, inside triple backticks with a 'sql' or 'json' tag depending on the DBMS.
-If the query is for MongoDB, use the proper MongoDB syntax in Python, not JSON. For example:
-- For regular queries: db.collection.find({{"field": "value"}})
-- For aggregation: db.collection.aggregate([
-    {{"$match": {{"field": "value"}}}},
-    {{"$group": {{"_id": "$field", "count": {{"$sum": 1}}}}}}
-])
-- For updates: 
-  # Update one document
-  db.collection.update_one(
-    {{"field": "value"}},
-    {{"$set": {{"field": "new_value"}}}}
-  )
-  # Update multiple documents
-  db.collection.update_many(
-    {{"field": "value"}},
-    {{"$set": {{"field": "new_value"}}}}
-  )
-- For inserts: 
-    db.collection.insert_one({{"field": "value"}})
-    # For multiple inserts, use:
-    db.collection.insert_many([
-        {{"field": "value1"}},
-        {{"field": "value2"}}
-    ])
-
-- For deletes: db.collection.delete_one({{"field": "value"}})
-
-For SQL, use proper SQL syntax. For example: SELECT * FROM table WHERE field = 'value'
-"""
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-    query_text = response.text
-    # Extract only inside ```sql ... ```
-    if "```" in query_text:
-        query_text = query_text.split("```")[1]
-        query_text = query_text.strip().split("\n", 1)[1]  # Remove "sql" or "json" line
-    return query_text.strip()
-
-def fix_query(original_query, error_message, db_type):
+{QUERY_FORMAT_INSTRUCTIONS}"""
+    with metrics.span("generate", dbms=dbms):
+        return extract_query(ask_llm(prompt))
+
+# llm.generate, given no longer than what is left of the thread's time
+# budget (cost_guard.time_budget, set for batch items)
+def ask_llm(prompt):
+    return llm.generate(prompt, timeout=cost_guard.remaining_seconds())
+
+# Get the query for a question: from the query cache, the fused call's
+# output or convert_to_query. Returns (query, fingerprint, cached)
+def generate_query(question, dbms, database, fused_query=None):
+    fingerprint = get_schema_fingerprint(dbms, database)
+    query = query_cache.get(dbms, database, fingerprint, question)
+    if query:
+        metrics.increment("chatdb_query_cache_hits_total", help_text="Queries served from the query cache", dbms=dbms)
+        return query, fingerprint, True
+    if fused_query:
+        return fused_query, fingerprint, False
+    query = convert_to_query(question, "SQL" if dbms == "sql" else "MongoDB", dbms, database)
+    return query, fingerprint, False
+
+# Remember the query that finally worked, or forget one that failed
+def record_query_outcome(question, dbms, database, fingerprint, final_query, error):
+    if error:
+        query_cache.delete(dbms, database, fingerprint, question)
+    else:
+        query_cache.put(dbms, database, fingerprint, question, final_query)
+
+def fix_query(original_query, error_message, db_type, schema_info="", hint=""):
     prompt = f"""
 You are a database assistant. Fix this {db_type} query that resulted in an error.
 
@@ -214,91 +390,315 @@ Original Query:
 Error Message:
 {error_message}
 
+Relevant Schema:
+{schema_info or "(not available)"}
+
 Return ONLY the fixed query and nothing else, inside triple backticks with a 'sql' or 'json' tag depending on the DBMS.
 If the query is for MongoDB, use the proper MongoDB syntax in Python, not JSON. For example: db.users.find() or db.users.aggregate()
 """
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-    query_text = response.text
-    # Extract only inside ```sql ... ```
-    if "```" in query_text:
-        query_text = query_text.split("```")[1]
-        query_text = query_text.strip().split("\n", 1)[1]  # Remove "sql" or "json" line
-    return query_text.strip()
-
-def execute_query(query, db_type):
+    if hint:
+        prompt += hint + "\n"
+    return extract_query(ask_llm(prompt))
+
+# Run a generated MongoDB query against db. query is the generated text or
+# its compiled plan (mongo_query.MongoQuery); limit and max_time_ms come from
+# the cost guard
+def run_mongodb_query(db, query, limit=None, max_time_ms=None):
+    if isinstance(query, str):
+        query = mongo_query.parse(query)
+    # Check if the query is a list of operations
+    if query.batch:
+        # Execute each operation in the list
+        operations = [mongo_query.execute(db, call, limit, max_time_ms) for call in query.calls]
+        results = []
+        for op in operations:
+            if hasattr(op, "inserted_ids"):
+                results.append(f"Documents inserted with IDs: {op.inserted_ids}")
+            elif hasattr(op, "inserted_id"):
+                results.append(f"Document inserted with ID: {op.inserted_id}")
+            elif hasattr(op, "modified_count"):
+                results.append(f"Modified {op.modified_count} document(s)")
+            elif hasattr(op, "deleted_count"):
+                results.append(f"Deleted {op.deleted_count} document(s)")
+        return {"message": "\n".join(results)}
+    else:
+        # Regular MongoDB query
+        exec_result = mongo_query.execute(db, query.calls[0], limit, max_time_ms)
+        
+        # Handle different types of MongoDB operations
+        if hasattr(exec_result, "inserted_ids"):  # Insert many operation
+            return {"message": f"Documents inserted with IDs: {exec_result.inserted_ids}"}
+        elif hasattr(exec_result, "inserted_id"):  # Insert one operation
+            return {"message": f"Document inserted with ID: {exec_result.inserted_id}"}
+        elif hasattr(exec_result, "modified_count"):  # Update operation
+            return {"message": f"Modified {exec_result.modified_count} document(s)"}
+        elif hasattr(exec_result, "deleted_count"):  # Delete operation
+            return {"message": f"Deleted {exec_result.deleted_count} document(s)"}
+        elif hasattr(exec_result, "next"):  # Find operation
+            return result_stream.iter_mongo_cursor(exec_result, mongo_query.MONGO_BATCH_SIZE)
+        else:
+            return exec_result
+
+# Execute a query, asking Gemini to fix it on errors. session defaults to the
+# console session and database to the session's database; connection to the
+# session's MySQL connection or the shared Mongo client (any DB-API connection
+# or MongoClient-like object works)
+def execute_query(query, db_type, database=None, connection=None, session=None):
+    session = session or console_session
+    database = database or session.database
+    catalog = get_validation_catalog(db_type, database)
     max_attempts = 3
     attempt = 0
     last_error = None
+    refreshed = False
     
     while attempt < max_attempts:
         try:
-            if db_type == "sql":
-                mysql_cursor.execute(query)
-                results = mysql_cursor.fetchall()
-                return results, None
-            else:
-                db = mongo_client[current_database]
-                # Check if the query is a list of pipeline stages
-                if isinstance(query, list):
-                    # Execute the aggregation pipeline
-                    exec_result = db.artist.aggregate(query)
-                    results = list(exec_result)
-                    return results, None
-                else:
-                    # Check if the query is a list of operations
-                    if query.strip().startswith('[') and query.strip().endswith(']'):
-                        # Execute each operation in the list
-                        operations = eval(query)
-                        results = []
-                        for op in operations:
-                            if hasattr(op, "inserted_ids"):
-                                results.append(f"Documents inserted with IDs: {op.inserted_ids}")
-                            elif hasattr(op, "inserted_id"):
-                                results.append(f"Document inserted with ID: {op.inserted_id}")
-                            elif hasattr(op, "modified_count"):
-                                results.append(f"Modified {op.modified_count} document(s)")
-                            elif hasattr(op, "deleted_count"):
-                                results.append(f"Deleted {op.deleted_count} document(s)")
-                        return {"message": "\n".join(results)}, None
-                    else:
-                        # Regular MongoDB query
-                        exec_result = eval(f"{query}")
-                        
-                        # Handle different types of MongoDB operations
-                        if hasattr(exec_result, "inserted_ids"):  # Insert many operation
-                            return {"message": f"Documents inserted with IDs: {exec_result.inserted_ids}"}, None
-                        elif hasattr(exec_result, "inserted_id"):  # Insert one operation
-                            return {"message": f"Document inserted with ID: {exec_result.inserted_id}"}, None
-                        elif hasattr(exec_result, "modified_count"):  # Update operation
-                            return {"message": f"Modified {exec_result.modified_count} document(s)"}, None
-                        elif hasattr(exec_result, "deleted_count"):  # Delete operation
-                            return {"message": f"Deleted {exec_result.deleted_count} document(s)"}, None
-                        elif hasattr(exec_result, "next"):  # Find operation
-                            results = list(exec_result)
-                            return results, None
-                        else:
-                            return exec_result, None
+            cost_guard.check_budget()
+            # Names are checked against the cached schema first, so broken
+            # queries never reach the database
+            try:
+                query = validate_query(query, db_type, catalog)
+            except query_validator.ValidationError as e:
+                if refreshed or not e.unknown_table:
+                    raise
+                # The table may be newer than the cached catalog; reload it once
+                refreshed = True
+                catalog = refresh_validation_catalog(db_type, database, catalog)
+                query = validate_query(query, db_type, catalog)
+            with metrics.span("execute", dbms=db_type, attempt=attempt + 1):
+                return _execute_cached(query, db_type, database, connection, session), None, query
+        except cost_guard.QueryRejected as e:
+            # Declined by the cost guard; nothing for fix_query to repair
+            print(f"\n{e}")
+            return None, str(e), query
         except Exception as e:
+            if connection_manager.is_unreachable(e):
+                # Nor when the server is down
+                connections.mark_unreachable(db_type, e)
+                return None, str(e), query
             last_error = str(e)
             print(f"\nQuery error (attempt {attempt + 1}/{max_attempts}): {last_error}")
             
+            if attempt < max_attempts - 1 and REPAIR_CANDIDATES > 1:
+                return repair_with_candidates(query, last_error, db_type, database, connection, session, catalog,
+                                              max_attempts - 1 - attempt)
             if attempt < max_attempts - 1:
                 print("Attempting to fix the query...")
-                fixed_query = fix_query(query, last_error, db_type)
+                metrics.increment("chatdb_repairs_total", help_text="fix_query repair attempts", attempt=attempt + 1)
+                schema_info = query_validator.schema_slice(query, db_type, catalog, last_error)
+                with metrics.span("repair", dbms=db_type, attempt=attempt + 1):
+                    fixed_query = fix_query(query, last_error, db_type, schema_info)
                 print(f"Fixed query: {fixed_query}")
                 query = fixed_query
             attempt += 1
     
-    return None, last_error
+    metrics.increment("chatdb_failed_queries_total", help_text="Queries that failed after every repair", dbms=db_type)
+    return None, last_error, query
+
+if metrics.PROFILE_PATH:
+    # Opt-in: accumulate cProfile stats of every execution, up to the last
+    # row fetched, in CHATDB_PROFILE
+    execute_query = metrics.profiled(execute_query)
+
+# Speculative repair: each round asks for REPAIR_CANDIDATES fixes at once,
+# drops those that fail validation or EXPLAIN, and runs the rest cheapest
+# first. The first success is returned and the remaining candidates are
+# dropped. Candidates run one at a time, on the caller's connection, so at
+# most one write succeeds. Returns what execute_query returns.
+def repair_with_candidates(query, error, db_type, database, connection, session, catalog, rounds):
+    for round_number in range(1, rounds + 1):
+        print(f"Attempting to fix the query ({REPAIR_CANDIDATES} candidates)...")
+        metrics.increment("chatdb_repairs_total", help_text="fix_query repair attempts", attempt=round_number)
+        schema_info = query_validator.schema_slice(query, db_type, catalog, error)
+        with metrics.span("repair", dbms=db_type, attempt=round_number, candidates=REPAIR_CANDIDATES):
+            candidates = generate_candidates(query, error, db_type, schema_info)
+        ranked, rejected = rank_candidates(candidates, db_type, database, connection, session, catalog)
+        failed = []
+        for candidate, estimate in ranked:
+            print(f"Trying candidate (estimated {estimate if estimate is not None else 'unknown'} rows): {candidate}")
+            metrics.increment("chatdb_candidate_executions_total", help_text="Repair candidates run against the database",
+                              dbms=db_type)
+            try:
+                with metrics.span("execute", dbms=db_type, attempt=round_number + 1):
+                    return _execute_cached(candidate, db_type, database, connection, session), None, candidate
+            except cost_guard.QueryRejected as e:
+                print(f"\n{e}")
+                return None, str(e), candidate
+            except Exception as e:
+                failed.append((candidate, str(e)))
+                print(f"Candidate failed: {e}")
+        if failed or rejected:
+            # The next round repairs the cheapest candidate that reached the
+            # database, or else the first one rejected locally
+            query, error = (failed or rejected)[0]
+        print(f"\nQuery error (repair round {round_number}/{rounds}): {error}")
+
+    metrics.increment("chatdb_failed_queries_total", help_text="Queries that failed after every repair", dbms=db_type)
+    return None, error, query
+
+# Ask for REPAIR_CANDIDATES fixes concurrently. Waits for the first and then
+# up to CANDIDATE_GRACE_SECONDS for the rest; stragglers are cancelled.
+# Returns the distinct candidates in arrival order.
+def generate_candidates(query, error, db_type, schema_info):
+    # The pool's threads get what is left of this thread's time budget
+    remaining = cost_guard.remaining_seconds()
+    futures = [
+        candidate_pool.submit(_fix_within, remaining, query, error, db_type, schema_info,
+                              CANDIDATE_HINTS[i % len(CANDIDATE_HINTS)])
+        for i in range(REPAIR_CANDIDATES)
+    ]
+    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+    if pending:
+        done, pending = wait(futures, timeout=CANDIDATE_GRACE_SECONDS)
+    for future in pending:
+        future.cancel()
+    candidates = []
+    for future in futures:
+        if future not in done or future.exception() is not None:
+            continue
+        candidate = future.result()
+        if candidate and candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+def _fix_within(seconds, *args):
+    with cost_guard.time_budget(seconds):
+        return fix_query(*args)
+
+# Validate candidates and order them by their estimated rows (EXPLAIN for
+# SQL, the cost guard's estimate for MongoDB), unknown estimates last.
+# Returns ([(candidate, estimate)], [(candidate, error)] for rejected ones)
+def rank_candidates(candidates, db_type, database, connection, session, catalog):
+    ranked, failed = [], []
+    for candidate in candidates:
+        try:
+            candidate = validate_query(candidate, db_type, catalog)
+            if db_type == "sql":
+                estimate = cost_guard.explain_sql(candidate, _sql_executor(connection, session))
+            else:
+                plan = mongo_query.parse(candidate)
+                estimate = cost_guard.estimate_mongodb((connection or get_mongo_client())[database], plan)
+        except Exception as e:
+            failed.append((candidate, str(e)))
+            continue
+        if all(candidate != seen for seen, _ in ranked):
+            ranked.append((candidate, estimate))
+    ranked.sort(key=lambda pair: (pair[1] is None, pair[1] or 0))
+    return ranked, failed
+
+# Catalog the validator checks names against; None skips validation
+def get_validation_catalog(db_type, database):
+    if not database:
+        return None
+    try:
+        return get_mysql_catalog(database) if db_type == "sql" else get_mongodb_catalog(database)
+    except Exception:
+        return None
+
+# Load the catalog again, bypassing the cache; the old one when that fails
+def refresh_validation_catalog(db_type, database, catalog):
+    schema_catalog.invalidate(db_type, database)
+    fresh = get_validation_catalog(db_type, database)
+    if fresh is None and catalog is not None:
+        schema_catalog.store((db_type, database), catalog)
+    return fresh or catalog
+
+# Correct near-miss names locally; raises query_validator.ValidationError
+# for problems only the LLM can fix
+def validate_query(query, db_type, catalog):
+    with metrics.span("validate", dbms=db_type) as span:
+        try:
+            validated, fixes = query_validator.validate(query, db_type, catalog)
+        except query_validator.ValidationError:
+            metrics.increment("chatdb_validation_failures_total", help_text="Queries rejected by local validation",
+                              dbms=db_type)
+            raise
+        span["fixes"] = len(fixes)
+    if fixes:
+        metrics.increment("chatdb_local_fixes_total", len(fixes), help_text="Names corrected without the LLM",
+                          dbms=db_type)
+        print(f"Corrected locally ({', '.join(fixes)}): {validated}")
+    return validated
+
+# Answer reads from the result cache when possible; writes drop the cached
+# results of the tables they touch, whether or not they succeed, and keep
+# those tables off the analytical replica
+def _execute_cached(query, db_type, database, connection, session):
+    read = result_cache.lookup_key(db_type, database, query)
+    if read is None:
+        try:
+            return _execute_once(query, db_type, database, connection, session)
+        finally:
+            result_cache.invalidate_query(db_type, database, query)
+            if db_type == "sql":
+                analytics_replica.record_write(database, query)
+    hit, results = result_cache.get(read)
+    if hit:
+        return results
+    return result_cache.store(read, _execute_once(query, db_type, database, connection, session))
+
+# Run a query once, after the cost guard has checked it; returns a row
+# stream, a {"message": ...} dict or a scalar
+def _execute_once(query, db_type, database, connection, session):
+    if db_type == "sql" and connection is None:
+        # Plain reads the analytical replica has up-to-date copies of the
+        # tables for run there; the server is only asked for the tables'
+        # versions
+        cursor = analytics_replica.execute(query, database, _sql_executor(connection, session))
+        if cursor is not None:
+            return result_stream.iter_sql_rows(cursor)
+    if db_type == "sql":
+        execute = _sql_executor(connection, session)
+        cursor = execute(cost_guard.guard_sql(query, execute, database))
+        if schema_catalog.is_ddl(query):
+            # DDL may name any database, so drop every cached SQL catalog
+            schema_catalog.invalidate("sql")
+        if cursor.description is None:
+            return {"message": f"{cursor.rowcount} row(s) affected"}
+        # Rows are streamed in batches as they are printed
+        return result_stream.iter_sql_rows(cursor)
+    db = (connection or get_mongo_client())[database]
+    plan = mongo_query.parse(query)
+    decision = cost_guard.guard_mongodb(db, plan, query, database)
+    results = run_mongodb_query(db, plan, decision["limit"], decision["max_time_ms"])
+    if isinstance(results, dict) and "message" in results:
+        # Writes can add collections or shift counts, so re-check the inferred schema
+        schema_catalog.invalidate("mongodb", database)
+    return results
+
+# execute(sql) for a connection, or the session's connection when None
+def _sql_executor(connection, session):
+    if connection:
+        return lambda sql: _execute_on_connection(connection, sql)
+    return lambda sql: _execute_in_session(sql, session)
+
+def _execute_on_connection(connection, query):
+    cursor = connection.cursor()
+    cursor.execute(query)
+    return cursor
+
+# Run a statement on the session's connection. If the server dropped the
+# connection, check out a fresh one and send the statement again.
+def _execute_in_session(query, session):
+    import mysql.connector
+
+    try:
+        cursor = session.cursor()
+        cursor.execute(query)
+    except (mysql.connector.OperationalError, mysql.connector.InterfaceError) as err:
+        if err.errno not in CONNECTION_LOST_ERRORS:
+            raise
+        session.reconnect()
+        cursor = session.cursor()
+        cursor.execute(query)
+    return cursor
+
 
 # Get MongoDB tables/collections
 def get_mongodb_tables(db_name):
     try:
-        db = mongo_client[db_name]
-        collections = db.list_collection_names()
+        collections = get_mongodb_catalog(db_name)["tables"]
         return f"Database: {db_name}\nCollections:\n" + "\n".join(f"- {collection}" for collection in collections)
     except Exception as e:
         return f"Error getting MongoDB collections: {str(e)}"
@@ -306,15 +706,11 @@ def get_mongodb_tables(db_name):
 # Get MongoDB columns/attributes for a collection
 def get_mongodb_columns(db_name, collection_name):
     try:
-        db = mongo_client[db_name]
-        collection = db[collection_name]
-        sample_doc = collection.find_one()
-        if sample_doc:
-            # Convert ObjectId to string for JSON serialization
-            for key, value in sample_doc.items():
-                if isinstance(value, ObjectId):
-                    sample_doc[key] = str(value)
-            return f"Collection: {collection_name}\nAttributes:\n" + "\n".join(f"- {key}" for key in sample_doc.keys())
+        info = get_mongodb_catalog(db_name)["tables"].get(collection_name)
+        if info and info["sample"]:
+            return f"Collection: {collection_name}\nAttributes:\n" + "\n".join(
+                f"- {mongo_schema.format_field(column)}" for column in info["columns"]
+            )
         else:
             return f"Collection {collection_name} is empty"
     except Exception as e:
@@ -323,15 +719,9 @@ def get_mongodb_columns(db_name, collection_name):
 # Get MongoDB sample row
 def get_mongodb_sample(db_name, collection_name):
     try:
-        db = mongo_client[db_name]
-        collection = db[collection_name]
-        sample_doc = collection.find_one()
-        if sample_doc:
-            # Convert ObjectId to string for JSON serialization
-            for key, value in sample_doc.items():
-                if isinstance(value, ObjectId):
-                    sample_doc[key] = str(value)
-            return f"Collection: {collection_name}\nSample Document:\n{json.dumps(sample_doc, indent=2)}"
+        info = get_mongodb_catalog(db_name)["tables"].get(collection_name)
+        if info and info["sample"]:
+            return f"Collection: {collection_name}\nSample Document:\n{json.dumps(info['sample'], indent=2)}"
         else:
             return f"Collection {collection_name} is empty"
     except Exception as e:
@@ -340,27 +730,21 @@ def get_mongodb_sample(db_name, collection_name):
 # Get MySQL tables
 def get_mysql_tables(db_name):
     try:
-        mysql_cursor.execute(f"USE {db_name}")
-        mysql_cursor.execute("SHOW TABLES")
-        tables = mysql_cursor.fetchall()
-        return f"Database: {db_name}\nTables:\n" + "\n".join(f"- {table[0]}" for table in tables)
+        tables = get_mysql_catalog(db_name)["tables"]
+        return f"Database: {db_name}\nTables:\n" + "\n".join(f"- {table}" for table in tables)
     except Exception as e:
         return f"Error getting MySQL tables: {str(e)}"
 
 # Get MySQL columns for a table
 def get_mysql_columns(db_name, table_name):
-    if db_name == None and current_database != None:
-        db_name = current_database
+    if db_name == None and console_session.database != None:
+        db_name = console_session.database
     try:
-        mysql_cursor.execute(f"USE {db_name}")
-        mysql_cursor.execute(f"DESCRIBE {table_name}")
-        columns = mysql_cursor.fetchall()
+        table = get_mysql_catalog(db_name)["tables"].get(table_name)
+        if table is None:
+            return f"Error getting MySQL columns: Table '{db_name}.{table_name}' doesn't exist"
         return f"Table: {table_name}\nColumns:\n" + "\n".join(
-            f"- {column[0]} ({column[1]})" + 
-            (" NOT NULL" if column[2] == "NO" else "") +
-            (" PRIMARY KEY" if column[3] == "PRI" else "") +
-            (" AUTO_INCREMENT" if column[4] == "auto_increment" else "")
-            for column in columns
+            f"- {schema_catalog.format_column(column, table)}" for column in table["columns"]
         )
     except Exception as e:
         return f"Error getting MySQL columns: {str(e)}"
@@ -368,197 +752,254 @@ def get_mysql_columns(db_name, table_name):
 # Get MySQL sample row
 def get_mysql_sample(db_name, table_name):
     try:
-        mysql_cursor.execute(f"USE {db_name}")
-        mysql_cursor.execute(f"SELECT * FROM {table_name} LIMIT 1")
-        sample_row = mysql_cursor.fetchone()
-        if sample_row:
-            # Get column names
-            mysql_cursor.execute(f"SHOW COLUMNS FROM {table_name}")
-            columns = [column[0] for column in mysql_cursor.fetchall()]
-            # Create a dictionary of column names and values
-            sample_dict = dict(zip(columns, sample_row))
-            return f"Table: {table_name}\nSample Row:\n{json.dumps(sample_dict, indent=2)}"
+        table = get_mysql_catalog(db_name)["tables"].get(table_name)
+        if table is None:
+            return f"Error getting MySQL sample: Table '{db_name}.{table_name}' doesn't exist"
+        if table["sample"]:
+            return f"Table: {table_name}\nSample Row:\n{json.dumps(table['sample'], indent=2)}"
         else:
             return f"Table {table_name} is empty"
     except Exception as e:
         return f"Error getting MySQL sample: {str(e)}"
 
 # --- SQL & Mongo Setup ---
-mysql_conn = mysql.connector.connect(
-    host="localhost", ## change to your own host
-    user="tempuser", ## change to your own user
-    password="TestPass123!" ## change to your own password
-)
-mysql_cursor = mysql_conn.cursor()
+MYSQL_CONFIG = {
+    "host": "localhost", ## change to your own host
+    "user": "tempuser", ## change to your own user
+    "password": "TestPass123!", ## change to your own password
+}
 
-mongo_client = pymongo.MongoClient("mongodb://localhost:27017/") ## change to your own mongo client
+# MySQL client errors meaning the connection is gone (server gone away, lost
+# connection, lost connection during handshake)
+CONNECTION_LOST_ERRORS = (2006, 2013, 2055)
 
-# --- Initial state ---
-current_dbms = "sql"
-current_database = None
+MONGO_URI = "mongodb://localhost:27017/" ## change to your own mongo client
 
-def main():
-    global current_dbms, current_database
+# Pooled MySQL connections (opened on first use, health-checked on reuse)
+# and a MongoClient with a tuned pool, shared by every session. Nothing
+# connects at import; main() connects in the background.
+connections = connection_manager.ConnectionManager(MYSQL_CONFIG, MONGO_URI)
+mongo_client = None  # set to use another MongoClient-like object instead of connections'
 
-    print("Welcome to the DB Chatbot! Type 'exit' to quit.")
+def get_mongo_client():
+    return mongo_client if mongo_client is not None else connections.mongo_client
 
-    while True:
-        user_input = input(f"\nCurrent DBMS: {current_dbms} | Current Database: {current_database} | Your request: ")
-        command, target = interpret_user_input(user_input)
-
-        if command == "exit":
-            print("Goodbye!")
-            break
-
-        elif command == "list":
-            if current_dbms == "sql":
-                mysql_cursor.execute("SHOW DATABASES")
-                databases = mysql_cursor.fetchall()
-                print("Available SQL databases:")
-                for db in databases:
-                    print("-", db[0])
-            else:
-                print("Available MongoDB databases:")
-                for db in mongo_client.list_database_names():
-                    print("-", db)
-
-        elif command == "select":
-            current_database = target
-            if current_dbms == "sql":
-                try:
-                    mysql_cursor.execute(f"USE {current_database}")
-                    print(f"Switched to SQL database: {current_database}")
-                except Exception as e:
-                    print("Error selecting SQL database:", e)
-            else:
-                if target in mongo_client.list_database_names():
-                    print(f"Switched to MongoDB database: {target}")
-                else:
-                    print("MongoDB database not found.")
-
-        elif command == "switch":
-            if target.lower() == "sql":
-                current_dbms = "sql"
-                print("Switched to SQL.")
-                current_database = None
-            elif target.lower() == "mongodb":
-                current_dbms = "mongodb"
-                print("Switched to MongoDB.")
-                current_database = None
-            else:
-                print("Unknown DBMS to switch to.")
-
-        elif command == "schema":
-            if not current_database and target:
-                if current_dbms == "sql":
-                    try:
-                        mysql_cursor.execute(f"USE {target}")
-                        current_database = target
-                        print(f"Automatically switched to SQL database: {current_database}")
-                    except Exception as e:
-                        print("Error selecting SQL database:", e)
-                        continue
-                elif current_dbms == "mongodb":
-                    if target in mongo_client.list_database_names():
-                        current_database = target
-                        print(f"Automatically switched to MongoDB database: {current_database}")
-                    else:
-                        print("MongoDB database not found.")
-                        continue
-
-            if not current_database:
-                print("Please select a database first using the 'select' command.")
-                continue
-            
-            print(f"\nSchema for {current_database} ({current_dbms.upper()}):")
-            if current_dbms == "mongodb":
-                schema_info = get_mongodb_schema(current_database)
-            else:
-                schema_info = get_mysql_schema(current_database)
-            print(schema_info)
+# The interactive prompt's session: its own MySQL connection, DBMS and
+# selected database
+console_session = connections.session()
 
-        elif command == "query":
-            if not current_database:
-                print("Please select a database first using the 'select' command.")
-                continue
+# --- Command handlers ---
+# Each handler runs one command for a session and returns a response dict
+# whose "output" is the text to show the user. The console below and
+# chat_server.py both go through handle_input, so every session keeps its own
+# DBMS and database while sharing the schema, query and LLM caches.
 
-            generated_query = convert_to_query(target, "SQL" if current_dbms == "sql" else "MongoDB")
-            print(f"\nGenerated {current_dbms.upper()} Query:\n{generated_query}")
+NO_DATABASE_MESSAGE = "Please select a database first using the 'select' command."
+NO_TABLE_MESSAGE = "Please specify a table/collection name."
 
-            results, error = execute_query(generated_query, current_dbms)
-            
-            if error:
-                print(f"\nFailed to execute query after 3 attempts. Last error: {error}")
-            else:
-                if results:
-                    if isinstance(results, dict) and "message" in results:
-                        print(results["message"])
-                    else:
-                        for row in results:
-                            print(row)
-                else:
-                    print("Query executed successfully but returned no results.")
-
-        elif command == "schema_tables":
-            if not current_database and target:
-                if current_dbms == "sql":
-                    try:
-                        mysql_cursor.execute(f"USE {target}")
-                        current_database = target
-                        print(f"Automatically switched to SQL database: {current_database}")
-                    except Exception as e:
-                        print("Error selecting SQL database:", e)
-                        continue
-                elif current_dbms == "mongodb":
-                    if target in mongo_client.list_database_names():
-                        current_database = target
-                        print(f"Automatically switched to MongoDB database: {current_database}")
-                    else:
-                        print("MongoDB database not found.")
-                        continue
-
-            if not current_database:
-                print("Please select a database first using the 'select' command.")
-                continue
-            
-            print(f"\nTables/Collections in {current_database} ({current_dbms.upper()}):")
-            if current_dbms == "mongodb":
-                print(get_mongodb_tables(current_database))
-            else:
-                print(get_mysql_tables(current_database))
+def handle_exit(session, target):
+    return {"output": "Goodbye!"}
 
-        elif command == "schema_columns":
-            if not current_database:
-                print("Please select a database first using the 'select' command.")
-                continue
-            
-            if not target:
-                print("Please specify a table/collection name.")
-                continue
-            
-            print(f"\nColumns/Attributes for {target} in {current_database} ({current_dbms.upper()}):")
-            if current_dbms == "mongodb":
-                print(get_mongodb_columns(current_database, target))
-            else:
-                print(get_mysql_columns(current_database, target))
+def handle_list(session, target):
+    title = "Available SQL databases:" if session.dbms == "sql" else "Available MongoDB databases:"
+    return {"output": "\n".join([title] + [f"- {db}" for db in fetch_database_names(session.dbms)])}
 
-        elif command == "schema_sample":
-            if not current_database:
-                print("Please select a database first using the 'select' command.")
-                continue
-            
-            if not target:
-                print("Please specify a table/collection name.")
-                continue
-            
-            print(f"\nSample row from {target} in {current_database} ({current_dbms.upper()}):")
-            if current_dbms == "mongodb":
-                print(get_mongodb_sample(current_database, target))
-            else:
-                print(get_mysql_sample(current_database, target))
+def handle_select(session, target):
+    if session.dbms == "sql":
+        try:
+            session.use(target)
+            return {"output": f"Switched to SQL database: {target}"}
+        except Exception as e:
+            return {"output": f"Error selecting SQL database: {e}"}
+    if target in get_mongo_client().list_database_names():
+        session.use(target)
+        return {"output": f"Switched to MongoDB database: {target}"}
+    return {"output": "MongoDB database not found."}
+
+def handle_switch(session, target):
+    dbms = (target or "").lower()
+    if dbms not in ("sql", "mongodb"):
+        return {"output": "Unknown DBMS to switch to."}
+    session.dbms, session.database = dbms, None
+    return {"output": "Switched to SQL." if dbms == "sql" else "Switched to MongoDB."}
+
+# Schema commands may name a database; select it if none is selected yet.
+# Returns the lines to show and whether a database is now selected
+def _select_for_schema(session, target):
+    if not session.database and target:
+        if session.dbms == "sql":
+            try:
+                session.use(target)
+            except Exception as e:
+                return [f"Error selecting SQL database: {e}"], False
+            return [f"Automatically switched to SQL database: {target}"], True
+        if target not in get_mongo_client().list_database_names():
+            return ["MongoDB database not found."], False
+        session.use(target)
+        return [f"Automatically switched to MongoDB database: {target}"], True
+    if not session.database:
+        return [NO_DATABASE_MESSAGE], False
+    return [], True
+
+def handle_schema(session, target):
+    lines, selected = _select_for_schema(session, target)
+    if selected:
+        lines.append(f"\nSchema for {session.database} ({session.dbms.upper()}):")
+        if session.dbms == "mongodb":
+            lines.append(get_mongodb_schema(session.database))
+        else:
+            lines.append(get_mysql_schema(session.database))
+    return {"output": "\n".join(lines)}
+
+def handle_schema_tables(session, target):
+    lines, selected = _select_for_schema(session, target)
+    if selected:
+        lines.append(f"\nTables/Collections in {session.database} ({session.dbms.upper()}):")
+        if session.dbms == "mongodb":
+            lines.append(get_mongodb_tables(session.database))
+        else:
+            lines.append(get_mysql_tables(session.database))
+    return {"output": "\n".join(lines)}
+
+def handle_schema_columns(session, target):
+    if not session.database:
+        return {"output": NO_DATABASE_MESSAGE}
+    if not target:
+        return {"output": NO_TABLE_MESSAGE}
+    header = f"\nColumns/Attributes for {target} in {session.database} ({session.dbms.upper()}):"
+    if session.dbms == "mongodb":
+        return {"output": header + "\n" + get_mongodb_columns(session.database, target)}
+    return {"output": header + "\n" + get_mysql_columns(session.database, target)}
+
+def handle_schema_sample(session, target):
+    if not session.database:
+        return {"output": NO_DATABASE_MESSAGE}
+    if not target:
+        return {"output": NO_TABLE_MESSAGE}
+    header = f"\nSample row from {target} in {session.database} ({session.dbms.upper()}):"
+    if session.dbms == "mongodb":
+        return {"output": header + "\n" + get_mongodb_sample(session.database, target)}
+    return {"output": header + "\n" + get_mysql_sample(session.database, target)}
+
+def handle_unknown(session, target):
+    return {"output": "Sorry, I couldn't understand what you meant. Try commands like 'list databases', 'switch to MongoDB', or ask a query."}
+
+# Generate (or fetch from the cache) the query for a question. The response
+# carries the query; run_query executes it, so callers can show the query
+# before it runs
+def prepare_query(session, question, fused_query=None):
+    if not session.database:
+        return {"output": NO_DATABASE_MESSAGE}
+    query, fingerprint, cached = generate_query(question, session.dbms, session.database, fused_query)
+    return {
+        "query": query,
+        "fingerprint": fingerprint,
+        "cached": cached,
+        "output": f"\n{'Cached' if cached else 'Generated'} {session.dbms.upper()} Query:\n{query}",
+    }
+
+# Execute a prepared query. Adds "results" (a row stream, a {"message": ...}
+# dict or a plain value), "error" and the "final_query" after any repairs
+def run_query(session, response):
+    results, error, final_query = execute_query(response["query"], session.dbms, session=session)
+    record_query_outcome(response["target"], session.dbms, session.database, response["fingerprint"], final_query, error)
+    response.update(results=results, error=error, final_query=final_query)
+    return response
+
+COMMAND_HANDLERS = {
+    "exit": handle_exit,
+    "list": handle_list,
+    "select": handle_select,
+    "switch": handle_switch,
+    "schema": handle_schema,
+    "schema_tables": handle_schema_tables,
+    "schema_columns": handle_schema_columns,
+    "schema_sample": handle_schema_sample,
+    "unknown": handle_unknown,
+}
+
+# Commands that need the session's database server
+DATABASE_COMMANDS = {"list", "select", "schema", "schema_tables", "schema_columns", "schema_sample", "query"}
+
+def unreachable_message(dbms, error):
+    name, other = ("MySQL", "MongoDB") if dbms == "sql" else ("MongoDB", "MySQL")
+    return f"{name} is not reachable ({error}). Switch to {other} or try again later."
+
+# Interpret one line of input for a session and run the command it names.
+# Queries are only prepared; see run_query. Commands for a server that
+# cannot be reached answer with an error instead of waiting on it again.
+def handle_input(session, user_input):
+    if FUSED_MODE:
+        command, target, fused_query = interpret_and_convert(user_input, session=session)
+    else:
+        command, target = interpret_user_input(user_input, session=session)
+        fused_query = None
+    response = {"command": command, "target": target}
+    if command in DATABASE_COMMANDS:
+        error = connections.unreachable_error(session.dbms)
+        if error:
+            response["output"] = unreachable_message(session.dbms, error)
+            return response
+    try:
+        if command == "query":
+            response.update(prepare_query(session, target, fused_query))
+        else:
+            response.update(COMMAND_HANDLERS.get(command, handle_unknown)(session, target))
+    except Exception as e:
+        if not connection_manager.is_unreachable(e):
+            raise
+        connections.mark_unreachable(session.dbms, e)
+        response["output"] = unreachable_message(session.dbms, e)
+    return response
+
+def print_results(response, started_at, dbms):
+    results, error = response["results"], response["error"]
+    if error:
+        print(f"\nFailed to execute query after 3 attempts. Last error: {error}")
+    elif isinstance(results, dict) and "message" in results:
+        print(results["message"])
+    elif isinstance(results, (list, tuple)) or hasattr(results, "__next__"):
+        stats = result_stream.render_rows(results, started_at)
+        metrics.record_rows(stats["rows"], dbms)
+    elif results:
+        print(results)
+    else:
+        print("Query executed successfully but returned no results.")
+
+# Ask before running a query the cost guard considers very expensive
+def confirm_expensive_query(decision):
+    answer = input(f"\nThis query is estimated to examine {decision['estimated_rows']:,} rows. Run it anyway? [y/N] ")
+    return answer.strip().lower() in ("y", "yes")
 
-        elif command == "unknown":
-            print("Sorry, I couldn't understand what you meant. Try commands like 'list databases', 'switch to MongoDB', or ask a query.")
+def main():
+    print("Welcome to the DB Chatbot! Type 'exit' to quit.")
+    # The prompt shows while the drivers load and the servers are reached
+    connections.connect_in_background()
+    metrics.start()
+    cost_guard.confirm = confirm_expensive_query
+
+    while True:
+        user_input = input(f"\nCurrent DBMS: {console_session.dbms} | Current Database: {console_session.database} | Your request: ")
+        with metrics.request() as request:
+            response = handle_input(console_session, user_input)
+            request["command"] = response["command"]
+
+            if response["command"] == "exit":
+                print(intent_classifier.summary())
+                print(query_cache.summary())
+                print(result_cache.summary())
+                print(llm.summary())
+                print(connections.summary())
+                console_session.close()
+                connections.close()
+                print(response["output"])
+                break
+
+            print(response["output"])
+            if "query" in response:
+                started_at = time.perf_counter()
+                run_query(console_session, response)
+                print_results(response, started_at, console_session.dbms)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import re
+import threading
+import time
+
+# How long (in seconds) a loaded schema stays valid before it is fetched again
+SCHEMA_CACHE_TTL = 300
+
+# (dbms, database) -> (loaded_at, value)
+_cache = {}
+_cache_lock = threading.Lock()
+
+DDL_PATTERN = re.compile(r"^\s*(CREATE|ALTER|DROP|RENAME|TRUNCATE)\b", re.IGNORECASE)
+
+# All columns, keys and types of a database in a single round trip
+MYSQL_CATALOG_QUERY = """
+SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY, c.EXTRA,
+       k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME, t.TABLE_ROWS
+FROM information_schema.COLUMNS c
+JOIN information_schema.TABLES t
+  ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+LEFT JOIN information_schema.KEY_COLUMN_USAGE k
+  ON k.TABLE_SCHEMA = c.TABLE_SCHEMA AND k.TABLE_NAME = c.TABLE_NAME
+ AND k.COLUMN_NAME = c.COLUMN_NAME AND k.REFERENCED_TABLE_NAME IS NOT NULL
+WHERE c.TABLE_SCHEMA = %s
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+
+# Return the cached value for key, calling loader() when missing or expired
+def get_cached(key, loader, ttl=None):
+    ttl = SCHEMA_CACHE_TTL if ttl is None else ttl
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry and time.time() - entry[0] < ttl:
+        return entry[1]
+    value = loader()
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+    return value
+
+
+# Put an already built value into the cache
+def store(key, value):
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+
+
+# Get the catalog for a database, loading it on a miss
+def get_catalog(dbms, db_name, loader, ttl=None):
+    return get_cached((dbms, db_name), loader, ttl)
+
+
+# Drop cached catalogs; with no arguments everything is dropped
+def invalidate(dbms=None, db_name=None):
+    with _cache_lock:
+        for key in list(_cache):
+            if dbms is not None and key[0] != dbms:
+                continue
+            if db_name is not None and key[1] != db_name:
+                continue
+            del _cache[key]
+
+
+def is_ddl(query):
+    return isinstance(query, str) and bool(DDL_PATTERN.match(query))
+
+
+def _new_table():
+    return {"columns": [], "foreign_keys": [], "row_count": None, "sample": None}
+
+
+# Load the full catalog of a MySQL database: one information_schema query for
+# columns/keys/types and one UNION query for a sample row of every table
+def load_mysql_catalog(cursor, db_name):
+    cursor.execute(MYSQL_CATALOG_QUERY, (db_name,))
+    tables = {}
+    for row in cursor.fetchall():
+        table_name, column_name, column_type, nullable, key, extra, ref_table, ref_column, table_rows = row
+        table = tables.setdefault(table_name, _new_table())
+        if isinstance(column_type, bytes):
+            column_type = column_type.decode()
+        table["row_count"] = table_rows
+        # A column in several keys (the primary key and a foreign key, or two
+        # foreign keys) comes back once per key
+        if ref_table:
+            foreign_key = {"column": column_name, "ref_table": ref_table, "ref_column": ref_column}
+            if foreign_key not in table["foreign_keys"]:
+                table["foreign_keys"].append(foreign_key)
+        if any(column["name"] == column_name for column in table["columns"]):
+            continue
+        table["columns"].append({
+            "name": column_name,
+            "type": column_type,
+            "nullable": nullable == "YES",
+            "key": key,
+            "extra": extra,
+        })
+
+    _load_mysql_samples(cursor, db_name, tables)
+    return {"dbms": "sql", "database": db_name, "tables": tables}
+
+
+def _identifier(name):
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _string(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def _load_mysql_samples(cursor, db_name, tables):
+    parts = []
+    for table_name, table in tables.items():
+        pairs = ", ".join(f"{_string(column['name'])}, {_identifier(column['name'])}" for column in table["columns"])
+        parts.append(
+            f"SELECT {_string(table_name)}, "
+            f"(SELECT JSON_OBJECT({pairs}) FROM {_identifier(db_name)}.{_identifier(table_name)} LIMIT 1)"
+        )
+    if not parts:
+        return
+    cursor.execute(" UNION ALL ".join(parts))
+    for table_name, sample in cursor.fetchall():
+        if sample is None:
+            continue
+        if isinstance(sample, (bytes, bytearray)):
+            sample = sample.decode()
+        sample = json.loads(sample) if isinstance(sample, str) else sample
+        # JSON_OBJECT does not keep column order
+        order = [column["name"] for column in tables[table_name]["columns"]]
+        tables[table_name]["sample"] = {name: sample.get(name) for name in order}
+
+
+# Format one column the way DESCRIBE output used to be shown. With the table
+# given, composite keys and foreign key references are spelled out so the
+# LLM can join and filter on indexed columns.
+def format_column(column, table=None):
+    text = f"{column['name']} ({column['type']})"
+    if not column["nullable"]:
+        text += " NOT NULL"
+    primary_key = [c["name"] for c in table["columns"] if c["key"] == "PRI"] if table else [column["name"]]
+    if column["key"] == "PRI":
+        if len(primary_key) > 1:
+            text += f" PART OF PRIMARY KEY ({', '.join(primary_key)})"
+        else:
+            text += " PRIMARY KEY"
+    elif column["key"] == "UNI":
+        text += " UNIQUE"
+    elif column["key"] == "MUL":
+        text += " INDEXED"
+    for fk in table["foreign_keys"] if table else []:
+        if fk["column"] == column["name"]:
+            text += f" REFERENCES {fk['ref_table']}({fk['ref_column']})"
+    if column["extra"] == "auto_increment":
+        text += " AUTO_INCREMENT"
+    return text
+
+
+# Stable hash of the tables, columns and types of a catalog; sample rows and
+# row counts are left out so data changes do not alter it
+def fingerprint(catalog):
+    parts = []
+    for table_name in sorted(catalog["tables"]):
+        columns = catalog["tables"][table_name]["columns"]
+        parts.append(table_name + "(" + ",".join(f"{column['name']}:{column['type']}" for column in columns) + ")")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+# Load the catalog of a SQLite database in the same shape as
+# load_mysql_catalog; used by the offline benchmark stand-in
+def load_sqlite_catalog(conn, db_name):
+    tables = {}
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+    for table_name in names:
+        table = tables.setdefault(table_name, _new_table())
+        for _, name, column_type, notnull, _, pk in conn.execute(f'PRAGMA table_info("{table_name}")'):
+            table["columns"].append({
+                "name": name,
+                "type": column_type.lower() or "text",
+                "nullable": not notnull,
+                "key": "PRI" if pk else "",
+                "extra": "",
+            })
+        indexed = set()
+        for index in conn.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+            first = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchone()
+            if first:
+                indexed.add(first[2])
+        for column in table["columns"]:
+            if not column["key"] and column["name"] in indexed:
+                column["key"] = "MUL"
+        for row in conn.execute(f'PRAGMA foreign_key_list("{table_name}")'):
+            table["foreign_keys"].append({"column": row[3], "ref_table": row[2], "ref_column": row[4]})
+        table["row_count"] = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+        cursor = conn.execute(f'SELECT * FROM "{table_name}" LIMIT 1')
+        row = cursor.fetchone()
+        if row:
+            table["sample"] = dict(zip([column[0] for column in cursor.description], row))
+    return {"dbms": "sql", "database": db_name, "tables": tables}
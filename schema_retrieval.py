@@ -0,0 +1,208 @@
+import json
+import math
+import re
+from collections import Counter
+
+import mongo_schema
+import schema_catalog
+
+# Pick the part of a database's schema a question needs, so prompts stay
+# small on wide databases. Every table is indexed by the tokens of its name,
+# its column names and its sample values; a question's tokens score the
+# tables (rarer tokens count more), the best RETRIEVAL_TOP_K are kept along
+# with the tables they join to, and the result is written one compact line
+# per table until RETRIEVAL_TOKEN_BUDGET is reached.
+
+SCHEMA_RETRIEVAL_ENABLED = True
+RETRIEVAL_TOP_K = 3  # best-scoring tables kept per question
+RETRIEVAL_MIN_SCORE = 0.5  # ... when they score at least this share of the best table
+RETRIEVAL_TOKEN_BUDGET = 1200  # estimated tokens of schema text per prompt
+CHARS_PER_TOKEN = 4  # rough estimate of prompt tokens
+SAMPLE_VALUE_CHARS = 30  # sample values are cut to this length
+
+# How much a question token matching each part of a table counts
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.5
+SAMPLE_VALUE_WEIGHT = 0.5
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "each", "for", "from", "have", "has",
+    "how", "in", "is", "it", "its", "many", "me", "most", "of", "on", "or", "per", "show", "than", "that", "the",
+    "their", "there", "to", "was", "were", "what", "which", "who", "with", "all", "every", "give", "find", "get",
+    "id", "list", "top", "number", "total", "average", "count", "sum",
+}
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+# Crude singular form, so "stores" matches "store" and "categories" "category"
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    words = WORD.findall(re.sub(r"([a-z])([A-Z])", r"\1 \2", str(text)).lower())
+    return [_stem(word) for word in words if word not in STOP_WORDS and not word.isdigit()]
+
+
+def _sample_values(sample):
+    if isinstance(sample, dict):
+        for value in sample.values():
+            yield from _sample_values(value)
+    elif isinstance(sample, list):
+        for value in sample:
+            yield from _sample_values(value)
+    elif isinstance(sample, str):
+        yield sample
+
+
+# Collections without declared foreign keys are linked through their <name>_id
+# fields: work.artist_id refers to artist, orders.store_id to stores
+def _inferred_references(tables):
+    owners = {_stem(name.lower()): name for name in tables}
+    references = []
+    for name, table in tables.items():
+        for column in table["columns"]:
+            field = column["name"].rsplit(".", 1)[-1].replace("[]", "").lower()
+            if field.endswith("_id") and field != "_id":
+                owner = owners.get(_stem(field[:-3]))
+                if owner and owner != name:
+                    references.append((name, owner))
+    return references
+
+
+# Token weights of every table and the tables each one joins to
+def build_index(catalog):
+    tables = catalog["tables"]
+    weights = {}
+    for name, table in tables.items():
+        tokens = Counter()
+        for token in tokenize(" ".join(_sample_values(table.get("sample")))):
+            tokens[token] = max(tokens[token], SAMPLE_VALUE_WEIGHT)
+        for column in table["columns"]:
+            for token in tokenize(column["name"]):
+                tokens[token] = max(tokens[token], COLUMN_NAME_WEIGHT)
+        for token in tokenize(name):
+            tokens[token] = TABLE_NAME_WEIGHT
+        weights[name] = tokens
+
+    references = [(name, fk["ref_table"]) for name, table in tables.items() for fk in table["foreign_keys"]]
+    if not references:
+        references = _inferred_references(tables)
+    neighbours = {name: set() for name in tables}
+    for name, ref_table in references:
+        if ref_table in tables and ref_table != name:
+            neighbours[name].add(ref_table)
+            neighbours[ref_table].add(name)
+
+    frequency = Counter(token for tokens in weights.values() for token in tokens)
+    idf = {token: math.log(1 + len(tables) / count) for token, count in frequency.items()}
+    return {"weights": weights, "idf": idf, "neighbours": neighbours}
+
+
+# Indexes are cached with the catalogs and keyed by the schema fingerprint, so
+# a changed schema is indexed again
+def get_index(catalog):
+    key = (catalog["dbms"], catalog["database"], "retrieval", schema_catalog.fingerprint(catalog))
+    return schema_catalog.get_cached(key, lambda: build_index(catalog))
+
+
+def score_tables(catalog, question):
+    index = get_index(catalog)
+    tokens = set(tokenize(question))
+    scores = {}
+    for name, weights in index["weights"].items():
+        score = sum(weights[token] * index["idf"][token] for token in tokens if token in weights)
+        if score > 0:
+            scores[name] = score
+    return scores
+
+
+# Tables for a question, most relevant first: the top RETRIEVAL_TOP_K and
+# then the tables they join to. Returns (chosen, linked); every table is
+# chosen when nothing matched.
+def select_tables(catalog, question, top_k=None):
+    top_k = RETRIEVAL_TOP_K if top_k is None else top_k
+    scores = score_tables(catalog, question)
+    if not scores:
+        return list(catalog["tables"]), []
+    ranked = sorted(scores, key=lambda name: -scores[name])
+    best = scores[ranked[0]]
+    chosen = [name for name in ranked[:top_k] if scores[name] >= best * RETRIEVAL_MIN_SCORE]
+    neighbours = get_index(catalog)["neighbours"]
+    linked = {neighbour for name in chosen for neighbour in neighbours[name]} - set(chosen)
+    return chosen, sorted(linked, key=lambda name: (-scores.get(name, 0), name))
+
+
+def _short(value):
+    if isinstance(value, dict):
+        return {key: _short(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_short(item) for item in value[:3]]
+    if isinstance(value, str) and len(value) > SAMPLE_VALUE_CHARS:
+        return value[:SAMPLE_VALUE_CHARS] + "..."
+    return value
+
+
+def _column_text(column, table):
+    text = f"{column['name']} {column['type']}"
+    if column["key"] == "PRI":
+        text += " PK"
+    elif column["key"] in ("UNI", "MUL"):
+        text += " indexed"
+    for fk in table["foreign_keys"]:
+        if fk["column"] == column["name"]:
+            text += f" -> {fk['ref_table']}.{fk['ref_column']}"
+    return text
+
+
+# One table on one line (plus its sample on a second line when with_sample)
+def format_table(name, table, dbms, with_sample=True):
+    if dbms == "sql":
+        columns = ", ".join(_column_text(column, table) for column in table["columns"])
+        size = f"{table['row_count']} rows" if table["row_count"] is not None else ""
+    else:
+        columns = ", ".join(mongo_schema.format_field(column) for column in table["columns"])
+        size = f"{table['row_count']} documents"
+    text = f"{name} ({size}): {columns}" if size else f"{name}: {columns}"
+    if table.get("embedded"):
+        text += f"\n  {mongo_schema.format_embedded(table)}"
+    if with_sample and table["sample"]:
+        sample = json.dumps(_short(table["sample"]), default=str, separators=(",", ":"))
+        text += f"\n  e.g. {sample}"
+    return text
+
+
+# Schema text for a question's prompt: the selected tables within budget
+# (samples are dropped before tables are), then the names of the rest.
+# Linked tables are there for their join keys and come without samples.
+# Returns the text and the tables it describes.
+def relevant_schema(catalog, question, budget=None):
+    budget = RETRIEVAL_TOKEN_BUDGET if budget is None else budget
+    tables = catalog["tables"]
+    dbms = catalog["dbms"]
+    kind = "Tables" if dbms == "sql" else "Collections"
+    lines, shown = [], []
+    used = estimate_tokens(f"Database: {catalog['database']}")
+    chosen, linked = select_tables(catalog, question)
+    for name in chosen + linked:
+        text = format_table(name, tables[name], dbms, with_sample=name in chosen)
+        if used + estimate_tokens(text) > budget:
+            text = format_table(name, tables[name], dbms, with_sample=False)
+        if used + estimate_tokens(text) > budget and shown:
+            continue
+        lines.append(text)
+        shown.append(name)
+        used += estimate_tokens(text)
+    header = f"Database: {catalog['database']}\n{kind} relevant to the question:"
+    others = [name for name in tables if name not in shown]
+    if others:
+        lines.append(f"Other {kind.lower()}: " + ", ".join(others))
+    return header + "\n" + "\n".join(lines), shown
@@ -0,0 +1,115 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup time of the interactive interface. Every run starts a fresh
+# interpreter, as a user would, and measures the time to import the module,
+# the time until the prompt shows and the time until "exit" returns. Nothing
+# needs to be reachable: with MySQL and MongoDB down the prompt must still
+# show, and the run reports what the user would see.
+
+STARTUP_SCRIPT = "run_full_interface_with_error_correction.py"
+STARTUP_MODULE = "run_full_interface_with_error_correction"
+STARTUP_RUNS = 10
+STARTUP_PROMPT = b"Your request:"
+STARTUP_TIMEOUT = 60  # seconds a run may take before it counts as hung
+# Modules whose import time is reported separately
+STARTUP_HEAVY_MODULES = ["mysql.connector", "pymongo", "sqlglot", "google.genai", "pandas"]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def child_env():
+    # Gemini is never called; replay keeps the run offline if it were
+    return dict(os.environ, CHATDB_LLM_BACKEND="replay", PYTHONDONTWRITEBYTECODE="1")
+
+
+# Seconds to import module in a fresh interpreter, and the heavy modules it
+# pulled in
+def time_import(module):
+    code = (
+        "import sys, time\n"
+        "started_at = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - started_at)\n"
+        f"print(','.join(name for name in {STARTUP_HEAVY_MODULES!r} if name in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, env=child_env(),
+                            timeout=STARTUP_TIMEOUT, check=True).stdout.decode().splitlines()
+    return float(output[0]), [name for name in output[1].split(",") if name]
+
+
+# Seconds until the prompt shows and until "exit" has returned, plus what the
+# session printed
+def time_session(script):
+    started_at = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=child_env())
+    output = b""
+    try:
+        while STARTUP_PROMPT not in output:
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError(f"{script} exited before showing the prompt:\n{output.decode()}")
+            output += chunk
+        prompt_at = time.perf_counter() - started_at
+        rest, _ = process.communicate(b"exit\n", timeout=STARTUP_TIMEOUT)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    return prompt_at, time.perf_counter() - started_at, (output + rest).decode()
+
+
+# Cumulative import time (ms) of the slowest modules the interface imports
+def slowest_imports(module, count=8):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                            env=child_env(), timeout=STARTUP_TIMEOUT, check=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        # Only the modules imported directly by the interface and its own modules
+        if len(parts[2]) - len(parts[2].lstrip()) <= 3:
+            times[name] = int(parts[1]) / 1000
+    return sorted(times.items(), key=lambda pair: -pair[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the chat interface")
+    parser.add_argument("--runs", type=int, default=STARTUP_RUNS)
+    parser.add_argument("--script", default=STARTUP_SCRIPT)
+    parser.add_argument("--module", default=STARTUP_MODULE)
+    args = parser.parse_args()
+
+    imports, prompts, sessions = [], [], []
+    heavy, transcript = [], ""
+    for _ in range(args.runs):
+        seconds, heavy = time_import(args.module)
+        imports.append(seconds)
+        prompt_at, finished_at, transcript = time_session(args.script)
+        prompts.append(prompt_at)
+        sessions.append(finished_at)
+
+    print(f"{args.runs} run(s) of {args.script}")
+    print(f"{'stage':<18} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}")
+    for stage, values in (("import", imports), ("prompt shown", prompts), ("exit returned", sessions)):
+        print(f"{stage:<18} {percentile(values, 50) * 1000:>10.1f} {percentile(values, 95) * 1000:>10.1f} "
+              f"{statistics.mean(values) * 1000:>10.1f}")
+    print(f"heavy modules loaded by import: {', '.join(heavy) or 'none'}")
+    print("slowest imports (cumulative ms):")
+    for name, ms in slowest_imports(args.module):
+        print(f"  {name:<40} {ms:>8.1f}")
+    print("\nLast session's output:")
+    print(transcript.strip())
+
+
+if __name__ == "__main__":
+    main()